@@ -100,6 +100,12 @@ class WindowsService(win32serviceutil.ServiceFramework):
 				except pywintypes, msg:
 					pass
 			service.logger.debug("New python exe: %r" % getPythonBin())
+		try:
+			return self.run(configuration)
+		finally:
+			service.shutdownLogging(service.logger)
+			
+	def run(self, configuration):
 		# start the service
 		s = service.Service(configuration)
 		try:
@@ -760,6 +760,11 @@ class ElementTree(object):
         if method == "text":
             _serialize_text(write, self._root, encoding)
         else:
+            if method == "xml" and not default_namespace:
+                data = _serialize_xml_fast(self._root, encoding)
+                if data is not None:
+                    write("".join(data))
+                    return
             qnames, namespaces = _namespaces(
                 self._root, encoding, default_namespace
                 )
@@ -893,6 +898,67 @@ def _serialize_xml(write, elem, encoding, qnames, namespaces):
     if elem.tail:
         write(_escape_cdata(elem.tail, encoding))
 
+##
+# (Internal) Serializes a tree made of plain tags, attributes and text
+# without recursion and without the _namespaces pass, caching the encoded
+# tag and attribute names.  The output is the same as _serialize_xml.
+#
+# @return A list of encoded fragments, or None if the tree needs the
+#     generic serializer (namespaces, QName, comments, processing
+#     instructions or None tags).
+
+def _serialize_xml_fast(elem, encoding):
+    data = []
+    write = data.append
+    names = {}
+    stack = [elem]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        elem = pop()
+        if type(elem) is tuple:
+            # end tag and tail of an element whose children are written
+            write(elem[0])
+            continue
+        tag = elem.tag
+        try:
+            start = names[tag]
+        except (KeyError, TypeError):
+            if not isinstance(tag, basestring) or tag[:1] == "{":
+                return None
+            start = names[tag] = tag.encode(encoding)
+        write("<" + start)
+        items = elem.items()
+        if items:
+            items.sort() # lexical order
+            for k, v in items:
+                try:
+                    key = names[k]
+                except (KeyError, TypeError):
+                    if not isinstance(k, basestring) or k[:1] == "{":
+                        return None
+                    key = names[k] = k.encode(encoding)
+                if isinstance(v, QName):
+                    return None
+                write(" %s=\"%s\"" % (key, _escape_attrib(v, encoding)))
+        text = elem.text
+        children = elem[:]
+        if text or children:
+            write(">")
+            if text:
+                write(_escape_cdata(text, encoding))
+            if elem.tail:
+                push(("</" + start + ">" + _escape_cdata(elem.tail, encoding),))
+            else:
+                push(("</" + start + ">",))
+            children.reverse()
+            stack.extend(children)
+        else:
+            write(" />")
+            if elem.tail:
+                write(_escape_cdata(elem.tail, encoding))
+    return data
+
 HTML_EMPTY = ("area", "base", "basefont", "br", "col", "frame", "hr",
               "img", "input", "isindex", "link", "meta" "param")
 
@@ -1076,6 +1142,16 @@ def tostring(element, encoding=None, method=None):
 # @defreturn sequence
 # @since 1.3
 
+##
+# (Internal) Same as tostring, always using the generic serializer.
+
+def _generic_tostring(element, encoding=None):
+    data = []
+    encoding = encoding or "us-ascii"
+    qnames, namespaces = _namespaces(element, encoding)
+    _serialize_xml(data.append, element, encoding, qnames, namespaces)
+    return "".join(data)
+
 def tostringlist(element, encoding=None):
     class dummy:
         pass
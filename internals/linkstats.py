@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# ExtraControl - Aruba Cloud Computing ExtraControl
+# Copyright (C) 2012 Aruba S.p.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import argparse
+from elementtree.ElementTree import Element, SubElement, tostring
+from tools import *
+
+def camelCase(name):
+	words = name.split('_')
+	return words[0] + ''.join([w.capitalize() for w in words[1:]])
+
+def main():
+	parser = argparse.ArgumentParser(add_help=False, prog='linkstats')
+	parser.add_argument("-h", "--help", help="show this help", dest="help", action="store_true", default=False)
+	args = parser.parse_args()
+	
+	if args.help:
+		parser.print_help()
+		return 0
+		
+	# saved by the service with the command metrics, counters start from zero when the service starts
+	link = Metrics.load(getMetricsFileName()).link
+	top = Element('linkstats')
+	for name, value in link.values():
+		SubElement(top, camelCase(name)).text = str(value)
+	print tostring(top)
+	return 0
+	
+if __name__ == "__main__":
+	sys.exit(main())
@@ -19,9 +19,42 @@
 
 import sys
 import argparse
-from elementtree.ElementTree import Element, tostring
+from elementtree.ElementTree import Element, SubElement, tostring
 from tools import *
 
+def cacheCommand(args):
+	cache = ArtifactCache()
+	
+	if args.action == "purge":
+		beforeFileUpdate()
+		try:
+			if args.sha256 == None:
+				cache.purge()
+			else:
+				try:
+					found = cache.remove(args.sha256)
+				except ValueError, msg:
+					print msg
+					return 1
+				if not found:
+					print 'artifact not found'
+					return 1
+		finally:
+			afterFileUpdate()
+		print 'Done'
+		return 0
+	
+	top = Element('artifacts')
+	for entry in cache.entries():
+		a = SubElement(top, 'artifact')
+		SubElement(a, 'sha256').text = entry['sha256']
+		SubElement(a, 'size').text = str(entry['size'])
+		SubElement(a, 'lastUsed').text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used']))
+		for url in entry['urls']:
+			SubElement(a, 'url').text = url
+	print tostring(top)
+	return 0
+
 def main():
 	parser = argparse.ArgumentParser(add_help=False, prog='modulemng')
 	subparsers = parser.add_subparsers(title='subcommands', help='valid subcommands', dest="sub_command")
@@ -29,6 +62,9 @@ def main():
 	get.add_argument("module", help="module", default=None)
 	list = subparsers.add_parser('list')
 	list.add_argument("-d", help="module details", dest="details", action="store_true", default=False)
+	cache = subparsers.add_parser('cache')
+	cache.add_argument("action", help="list or purge the downloaded artifacts", choices=['list', 'purge'])
+	cache.add_argument("sha256", help="artifact to purge (default: all)", nargs='?', default=None)
 	help = subparsers.add_parser('help')
 	args = parser.parse_args()
 	
@@ -36,6 +72,9 @@ def main():
 		parser.print_help()
 		return 0
 
+	if args.sub_command == "cache":
+		return cacheCommand(args)
+
 	# retrieve all modules from file system
 	top = Element('modules')
 	
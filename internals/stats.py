@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# ExtraControl - Aruba Cloud Computing ExtraControl
+# Copyright (C) 2012 Aruba S.p.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import argparse
+from elementtree.ElementTree import Element, SubElement, tostring
+from tools import *
+
+QUANTILES = ((0.5, 'p50'), (0.9, 'p90'), (0.99, 'p99'))
+
+def histogramElement(parent, tag, h, format):
+	e = SubElement(parent, tag)
+	SubElement(e, 'count').text = str(h.count)
+	SubElement(e, 'mean').text = format % (h.sum / max(h.count, 1))
+	for q, name in QUANTILES:
+		SubElement(e, name).text = format % (h.quantile(q) or 0)
+	SubElement(e, 'max').text = format % h.max
+	return e
+
+def main():
+	parser = argparse.ArgumentParser(add_help=False, prog='stats')
+	parser.add_argument("module", help="show only this module", nargs='?', default=None)
+	parser.add_argument("--prometheus", help="print the metrics in the Prometheus text format", action="store_true", default=False)
+	parser.add_argument("-h", "--help", help="show this help", dest="help", action="store_true", default=False)
+	args = parser.parse_args()
+	
+	if args.help:
+		parser.print_help()
+		return 0
+		
+	# saved by the service every few seconds, the running command is not there yet
+	metrics = Metrics.load(getMetricsFileName())
+	
+	if args.prometheus:
+		sys.stdout.write(metrics.toString())
+		return 0
+		
+	top = Element('stats')
+	modules = {}
+	for module, phase, h in metrics.phases():
+		if args.module != None and module != args.module: continue
+		if module not in modules:
+			m = modules[module] = SubElement(top, 'module', name=module)
+			items = metrics.commands.items()
+			items.sort()
+			for (name, result), count in items:
+				if name == module:
+					SubElement(m, 'commands', result=result).text = str(count)
+			output = metrics.histograms.get((Metrics.OUTPUT, (module,)))
+			if output != None:
+				histogramElement(m, 'output', output, '%d')
+		histogramElement(modules[module], 'phase', h, '%.3f').set('name', phase)
+	print tostring(top)
+	return 0
+	
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# ExtraControl - Aruba Cloud Computing ExtraControl
+# Copyright (C) 2012 Aruba S.p.A.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import argparse
+from tools import *
+
+def main():
+	parser = argparse.ArgumentParser(add_help=False, prog='wiretrace')
+	subparsers = parser.add_subparsers(title='subcommands', help='valid subcommands', dest="sub_command")
+	on = subparsers.add_parser('on')
+	on.add_argument("rate", help="dump one serial read/write every RATE (default: %(default)s)", type=int, nargs='?', default=1)
+	off = subparsers.add_parser('off')
+	status = subparsers.add_parser('status')
+	help = subparsers.add_parser('help')
+	args = parser.parse_args()
+	
+	if args.sub_command == "help":
+		parser.print_help()
+		return 0
+		
+	path = getWireTraceFileName()
+	
+	if args.sub_command == "status":
+		try:
+			print 'on %s' % open(path).read().strip()
+		except IOError:
+			print 'off'
+		return 0
+		
+	# the service checks the file periodically, no restart is needed
+	beforeFileUpdate()
+	try:
+		if args.sub_command == "on":
+			if args.rate < 1:
+				print 'rate must be a positive number'
+				return 1
+			open(path, 'w').write("%d\n" % args.rate)
+		elif os.path.exists(path):
+			os.remove(path)
+	finally:
+		afterFileUpdate()
+		
+	print 'Done'
+	return 0
+	
+if __name__ == "__main__":
+	sys.exit(main())
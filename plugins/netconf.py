@@ -26,7 +26,7 @@ import struct
 import tempfile
 import time
 from tools import *
-from elementtree.ElementTree import Element, SubElement, tostring
+from elementtree.ElementTree import Element, SubElement, tostring, iterparse
 
 WIN32_ADAPTER_TYPES = [0]
 
@@ -786,58 +786,6 @@ INSERT INTO network_alias
 
 # pfSense support code
 
-# dumps network config as a list of <key>=<value> lines, associating
-# gateways with the main interfaces and listing aliases in a format
-# similar to "normal" addresses
-PFSENSE_READ = """
-<?php
-require_once('functions.inc');
-require_once('globals.inc');
-require_once('config.inc');
-
-$config = parse_config();
-
-foreach ($config['interfaces'] as $name => $iface) {
-	echo "name=$name\n";
-	echo "device={$iface['if']}:0\n";
-	echo "ip={$iface['ipaddr']}\n";
-	echo "subnet={$iface['subnet']}\n";
-	if (array_key_exists('enable', $iface)) {
-		echo "enabled=True\n";
-	} else {
-		echo "enabled=False\n";
-	}
-
-	if ($config['gateways']) {
-		foreach ($config['gateways'] as $iface_gw) {
-			foreach ($iface_gw as $gw) {
-				if ($gw['interface'] == $name) {
-					echo "gateway={$gw['gateway']}\n";
-				}
-			}
-		}
-	}
-
-	$count = 1;
-
-	if ($config['virtualip']) {
-		foreach ($config['virtualip'] as $iface_vip) {
-			foreach ($iface_vip as $vip) {
-				if ($vip['interface'] == $name && $vip['type'] == 'single') {
-					echo "name=$name\n";
-					echo "device={$iface['if']}:$count\n";
-					echo "ip={$vip['subnet']}\n";
-					echo "subnet={$vip['subnet_bits']}\n";
-				}
-			}
-		}
-	}
-
-	echo "\n";
-}
-?>
-"""
-
 PFSENSE_WRITE = """
 <?php
 require_once('functions.inc');
@@ -960,22 +908,86 @@ def runPHP(code):
 	return subprocessCheckOutput(['php', '-q', script.name])
 
 
-def pfsenseGetNetworkCfg():
-	result = []
-	config = runPHP(PFSENSE_READ)
+# config.xml sections needed to list the network configuration, the
+# rest of the file is discarded while parsing
+PFSENSE_SECTIONS = ('interfaces', 'gateways', 'virtualip')
 
-	for line in config.split('\n'):
-		if not line:
-			continue
 
-		key, value = line.split('=', 1)
+def pfsenseParseConfig(path):
+	sections = dict((s, None) for s in PFSENSE_SECTIONS)
+	source = open(path, 'rb')
+	depth = 0
+	root = None
 
-		if key == 'name':
-			result.append({'gateway': None})
-		elif key == 'subnet' and value:
-			result[-1]['netmask'] = makeNetmask(int(value))
-		else:
-			result[-1][key] = value
+	try:
+		for event, elem in iterparse(source, events=('start', 'end')):
+			if event == 'start':
+				if root is None:
+					root = elem
+				depth += 1
+				continue
+
+			depth -= 1
+			if depth != 1:
+				continue
+
+			if elem.tag in sections:
+				sections[elem.tag] = elem
+				if None not in sections.values():
+					break
+
+			# drop top level sections as soon as they are complete
+			root.clear()
+	finally:
+		source.close()
+
+	return sections
+
+
+def pfsenseItems(section):
+	if section is None:
+		return []
+
+	return list(section)
+
+
+def pfsenseGetNetworkCfg(path=PFSENSE_CONFIG):
+	result = []
+	sections = pfsenseParseConfig(path)
+
+	for iface in pfsenseItems(sections['interfaces']):
+		name = iface.tag
+		device = iface.findtext('if', '')
+		config = {
+			'device': '%s:0' % device,
+			'ip': iface.findtext('ipaddr', ''),
+			'enabled': str(iface.find('enable') is not None),
+			'gateway': None,
+		}
+		subnet = iface.findtext('subnet', '')
+		if subnet:
+			config['netmask'] = makeNetmask(int(subnet))
+
+		for gw in pfsenseItems(sections['gateways']):
+			if gw.findtext('interface') == name:
+				config['gateway'] = gw.findtext('gateway', '')
+
+		result.append(config)
+
+		# every alias is reported as device:1, like the PHP code that used
+		# to read config.xml did
+		for vip in pfsenseItems(sections['virtualip']):
+			if vip.findtext('interface') == name and vip.findtext('type') == 'single':
+				config = {
+					'device': '%s:1' % device,
+					'ip': vip.findtext('subnet', ''),
+					'gateway': None,
+				}
+				subnet = vip.findtext('subnet_bits', '')
+				if subnet:
+					config['netmask'] = makeNetmask(int(subnet))
+
+				result.append(config)
 
 	return [r for r in result if r['ip'] and r['ip'] != 'dhcp']
 
@@ -45,7 +45,7 @@ def main():
 	beforeFileUpdate()
 
 	try:
-		os.remove(m.fullPath())
+		removeModule(m.fullPath())
 	except OSError, oe:
 		afterFileUpdate()
 		print oe
@@ -19,15 +19,52 @@
 
 import sys
 import argparse
+import httplib
 from tools import *
 import os
 
+def update(m, v, new_module, sha256):
+	if new_module.lower().startswith('http'):
+		print "Downloading:", new_module
+		try:
+			filename, headers = ArtifactCache().download(new_module, sha256=sha256)
+			new_module = filename
+		except (EnvironmentError, ValueError, httplib.HTTPException), msg:
+			# DownloadError, a bad URL or an unexpected reply of the server
+			print "Error: %s" % msg
+			return 1
+		print '\nDownloaded:', filename
+		if headers != None:
+			print 'Headers:\n', headers
+	else:
+		if not os.path.exists(new_module):
+			print "Update file not found"
+			return 1
+		try:
+			checkSHA256(new_module, sha256)
+		except IOError, msg:
+			print "Error: %s" % msg
+			return 1
+		
+	update_dir = getPluginsUpdateDirectory()
+
+	try:
+		os.mkdir(update_dir)
+	except OSError, msg:
+		pass
+	update_path = os.path.join(update_dir, m.nameWithExtension())
+	copyModule(new_module, update_path, version=v, blocking=m.isBlocking())
+		
+	print 'Done'
+	return 0
+
 def main():
 	parser = argparse.ArgumentParser(add_help=True, prog='updateModule')
 	parser.add_argument("module", help="module")
 	parser.add_argument("version", help="new module version")
 	parser.add_argument("new_module", help="path to new module binary", nargs='+')
 	parser.add_argument("--force", help="force update (ignore the version)", action='store_const', default=False, const=True)
+	parser.add_argument("--sha256", help="expected SHA-256 hex digest of the new module", default=None)
 	args = parser.parse_args()
 	
 	m = moduleFromNameAndType(args.module, MODULE_PLUGINS)
@@ -46,50 +83,12 @@ def main():
 			print "Current module version is same or newer"
 			return 1
 			
-	new_module = args.new_module[0]
-
-	if new_module.lower().startswith('http'):
-		def logTransfer(count, block, size):
-			pass
-		print "Downloading:", new_module
-		try:
-			filename, headers = urllib.urlretrieve(new_module, reporthook=logTransfer)
-			new_module = filename
-		except IOError, msg:
-			print "Error: %s" % msg
-			return 1
-		except:
-			print "File too short"
-			return 1
-		print '\nDownloaded:', filename
-		print 'Headers:\n', headers
-	else:
-		if not os.path.exists(new_module):
-			print "Update file not found"
-			return 1
-		
-	update_dir = getPluginsUpdateDirectory()
-		
+	# download and installation share a single writable file system window
 	beforeFileUpdate()
-
 	try:
-		os.mkdir(update_dir)
-	except OSError, msg:
-		pass
-	update_path = os.path.join(update_dir, m.nameWithExtension())
-	try:
-		os.remove(update_path)
-	except OSError:
-		pass
-	copyModule(new_module, update_path)
-	open(update_path + EXTENSION_VERSION, "w").write("%r" % v)
-	if m.isBlocking():
-		open(update_path + EXTENSION_BLOCKING, "w").write("")
-
-	afterFileUpdate()
-		
-	print 'Done'
-	return 0
+		return update(m, v, args.new_module[0], args.sha256)
+	finally:
+		afterFileUpdate()
 	
 	
 if __name__ == "__main__":
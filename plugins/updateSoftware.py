@@ -19,10 +19,10 @@
 
 import sys
 import argparse
+import httplib
 from tools import *
 import os
 import subprocess
-import urllib
 import logging
 
 # Enable writing on some file systems
@@ -41,6 +41,7 @@ def main():
 	parser.add_argument("version", help="new software version")
 	parser.add_argument("installer", help="path to installer binary", nargs='+')
 	parser.add_argument("--force", help="force update (ignore the version)", action='store_const', default=False, const=True)
+	parser.add_argument("--sha256", help="expected SHA-256 hex digest of the installer", default=None)
 	args = parser.parse_args()
 		
 	v= float(args.version)
@@ -52,24 +53,26 @@ def main():
 	installer = args.installer[0]
 
 	if installer.lower().startswith('http'):
-		def logTransfer(count, block, size):
-			pass
 		logger.info("Downloading: %r" % installer)
 		try:
-			filename, headers = urllib.urlretrieve(installer, reporthook=logTransfer)
+			filename, headers = ArtifactCache().download(installer, sha256=args.sha256, logger=logger)
 			installer = filename
-		except IOError, msg:
+		except (EnvironmentError, ValueError, httplib.HTTPException), msg:
+			# DownloadError, a bad URL or an unexpected reply of the server
 			logger.error("%s" % msg)
 			return 1
-		except:
-			logger.error("File too short")
-			return 1
 		logger.info("Downloaded: %r" % filename)
-		logger.debug('Headers:\n%s' % headers)
+		if headers != None:
+			logger.debug('Headers:\n%s' % headers)
 	else:
 		if not os.path.exists(installer):
 			logger.error("Update file not found")
 			return 1
+		try:
+			checkSHA256(installer, args.sha256)
+		except IOError, msg:
+			logger.error("%s" % msg)
+			return 1
 		
 	# we execute the installer and leave any problems to him
 	try:
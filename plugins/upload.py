@@ -19,68 +19,74 @@
 
 import sys
 import argparse
+import httplib
 from tools import *
 import os
 
-def main():
-	parser = argparse.ArgumentParser(add_help=True, prog='upload')
-	subparsers = parser.add_subparsers(title='subcommands', help='valid subcommands', dest="sub_command")
-	
-	usermodule = subparsers.add_parser('usermodule')
-	usermodule.add_argument("module", help="module name")
-	usermodule.add_argument("new_module", help="path to module", nargs="+")
-	
-	help = subparsers.add_parser('help')
-	args = parser.parse_args()
-	
-	if args.sub_command == 'help':
-		usermodule.print_help()
-		return 0
-
-	m = moduleFromNameAndType(args.module, MODULE_CUSTOMS)
-	
-	if m != None:
-		print "Module already exists"
-		return 1
-		
-	new_module = args.new_module[0]
-	
+def upload(name, new_module, sha256):
 	if new_module.lower().startswith('http'):
-		def logTransfer(count, block, size):
-			pass
 		print "Downloading:", new_module
 		try:
-			filename, headers = urllib.urlretrieve(new_module, reporthook=logTransfer)
+			filename, headers = ArtifactCache().download(new_module, sha256=sha256)
 			new_module = filename
-		except IOError, msg:
+		except (EnvironmentError, ValueError, httplib.HTTPException), msg:
+			# DownloadError, a bad URL or an unexpected reply of the server
 			print "Error: %s" % msg
 			return 1
-		except:
-			print "File too short"
-			return 1
 		print '\nDownloaded:', filename
-		print 'Headers:\n', headers
+		if headers != None:
+			print 'Headers:\n', headers
 	else:
 		if not os.path.exists(new_module):
 			print "Update file not found"
 			return 1
+		try:
+			checkSHA256(new_module, sha256)
+		except IOError, msg:
+			print "Error: %s" % msg
+			return 1
 	
 	custom_dir = getCustomDirectory()
-
-	beforeFileUpdate()
 		
 	try:
 		os.mkdir(custom_dir)
 	except OSError, msg:
 		pass
 
-	update_path = os.path.join(custom_dir, args.module)
+	update_path = os.path.join(custom_dir, name)
 	copyModule(new_module, update_path)
 
-	afterFileUpdate()
-
 	print 'Done'
 	return 0
+
+def main():
+	parser = argparse.ArgumentParser(add_help=True, prog='upload')
+	subparsers = parser.add_subparsers(title='subcommands', help='valid subcommands', dest="sub_command")
+	
+	usermodule = subparsers.add_parser('usermodule')
+	usermodule.add_argument("module", help="module name")
+	usermodule.add_argument("new_module", help="path to module", nargs="+")
+	usermodule.add_argument("--sha256", help="expected SHA-256 hex digest of the module", default=None)
+	
+	help = subparsers.add_parser('help')
+	args = parser.parse_args()
+	
+	if args.sub_command == 'help':
+		usermodule.print_help()
+		return 0
+
+	m = moduleFromNameAndType(args.module, MODULE_CUSTOMS)
+	
+	if m != None:
+		print "Module already exists"
+		return 1
+		
+	# download and installation share a single writable file system window
+	beforeFileUpdate()
+	try:
+		return upload(args.module, args.new_module[0], args.sha256)
+	finally:
+		afterFileUpdate()
 	
 if __name__ == "__main__":
 	sys.exit(main())
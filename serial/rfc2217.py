@@ -64,7 +64,6 @@ import time
 import struct
 import socket
 import threading
-import Queue
 import logging
 
 # port string is expected to be something like this:
@@ -375,9 +374,11 @@ class RFC2217Serial(SerialBase):
 
         self._socket.settimeout(5) # XXX good value?
 
-        # use a thread save queue as buffer. it also simplifies implementing
-        # the read timeout
-        self._read_buffer = Queue.Queue()
+        # received data, appended by the reader thread in whole runs and
+        # taken by read() in slices. the condition guards it and wakes up
+        # the readers waiting for data
+        self._read_buffer = bytearray()
+        self._read_condition = threading.Condition()
         # to ensure that user writes does not interfere with internal
         # telnet/rfc2217 options establish a lock
         self._write_lock = threading.Lock()
@@ -550,22 +551,49 @@ class RFC2217Serial(SerialBase):
     def inWaiting(self):
         """Return the number of characters currently in the input buffer."""
         if not self._isOpen: raise portNotOpenError
-        return self._read_buffer.qsize()
+        return len(self._read_buffer)
+
+    def _takeReadBuffer(self, wanted, size, timeout):
+        """internal - wait up to timeout seconds (forever when None) for
+        wanted bytes in the read buffer, then remove and return up to size
+        bytes from it"""
+        if timeout is not None:
+            timeout = time.time() + timeout
+        self._read_condition.acquire()
+        try:
+            while len(self._read_buffer) < wanted:
+                if self._thread is None:
+                    if self._read_buffer:
+                        break
+                    raise SerialException('connection failed (reader thread died)')
+                if timeout is None:
+                    self._read_condition.wait()
+                else:
+                    left = timeout - time.time()
+                    if left <= 0:
+                        break
+                    self._read_condition.wait(left)
+            data = bytes(self._read_buffer[:size])
+            del self._read_buffer[:size]
+        finally:
+            self._read_condition.release()
+        return data
 
     def read(self, size=1):
         """Read size bytes from the serial port. If a timeout is set it may
         return less characters as requested. With no timeout it will block
         until the requested number of bytes is read."""
         if not self._isOpen: raise portNotOpenError
-        data = bytearray()
-        try:
-            while len(data) < size:
-                if self._thread is None:
-                    raise SerialException('connection failed (reader thread died)')
-                data.append(self._read_buffer.get(True, self._timeout))
-        except Queue.Empty: # -> timeout
-            pass
-        return bytes(data)
+        return self._takeReadBuffer(size, size, self._timeout)
+
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+        Waits at most timeout seconds (the port timeout when None) for the
+        first byte."""
+        if not self._isOpen: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        return self._takeReadBuffer(1, size, timeout)
 
     def write(self, data):
         """Output the given string over the serial port. Can block if the
@@ -587,8 +615,11 @@ class RFC2217Serial(SerialBase):
         if not self._isOpen: raise portNotOpenError
         self.rfc2217SendPurge(PURGE_RECEIVE_BUFFER)
         # empty read buffer
-        while self._read_buffer.qsize():
-            self._read_buffer.get(False)
+        self._read_condition.acquire()
+        try:
+            del self._read_buffer[:]
+        finally:
+            self._read_condition.release()
 
     def flushOutput(self):
         """Clear output buffer, aborting the current output and
@@ -667,7 +698,7 @@ class RFC2217Serial(SerialBase):
         try:
             while self._socket is not None:
                 try:
-                    data = self._socket.recv(1024)
+                    data = self._socket.recv(65536)
                 except socket.timeout:
                     # just need to get out of recv form time to time to check if
                     # still alive
@@ -678,26 +709,35 @@ class RFC2217Serial(SerialBase):
                         self.logger.debug("socket error in reader thread: %s" % (e,))
                     break
                 if not data: break # lost connection
-                for byte in data:
+                # data for the read buffer, stored at once after the chunk
+                received = []
+                i = 0
+                while i < len(data):
                     if mode == M_NORMAL:
-                        # interpret as command or as data
-                        if byte == IAC:
+                        # everything up to the next IAC is data: store it in
+                        # the read buffer or sub option buffer depending on
+                        # state
+                        end = data.find(IAC, i)
+                        if end < 0:
+                            end = len(data)
+                        if suboption is not None:
+                            suboption.extend(data[i:end])
+                        elif end > i:
+                            received.append(data[i:end])
+                        if end < len(data):
                             mode = M_IAC_SEEN
-                        else:
-                            # store data in read buffer or sub option buffer
-                            # depending on state
-                            if suboption is not None:
-                                suboption.append(byte)
-                            else:
-                                self._read_buffer.put(byte)
-                    elif mode == M_IAC_SEEN:
+                        i = end + 1
+                        continue
+                    byte = data[i]
+                    i += 1
+                    if mode == M_IAC_SEEN:
                         if byte == IAC:
                             # interpret as command doubled -> insert character
                             # itself
                             if suboption is not None:
                                 suboption.append(IAC)
                             else:
-                                self._read_buffer.put(IAC)
+                                received.append(IAC)
                             mode = M_NORMAL
                         elif byte == SB:
                             # sub option start
@@ -719,8 +759,21 @@ class RFC2217Serial(SerialBase):
                     elif mode == M_NEGOTIATE: # DO, DONT, WILL, WONT was received, option now following
                         self._telnetNegotiateOption(telnet_command, byte)
                         mode = M_NORMAL
+                if received:
+                    self._read_condition.acquire()
+                    try:
+                        self._read_buffer.extend(''.join(received))
+                        self._read_condition.notifyAll()
+                    finally:
+                        self._read_condition.release()
         finally:
             self._thread = None
+            # wake up the readers waiting for data
+            self._read_condition.acquire()
+            try:
+                self._read_condition.notifyAll()
+            finally:
+                self._read_condition.release()
             if self.logger:
                 self.logger.debug("read thread terminated")
 
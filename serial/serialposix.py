@@ -256,6 +256,11 @@ TIOCM_DTR_str = struct.pack('I', TIOCM_DTR)
 TIOCSBRK  = hasattr(TERMIOS, 'TIOCSBRK') and TERMIOS.TIOCSBRK or 0x5427
 TIOCCBRK  = hasattr(TERMIOS, 'TIOCCBRK') and TERMIOS.TIOCCBRK or 0x5428
 
+# read() goes through a buffer kept by the port, allocated with at least
+# READ_BUFFER_SIZE bytes; reads bigger than READ_BUFFER_MAX get their own
+READ_BUFFER_SIZE = 64 * 1024
+READ_BUFFER_MAX = 1024 * 1024
+
 
 class PosixSerial(SerialBase):
     """Serial port class POSIX implementation. Serial port configuration is 
@@ -277,6 +282,10 @@ class PosixSerial(SerialBase):
             self.fd = None
             raise SerialException("could not open port %s: %s" % (self._port, msg))
         #~ fcntl.fcntl(self.fd, FCNTL.F_SETFL, 0)  # set blocking
+        # os.read allocates a new string per call, FileIO reads into buffers
+        import io
+        self._fileio = io.FileIO(self.fd, 'r', closefd=False)
+        self._read_buffer = None
 
         try:
             self._reconfigurePort()
@@ -422,6 +431,8 @@ class PosixSerial(SerialBase):
             if self.fd is not None:
                 os.close(self.fd)
                 self.fd = None
+                self._fileio = None
+                self._read_buffer = None
             self._isOpen = False
 
     def makeDeviceName(self, port):
@@ -435,14 +446,36 @@ class PosixSerial(SerialBase):
         s = fcntl.ioctl(self.fd, TIOCINQ, TIOCM_zero_str)
         return struct.unpack('I',s)[0]
 
-    # select based implementation, proved to work on many systems
+    def _readBuffer(self, size):
+        """internal - writable memoryview of size bytes for read()"""
+        if size > READ_BUFFER_MAX:
+            return memoryview(bytearray(size))
+        if self._read_buffer is None or len(self._read_buffer) < size:
+            self._read_buffer = bytearray(max(size, READ_BUFFER_SIZE))
+        return memoryview(self._read_buffer)[:size]
+
     def read(self, size=1):
         """Read size bytes from the serial port. If a timeout is set it may
            return less characters as requested. With no timeout it will block
            until the requested number of bytes is read."""
         if not self._isOpen: raise portNotOpenError
-        read = bytearray()
-        while len(read) < size:
+        view = self._readBuffer(size)
+        return view[:self.readinto(view)].tobytes()
+
+    # select based implementation, proved to work on many systems
+    def readinto(self, b):
+        """Read len(b) bytes from the serial port into the writable buffer b,
+           with the timeout handling of read(). Return the number of bytes
+           read."""
+        if not self._isOpen: raise portNotOpenError
+        try:
+            view = memoryview(b)
+        except TypeError:
+            # array.array of Python 2 has no memoryview
+            return SerialBase.readinto(self, b)
+        size = len(view)
+        n = 0
+        while n < size:
             ready,_,_ = select.select([self.fd],[],[], self._timeout)
             # If select was used with a timeout, and the timeout occurs, it
             # returns with empty lists -> thus abort read operation.
@@ -450,22 +483,46 @@ class PosixSerial(SerialBase):
             # is nothing to read.
             if not ready:
                 break   # timeout
-            buf = os.read(self.fd, size-len(read))
+            got = self._fileio.readinto(view[n:])
+            if got is None:
+                continue    # EAGAIN
             # read should always return some data as select reported it was
             # ready to read when we get to this point.
-            if not buf:
+            if not got:
                 # Disconnected devices, at least on Linux, show the
                 # behavior that they are always ready to read immediately
                 # but reading returns nothing.
                 raise SerialException('device reports readiness to read but returned no data (device disconnected?)')
-            read.extend(buf)
-        return bytes(read)
+            n += got
+        return n
+
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+           Waits at most timeout seconds (the port timeout when None) for
+           the first byte, then reads what the driver has buffered into
+           the reused read buffer: the port is non-blocking, one readinto
+           returns it all without asking its size."""
+        if not self._isOpen: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        ready,_,_ = select.select([self.fd],[],[], timeout)
+        if not ready:
+            return bytes()
+        view = self._readBuffer(size)
+        got = self._fileio.readinto(view)
+        if got is None:
+            return bytes()  # EAGAIN
+        if not got:
+            # see read()
+            raise SerialException('device reports readiness to read but returned no data (device disconnected?)')
+        return view[:got].tobytes()
 
     def write(self, data):
         """Output the given string over the serial port."""
         if not self._isOpen: raise portNotOpenError
         t = len(data)
-        d = data
+        # slicing a memoryview does not copy the data left to write
+        d = memoryview(data)
         if self._writeTimeout is not None and self._writeTimeout > 0:
             timeout = time.time() + self._writeTimeout
         else:
@@ -605,29 +662,36 @@ class PosixPollSerial(Serial):
     however this one has better handling of errors, such as a device
     disconnecting while it's in use (e.g. USB-serial unplugged)"""
 
-    def read(self, size=1):
-        """Read size bytes from the serial port. If a timeout is set it may
-           return less characters as requested. With no timeout it will block
-           until the requested number of bytes is read."""
+    def readinto(self, b):
+        """Read len(b) bytes from the serial port into the writable buffer b,
+           with the timeout handling of read(). Return the number of bytes
+           read."""
         if self.fd is None: raise portNotOpenError
-        read = bytearray()
+        try:
+            view = memoryview(b)
+        except TypeError:
+            # array.array of Python 2 has no memoryview
+            return SerialBase.readinto(self, b)
+        size = len(view)
+        n = 0
         poll = select.poll()
         poll.register(self.fd, select.POLLIN|select.POLLERR|select.POLLHUP|select.POLLNVAL)
         if size > 0:
-            while len(read) < size:
-                # print "\tread(): size",size, "have", len(read)    #debug
+            while n < size:
+                # print "\tread(): size",size, "have", n    #debug
                 # wait until device becomes ready to read (or something fails)
                 for fd, event in poll.poll(self._timeout*1000):
                     if event & (select.POLLERR|select.POLLHUP|select.POLLNVAL):
                         raise SerialException('device reports error (poll)')
                     #  we don't care if it is select.POLLIN or timeout, that's
                     #  handled below
-                buf = os.read(self.fd, size - len(read))
-                read.extend(buf)
+                # None when nothing is ready (EAGAIN)
+                got = self._fileio.readinto(view[n:]) or 0
+                n += got
                 if ((self._timeout is not None and self._timeout >= 0) or 
-                    (self._interCharTimeout is not None and self._interCharTimeout > 0)) and not buf:
+                    (self._interCharTimeout is not None and self._interCharTimeout > 0)) and not got:
                     break   # early abort on timeout
-        return bytes(read)
+        return n
 
 
 if __name__ == '__main__':
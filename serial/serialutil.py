@@ -515,6 +515,26 @@ class SerialBase(object):
             b[:n] = array.array('b', data)
         return n
 
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+           Unlike read() it does not wait for size bytes or for the line to
+           be silent: it waits at most timeout seconds (the port timeout
+           when None) for the first byte. This generic version polls
+           inWaiting(), the ports that can wait on the device override it
+           (posix, win32, socket://, rfc2217://, loop://)."""
+        import time
+        if timeout is None:
+            timeout = self._timeout
+        if timeout is not None:
+            timeout = time.time() + timeout
+        while True:
+            n = self.inWaiting()
+            if n:
+                return self.read(min(n, size))
+            if timeout is not None and time.time() >= timeout:
+                return bytes()
+            time.sleep(0.005)
+
 
 if __name__ == '__main__':
     import sys
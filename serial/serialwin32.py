@@ -109,6 +109,8 @@ class Win32Serial(SerialBase):
         else:
             timeouts = timeouts[:-2] + (0, int(self._writeTimeout*1000))
         win32.SetCommTimeouts(self.hComPort, ctypes.byref(win32.COMMTIMEOUTS(*timeouts)))
+        # read_available() changes the read timeouts, read() restores them
+        self._timeouts = self._setTimeouts = timeouts
 
         win32.SetCommMask(self.hComPort, win32.EV_ERR)
 
@@ -219,6 +221,7 @@ class Win32Serial(SerialBase):
            return less characters as requested. With no timeout it will block
            until the requested number of bytes is read."""
         if not self.hComPort: raise portNotOpenError
+        self._applyTimeouts(self._timeouts)
         if size > 0:
             win32.ResetEvent(self._overlappedRead.hEvent)
             flags = win32.DWORD()
@@ -249,6 +252,46 @@ class Win32Serial(SerialBase):
             read = bytes()
         return bytes(read)
 
+    def _applyTimeouts(self, timeouts):
+        """internal - set the COMMTIMEOUTS when they are not the current
+        ones"""
+        if timeouts != self._setTimeouts:
+            win32.SetCommTimeouts(self.hComPort, ctypes.byref(win32.COMMTIMEOUTS(*timeouts)))
+            self._setTimeouts = timeouts
+
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+           Waits at most timeout seconds (the port timeout when None) for
+           the first byte. The overlapped ReadFile blocks in the driver:
+           with ReadIntervalTimeout and ReadTotalTimeoutMultiplier set to
+           MAXDWORD it completes with the bytes received as soon as there
+           is one, or empty after ReadTotalTimeoutConstant."""
+        if not self.hComPort: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        if timeout is None:
+            # MAXDWORD is not allowed there, the read is repeated instead
+            constant = win32.MAXDWORD - 1
+        else:
+            constant = int(timeout * 1000)
+        if constant == 0:
+            # return immediately with what is in the buffer
+            timeouts = (win32.MAXDWORD, 0, 0)
+        else:
+            timeouts = (win32.MAXDWORD, win32.MAXDWORD, constant)
+        self._applyTimeouts(timeouts + self._timeouts[3:])
+        buf = ctypes.create_string_buffer(size)
+        rc = win32.DWORD()
+        while True:
+            win32.ResetEvent(self._overlappedRead.hEvent)
+            err = win32.ReadFile(self.hComPort, buf, size, ctypes.byref(rc), ctypes.byref(self._overlappedRead))
+            if not err and win32.GetLastError() != win32.ERROR_IO_PENDING:
+                raise SerialException("ReadFile failed (%s)" % ctypes.WinError())
+            if not win32.GetOverlappedResult(self.hComPort, ctypes.byref(self._overlappedRead), ctypes.byref(rc), True):
+                raise SerialException("GetOverlappedResult failed (%s)" % ctypes.WinError())
+            if rc.value or timeout is not None:
+                return buf.raw[:rc.value]
+
     def write(self, data):
         """Output the given string over the serial port."""
         if not self.hComPort: raise portNotOpenError
@@ -191,7 +191,48 @@ this module running...
 """ % (sys.platform, os.name, serial.VERSION))
     raise ImportError("Sorry: no implementation for your platform ('%s') available" % (os.name,))
 
+# channels of a virtual machine to its hypervisor, they are much faster than an
+# emulated serial port. udev links the virtio-serial ports named by the
+# hypervisor in VIRTIO_PORTS_DIR, VSOCK_DEVICE exists when the guest has vsock
+VIRTIO_PORTS_DIR = '/dev/virtio-ports'
+VSOCK_DEVICE = '/dev/vsock'
+# context identifier of the hypervisor
+VMADDR_CID_HOST = 2
+
+def virtio_ports():
+    """\
+    Scan for virtio-serial ports, return a list of tuples like comports():
+    virtio:// URL, port name and the path of the character device.
+    """
+    devices = glob.glob(os.path.join(VIRTIO_PORTS_DIR, '*'))
+    return [('virtio://%s' % (os.path.basename(d),), os.path.basename(d), os.path.realpath(d))
+            for d in devices]
+
+def vsock_ports(port):
+    """\
+    Return the vsock:// URL of port on the hypervisor as a list of tuples
+    like comports(), empty when the guest has no vsock.
+    """
+    if not os.path.exists(VSOCK_DEVICE):
+        return []
+    url = 'vsock://%d:%d' % (VMADDR_CID_HOST, port)
+    return [(url, 'vsock port %d of the host' % (port,), 'VSOCK CID=%d PORT=%d' % (VMADDR_CID_HOST, port))]
+
+def channels(vsock_port=None, virtio_name=None):
+    """\
+    Probe the channels to the hypervisor, return a list of tuples like
+    comports(), fastest first: the vsock port vsock_port of the host then
+    the virtio-serial port named virtio_name. Either is skipped when None.
+    The serial ports are not listed, they are the slowest channel.
+    """
+    found = []
+    if vsock_port is not None:
+        found.extend(vsock_ports(vsock_port))
+    if virtio_name is not None:
+        found.extend([c for c in virtio_ports() if c[1] == virtio_name])
+    return found
+
 # test
 if __name__ == '__main__':
-    for port, desc, hwid in sorted(comports()):
+    for port, desc, hwid in sorted(comports()) + virtio_ports():
         print "%s: %s [%s]" % (port, desc, hwid)
@@ -139,6 +139,26 @@ class LoopbackSerial(SerialBase):
                 break
         return bytes(data)
 
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+        Waits at most timeout seconds (the port timeout when None) for the
+        first byte."""
+        if not self._isOpen: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        if timeout is not None:
+            timeout = time.time() + timeout
+        while True:
+            self.buffer_lock.acquire()
+            try:
+                block = to_bytes(self.loop_buffer[:size])
+                del self.loop_buffer[:size]
+            finally:
+                self.buffer_lock.release()
+            if block or (timeout is not None and time.time() >= timeout):
+                return block
+            time.sleep(0.001)
+
     def write(self, data):
         """Output the given string over the serial port. Can block if the
         connection is blocked. May raise SerialException if the connection is
@@ -15,10 +15,12 @@
 #
 # URL format:    socket://<host>:<port>[/option[/option...]]
 # options:
-# - "debug" print diagnostic messages
+# - "logging=<level>" print diagnostic messages
+# - "rcvbuf=<bytes>", "sndbuf=<bytes>" size of the socket buffers
 
 from serial.serialutil import *
 import time
+import select
 import socket
 import logging
 
@@ -30,6 +32,9 @@ LOGGER_LEVELS = {
     'error': logging.ERROR,
     }
 
+# bytes asked to each recv, the data is kept in the port until read
+RECV_SIZE = 64 * 1024
+
 
 class SocketSerial(SerialBase):
     """Serial port implementation for plain sockets."""
@@ -41,20 +46,22 @@ class SocketSerial(SerialBase):
         """Open port with current settings. This may throw a SerialException
            if the port cannot be opened."""
         self.logger = None
+        self._socket_options = []
         if self._port is None:
             raise SerialException("Port must be configured before it can be used.")
         if self._isOpen:
             raise SerialException("Port is already open.")
         try:
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socket.connect(self.fromURL(self.portstr))
+            self._socket = None
+            self._connect(self.fromURL(self.portstr))
         except Exception, msg:
+            if self._socket is not None:
+                self._socket.close()
             self._socket = None
             raise SerialException("Could not open port %s: %s" % (self.portstr, msg))
+        # received data not read yet
+        self._read_buffer = bytearray()
 
-        self._socket.settimeout(2) # used for write timeout support :/
-
-        # not that there anything to configure...
         self._reconfigurePort()
         # all things set up get, now a clean start
         self._isOpen = True
@@ -64,11 +71,25 @@ class SocketSerial(SerialBase):
         self.flushInput()
         self.flushOutput()
 
+    def _connect(self, address):
+        """internal - create self._socket and connect it to the address
+        returned by fromURL()"""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # small packets must not wait for the ACK of the previous ones
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # buffer sizes are set before connecting, so that they are used
+        # for the TCP window
+        for option, value in self._socket_options:
+            self._socket.setsockopt(socket.SOL_SOCKET, option, value)
+        self._socket.connect(address)
+
     def _reconfigurePort(self):
         """Set communication parameters on opened port. for the socket://
-        protocol all settings are ignored!"""
+        protocol all settings but the write timeout are ignored!"""
         if self._socket is None:
             raise SerialException("Can only operate on open ports")
+        # reads wait with select, the socket timeout only limits writes
+        self._socket.settimeout(self._writeTimeout)
         if self.logger:
             self.logger.info('ignored port configuration change')
 
@@ -98,19 +119,7 @@ class SocketSerial(SerialBase):
             if '/' in url:
                 # cut away options
                 url, options = url.split('/', 1)
-                # process options now, directly altering self
-                for option in options.split('/'):
-                    if '=' in option:
-                        option, value = option.split('=', 1)
-                    else:
-                        value = None
-                    if option == 'logging':
-                        logging.basicConfig()   # XXX is that good to call it here?
-                        self.logger = logging.getLogger('pySerial.socket')
-                        self.logger.setLevel(LOGGER_LEVELS[value])
-                        self.logger.debug('enabled logging')
-                    else:
-                        raise ValueError('unknown option: %r' % (option,))
+                self._parseOptions(options)
             # get host and port
             host, port = url.split(':', 1) # may raise ValueError because of unpacking
             port = int(port)               # and this if it's not a number
@@ -119,36 +128,87 @@ class SocketSerial(SerialBase):
             raise SerialException('expected a string in the form "[rfc2217://]<host>:<port>[/option[/option...]]": %s' % e)
         return (host, port)
 
+    def _parseOptions(self, options):
+        """internal - process the options of the URL, directly altering
+        self. Raise ValueError on an unknown option."""
+        for option in options.split('/'):
+            if '=' in option:
+                option, value = option.split('=', 1)
+            else:
+                value = None
+            if option == 'logging':
+                logging.basicConfig()   # XXX is that good to call it here?
+                self.logger = logging.getLogger('pySerial.socket')
+                self.logger.setLevel(LOGGER_LEVELS[value])
+                self.logger.debug('enabled logging')
+            elif option == 'rcvbuf':
+                self._socket_options.append((socket.SO_RCVBUF, int(value)))
+            elif option == 'sndbuf':
+                self._socket_options.append((socket.SO_SNDBUF, int(value)))
+            else:
+                raise ValueError('unknown option: %r' % (option,))
+
     #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
 
+    def _receive(self, timeout):
+        """internal - wait up to timeout seconds (forever when None) for data
+        and append it to the read buffer. Return False on timeout."""
+        try:
+            ready, _, _ = select.select([self._socket], [], [], timeout)
+            if not ready:
+                return False
+            data = self._socket.recv(RECV_SIZE)
+        except (select.error, socket.error), e:
+            raise SerialException('connection failed (%s)' % (e,))
+        if not data:
+            raise SerialException('connection closed by the remote end')
+        self._read_buffer.extend(data)
+        return True
+
+    def _take(self, size):
+        """internal - remove and return up to size bytes of the read buffer"""
+        data = bytes(self._read_buffer[:size])
+        del self._read_buffer[:size]
+        return data
+
     def inWaiting(self):
         """Return the number of characters currently in the input buffer."""
         if not self._isOpen: raise portNotOpenError
-        if self.logger:
-            # set this one to debug as the function could be called often...
-            self.logger.debug('WARNING: inWaiting returns dummy value')
-        return 0 # hmmm, see comment in read()
+        self._receive(0)
+        return len(self._read_buffer)
 
     def read(self, size=1):
         """Read size bytes from the serial port. If a timeout is set it may
         return less characters as requested. With no timeout it will block
         until the requested number of bytes is read."""
         if not self._isOpen: raise portNotOpenError
-        data = bytearray()
-        timeout = time.time() + self._timeout
-        while len(data) < size and time.time() < timeout:
-            try:
-                # an implementation with internal buffer would be better
-                # performing...
-                data = self._socket.recv(size - len(data))
-            except socket.timeout:
-                # just need to get out of recv form time to time to check if
-                # still alive
-                continue
-            except socket.error, e:
-                # connection fails -> terminate loop
-                raise SerialException('connection failed (%s)' % e)
-        return bytes(data)
+        if self._timeout is not None:
+            timeout = time.time() + self._timeout
+        else:
+            timeout = None
+        try:
+            while len(self._read_buffer) < size:
+                left = None
+                if timeout is not None:
+                    left = max(timeout - time.time(), 0)
+                if not self._receive(left):
+                    break   # timeout
+        except SerialException:
+            # return what was received before the connection failed
+            if not self._read_buffer:
+                raise
+        return self._take(size)
+
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+        Waits at most timeout seconds (the port timeout when None) for the
+        first byte."""
+        if not self._isOpen: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        if not self._read_buffer:
+            self._receive(timeout)
+        return self._take(size)
 
     def write(self, data):
         """Output the given string over the serial port. Can block if the
@@ -157,6 +217,8 @@ class SocketSerial(SerialBase):
         if not self._isOpen: raise portNotOpenError
         try:
             self._socket.sendall(data)
+        except socket.timeout:
+            raise writeTimeoutError
         except socket.error, e:
             raise SerialException("socket connection failed: %s" % e) # XXX what exception if socket connection fails
         return len(data)
@@ -164,8 +226,9 @@ class SocketSerial(SerialBase):
     def flushInput(self):
         """Clear input buffer, discarding all that is in the buffer."""
         if not self._isOpen: raise portNotOpenError
-        if self.logger:
-            self.logger.info('ignored flushInput')
+        while self._receive(0):
+            del self._read_buffer[:]
+        del self._read_buffer[:]
 
     def flushOutput(self):
         """Clear output buffer, aborting the current output and
@@ -0,0 +1,254 @@
+#! python
+#
+# Python Serial Port Extension for Win32, Linux, BSD, Jython
+# see __init__.py
+#
+# This module implements a virtio-serial port, the character device of a
+# virtual machine connected to a socket or a chardev of the hypervisor. It is
+# not a tty: there is no termios, no modem line and no baud rate, the port
+# parameters are ignored.
+#
+# this is distributed under a free software license, see license.txt
+#
+# URL format:    virtio://<name>  or  virtio://<path>
+# the name is the one given to the port by the hypervisor, it is looked up
+# in /dev/virtio-ports. e.g. virtio://org.serclient.0
+#
+# The host end of the port may be disconnected: the device then reports a
+# hangup and reads return nothing until the host connects again. This is not
+# an error, reads return no data after a short delay and writes wait for the
+# host.
+
+from serial.serialutil import *
+from serial import serialposix
+import errno
+import os
+import select
+import time
+
+# udev links the ports named by the hypervisor here
+VIRTIO_PORTS_DIR = '/dev/virtio-ports'
+
+# seconds a read waits, at most, before returning nothing while the host end
+# is disconnected, the device does not tell when it connects again
+HOST_RETRY_DELAY = 0.5
+
+
+class VirtioSerial(serialposix.PosixSerial):
+    """Serial port implementation for virtio-serial character devices."""
+
+    def setPort(self, value):
+        """translate the URL to the device path before storing it"""
+        if isinstance(value, basestring) and value.lower().startswith('virtio://'):
+            serialposix.PosixSerial.setPort(self, self.fromURL(value))
+        else:
+            serialposix.PosixSerial.setPort(self, value)
+
+    # override property
+    port = property(serialposix.PosixSerial.getPort, setPort, doc="Port setting")
+
+    def fromURL(self, url):
+        """extract the device path from an URL string"""
+        if url.lower().startswith("virtio://"): url = url[9:]
+        if not url:
+            raise SerialException('expected a string in the form "virtio://<name>" or "virtio://<path>"')
+        if '/' in url:
+            return url
+        return os.path.join(VIRTIO_PORTS_DIR, url)
+
+    def _reconfigurePort(self):
+        """Set communication parameters on opened port. for virtio ports all
+        settings are ignored, timeouts are done via select"""
+        if self.fd is None:
+            raise SerialException("Can only operate on a valid file descriptor")
+
+    def makeDeviceName(self, port):
+        raise SerialException("there is no sensible way to turn numbers into virtio port names")
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    def _poll(self, timeout):
+        """internal - wait at most timeout seconds (None: forever) for the
+        port to be readable or hung up, return the poll events"""
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN|select.POLLHUP)
+        if timeout is not None:
+            timeout = timeout * 1000
+        events = 0
+        for fd, event in poll.poll(timeout):
+            events |= event
+        return events
+
+    def hostConnected(self):
+        """Return True when the host end of the port is connected: the
+        device reports a hangup when it is not and there is nothing left
+        to read."""
+        if not self._isOpen: raise portNotOpenError
+        events = self._poll(0)
+        return not (events & select.POLLHUP) or bool(events & select.POLLIN)
+
+    def _waitHost(self, timeout):
+        """internal - the host end is disconnected: wait before the caller
+        returns no data, as the device is readable (EOF) until it connects
+        again"""
+        delay = HOST_RETRY_DELAY
+        if timeout is not None:
+            delay = min(delay, timeout)
+        time.sleep(delay)
+
+    def inWaiting(self):
+        """Return the number of characters currently in the input buffer,
+        the driver does not tell it: 1 when some are ready, 0 otherwise."""
+        if not self._isOpen: raise portNotOpenError
+        if self._poll(0) & select.POLLIN:
+            return 1
+        return 0
+
+    def read_available(self, size=4096, timeout=None):
+        """Read up to size bytes, returning as soon as some are available.
+           Waits at most timeout seconds (the port timeout when None) for
+           the first byte. Returns no data while the host end is
+           disconnected."""
+        if not self._isOpen: raise portNotOpenError
+        if timeout is None:
+            timeout = self._timeout
+        events = self._poll(timeout)
+        if not events:
+            return bytes()
+        if not events & select.POLLIN:
+            # POLLHUP alone
+            self._waitHost(timeout)
+            return bytes()
+        view = self._readBuffer(size)
+        try:
+            got = self._fileio.readinto(view)
+        except IOError, e:
+            raise SerialException('read failed: %s' % (e,))
+        if got is None:
+            return bytes()  # EAGAIN
+        if not got:
+            # EOF, the host end is not connected
+            self._waitHost(timeout)
+            return bytes()
+        return view[:got].tobytes()
+
+    def write(self, data):
+        """Output the given string over the port. Waits for the host end to
+        be connected, up to the write timeout when there is one."""
+        if not self._isOpen: raise portNotOpenError
+        # slicing a memoryview does not copy the data left to write
+        d = memoryview(data)
+        if self._writeTimeout is not None and self._writeTimeout > 0:
+            timeout = time.time() + self._writeTimeout
+        else:
+            timeout = None
+        while len(d):
+            timeleft = None
+            if timeout:
+                timeleft = timeout - time.time()
+                if timeleft < 0:
+                    raise writeTimeoutError
+            # the device is not writable while the host is disconnected
+            _, ready, _ = select.select([], [self.fd], [], timeleft)
+            if not ready:
+                raise writeTimeoutError
+            try:
+                n = os.write(self.fd, d)
+            except OSError, v:
+                if v.errno != errno.EAGAIN:
+                    raise SerialException('write failed: %s' % (v,))
+                continue
+            d = d[n:]
+        return len(data)
+
+    def flush(self):
+        """Flush of file like objects, the writes are not buffered."""
+        if not self._isOpen: raise portNotOpenError
+
+    def flushInput(self):
+        """Clear input buffer, discarding all that is in the buffer."""
+        if not self._isOpen: raise portNotOpenError
+        while select.select([self.fd],[],[], 0)[0]:
+            try:
+                if not os.read(self.fd, 65536):
+                    break
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise SerialException('read failed: %s' % (e,))
+                break
+
+    def flushOutput(self):
+        """Clear output buffer, ignored: the writes are not buffered."""
+        if not self._isOpen: raise portNotOpenError
+
+    def drainOutput(self):
+        """internal - not portable!"""
+        if not self._isOpen: raise portNotOpenError
+
+    def sendBreak(self, duration=0.25):
+        """Send break condition, ignored."""
+        if not self._isOpen: raise portNotOpenError
+
+    def setBreak(self, level=1):
+        """Set break, ignored."""
+        if not self._isOpen: raise portNotOpenError
+
+    def setRTS(self, level=1):
+        """Set terminal status line: Request To Send, ignored."""
+        if not self._isOpen: raise portNotOpenError
+
+    def setDTR(self, level=1):
+        """Set terminal status line: Data Terminal Ready, ignored."""
+        if not self._isOpen: raise portNotOpenError
+
+    def getCTS(self):
+        """Read terminal status line: Clear To Send"""
+        if not self._isOpen: raise portNotOpenError
+        return True
+
+    def getDSR(self):
+        """Read terminal status line: Data Set Ready"""
+        if not self._isOpen: raise portNotOpenError
+        return True
+
+    def getRI(self):
+        """Read terminal status line: Ring Indicator"""
+        if not self._isOpen: raise portNotOpenError
+        return False
+
+    def getCD(self):
+        """Read terminal status line: Carrier Detect"""
+        if not self._isOpen: raise portNotOpenError
+        return True
+
+    def flowControl(self, enable):
+        """manually control flow, ignored."""
+        if not self._isOpen: raise portNotOpenError
+
+
+# assemble Serial class with the platform specific implementation and the base
+# for file-like behavior. for Python 2.6 and newer, that provide the new I/O
+# library, derive from io.RawIOBase
+try:
+    import io
+except ImportError:
+    # classic version with our own file-like emulation
+    class Serial(VirtioSerial, FileLike):
+        pass
+else:
+    # io library present
+    class Serial(VirtioSerial, io.RawIOBase):
+        pass
+
+
+# simple client test
+if __name__ == '__main__':
+    import sys
+    s = Serial('virtio://org.serclient.0')
+    sys.stdout.write('%s\n' % s)
+
+    sys.stdout.write("write...\n")
+    s.write("hello\n")
+    sys.stdout.write("read: %s\n" % s.read(5))
+
+    s.close()
@@ -0,0 +1,123 @@
+#! python
+#
+# Python Serial Port Extension for Win32, Linux, BSD, Jython
+# see __init__.py
+#
+# This module implements a client of a vsock (AF_VSOCK) stream socket, the
+# channel between a virtual machine and its hypervisor. It behaves as the
+# socket:// port, the port parameters are ignored.
+#
+# this is distributed under a free software license, see license.txt
+#
+# URL format:    vsock://<cid>:<port>[/option[/option...]]
+# the cid is a number or "host" for the hypervisor, "local" for the loopback
+# of the same machine
+# options:
+# - "logging=<level>" print diagnostic messages
+# - "rcvbuf=<bytes>", "sndbuf=<bytes>" size of the socket buffers
+
+from serial.serialutil import *
+from serial.urlhandler.protocol_socket import SocketSerial
+import os
+import socket
+
+# Linux address family, socket.AF_VSOCK is defined from Python 3.7 only
+AF_VSOCK = getattr(socket, 'AF_VSOCK', 40)
+
+# well known context identifiers
+CIDS = {
+    'local': 1,
+    'host': 2,
+    }
+
+
+def vsockAddress(cid, port):
+    """Return the struct sockaddr_vm of cid and port for bind() and
+    connect() of the C library"""
+    import ctypes
+
+    class sockaddr_vm(ctypes.Structure):
+        _fields_ = [
+            ('svm_family', ctypes.c_ushort),
+            ('svm_reserved1', ctypes.c_ushort),
+            ('svm_port', ctypes.c_uint),
+            ('svm_cid', ctypes.c_uint),
+            ('svm_zero', ctypes.c_ubyte * 4),
+            ]
+    return sockaddr_vm(AF_VSOCK, 0, port, cid)
+
+
+def vsockCall(name, sock, cid, port):
+    """Call bind or connect of the C library on sock with the vsock
+    address, the socket module of Python 2 does not know it"""
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    address = vsockAddress(cid, port)
+    if getattr(libc, name)(sock.fileno(), ctypes.byref(address), ctypes.sizeof(address)) != 0:
+        e = ctypes.get_errno()
+        raise socket.error(e, os.strerror(e))
+
+
+class VsockSerial(SocketSerial):
+    """Serial port implementation for vsock stream sockets."""
+
+    def _connect(self, address):
+        """internal - create self._socket and connect it to the (cid, port)
+        address"""
+        self._socket = socket.socket(AF_VSOCK, socket.SOCK_STREAM)
+        for option, value in self._socket_options:
+            self._socket.setsockopt(socket.SOL_SOCKET, option, value)
+        if hasattr(socket, 'AF_VSOCK'):
+            self._socket.connect(address)
+        else:
+            vsockCall('connect', self._socket, *address)
+
+    def fromURL(self, url):
+        """extract cid and port from an URL string"""
+        if url.lower().startswith("vsock://"): url = url[8:]
+        try:
+            # is there a "path" (our options)?
+            if '/' in url:
+                url, options = url.split('/', 1)
+                self._parseOptions(options)
+            # get cid and port
+            cid, port = url.split(':', 1) # may raise ValueError because of unpacking
+            if cid.lower() in CIDS:
+                cid = CIDS[cid.lower()]
+            else:
+                cid = int(cid)
+            port = int(port)
+            if not 0 <= cid < 1 << 32: raise ValueError("cid not in range 0...4294967295")
+            if not 0 <= port < 1 << 32: raise ValueError("port not in range 0...4294967295")
+        except ValueError, e:
+            raise SerialException('expected a string in the form "vsock://<cid>:<port>[/option[/option...]]": %s' % e)
+        return (cid, port)
+
+
+# assemble Serial class with the platform specific implementation and the base
+# for file-like behavior. for Python 2.6 and newer, that provide the new I/O
+# library, derive from io.RawIOBase
+try:
+    import io
+except ImportError:
+    # classic version with our own file-like emulation
+    class Serial(VsockSerial, FileLike):
+        pass
+else:
+    # io library present
+    class Serial(VsockSerial, io.RawIOBase):
+        pass
+
+
+# simple client test
+if __name__ == '__main__':
+    import sys
+    s = Serial('vsock://host:7000')
+    sys.stdout.write('%s\n' % s)
+
+    sys.stdout.write("write...\n")
+    s.write("hello\n")
+    s.flush()
+    sys.stdout.write("read: %s\n" % s.read(5))
+
+    s.close()
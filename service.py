@@ -21,22 +21,21 @@ import sys
 import os
 import argparse
 import logging
-import serial
 import struct
 import binascii
 import base64
+import zlib
 from elementtree import ElementTree as et
 import threading
 import subprocess
-from Queue import Queue
+from Queue import Queue, Empty
+from collections import deque
 import time
-import glob
-from xml.sax.saxutils import unescape, escape
 from tools import *
 import shlex
 import tempfile
-import subprocess
 import string
+import re
 
 # packet type
 COMMAND = "COMMAND"
@@ -44,11 +43,29 @@ ACK = "ACK"
 RECEIVED = "RECEIVED"
 AUTHRESPONSE = "AUTHRESPONSE"
 RESPONSE = "RESPONSE"
+# raw binary data of the COMMAND with the same guid, sent before it
+DATA = "DATA"
+PACKET_TYPES = (COMMAND, ACK, RECEIVED, AUTHRESPONSE, RESPONSE, DATA)
 
-# mn, 30 byte command, 32 byte guid, 16 byte for late use, 4 byte packet number, 4 byte packet count, 4 byte body size
+# mn, 30 byte command, 32 byte guid, 4 byte packet number, 4 byte packet count, 16 byte flags, 4 byte body size
 PROTOCOL_HEADER = "<c30s32sII16sI"
 PROTOCOL_HEADER_SIZE = struct.calcsize(PROTOCOL_HEADER)
 HEADER_MAGIC_NUMBER = "\x02"
+HEADER_FLAGS_OFFSET = struct.calcsize("<c30s32sII")
+
+# header flags, one character each in the field that was reserved. The old peers compute the
+# crc with an empty field: flags are sent only to the peers that advertised some.
+# the sender inflates the bodies deflated with zlib
+HEADER_FLAG_INFLATE = "z"
+# the sender accepts DATA packets
+HEADER_FLAG_DATA = "d"
+# the sender reassembles a RESPONSE sent in fragments and acknowledges each of them, the last one
+# included, with a RECEIVED numbered n/count
+HEADER_FLAG_FRAGMENTS = "f"
+# the flags advertised on each packet
+HEADER_CAPABILITIES = HEADER_FLAG_INFLATE + HEADER_FLAG_DATA + HEADER_FLAG_FRAGMENTS
+# the body, aggregated for a sequence of packets, is deflated with zlib
+HEADER_FLAG_DEFLATED = "Z"
 
 # crc32, mn
 PROTOCOL_FOOTER = "<Ic"
@@ -56,19 +73,167 @@ PROTOCOL_FOOTER_SIZE = struct.calcsize(PROTOCOL_FOOTER)
 FOOTER_MAGIC_NUMBER = "\x03"
 
 PACKET_MIN_SIZE = PROTOCOL_HEADER_SIZE + PROTOCOL_FOOTER_SIZE
-SERIAL_MIN_READ = 100000
+
+# COMMAND, RESPONSE and DATA bodies of at least this size are deflated when the peer inflates them
+COMPRESS_MIN_SIZE = 512
+COMPRESS_LEVEL = 6
+# bytes read at most from the serial port at once, a read returns as soon as some are available
+SERIAL_MAX_READ = 100000
+# seconds a read waits for the first byte
+SERIAL_READ_TIMEOUT = 1.0
 IDLE_TIMEOUT    = 60 * 15
 
 # debug
 N_DEBUG_REQUEST = 1
+
+# wire trace: seconds between two checks of the trace file and bytes dumped for each sampled read/write
+WIRETRACE_CHECK_INTERVAL = 5
+WIRETRACE_DUMP_SIZE = 4096
+
+# control packets are written before the others, between two frames
+CONTROL_PACKETS = (ACK, RECEIVED, AUTHRESPONSE)
+# RESPONSE and DATA bodies bigger than this are sent in fragments (packet number/count), 0
+# disables it for RESPONSE. A RESPONSE is fragmented only for the peers advertising HEADER_FLAG_FRAGMENTS
+RESPONSE_FRAGMENT_SIZE = 8192
+DATA_FRAGMENT_SIZE = 8192
+# seconds a written RESPONSE fragment waits for its RECEIVED before being sent again, and times it
+# is sent again before giving up the RESPONSE
+FRAGMENT_ACK_TIMEOUT = 10
+FRAGMENT_RETRIES = 3
+# seconds after its first write a RESPONSE is given up if still not acknowledged, and bytes of the
+# unacknowledged fragments kept to send them again: the fragments beyond are not sent again
+FRAGMENT_UNACKED_MAX_AGE = 60
+FRAGMENT_UNACKED_MAX_SIZE = 4 * 1024 * 1024
+# the frames ready together are written at once until the batch reaches this size, waiting
+# at most WRITE_BATCH_DELAY seconds for more of them
+WRITE_BATCH_SIZE = 8192
+WRITE_BATCH_DELAY = 0.0002
+# bytes given to each write of the serial port
+WRITE_CHUNK_SIZE = 65536
+# seconds given to the writer thread to send the queued packets when the service stops
+WRITER_STOP_TIMEOUT = 30
+
+# --port value that opens the fastest channel to the host found at startup, see Service.start
+PORT_AUTO = "auto"
+
+# seconds between two saves of the command metrics and two logs of the link statistics
+METRICS_SAVE_INTERVAL = 10
+LINKSTATS_LOG_INTERVAL = 60 * 5
+
+class CRCError(ValueError):
+	pass
+	
+# COMMAND body limits: bodies and command strings bigger than this are refused before parsing them
+COMMAND_BODY_MAX_SIZE = 128 * 1024 * 1024
+COMMAND_STRING_MAX_SIZE = 64 * 1024
+# DATA packets are written to disk as they are received, they can hold more
+DATA_MAX_SIZE = 1024 * 1024 * 1024
+
+# the usual COMMAND body, decoded without building a tree. The text can not hold entities, ']', '\r',
+# non ascii or control characters: those bodies go to the XML parser that handles them (or refuses them)
+_COMMAND_TEXT = r'[\t\n\x20-\x25\x27-\x3b\x3d-\x5c\x5e-\x7e]*'
+COMMAND_ENVELOPE = re.compile(r'<command><commandString>(%s)</commandString>(?:<binaryData>(%s)</binaryData>|<dataPacket size="(\d+)"/>)?</command>\Z' % 
+	(_COMMAND_TEXT, _COMMAND_TEXT))
+	
+class CommandBodyError(ValueError):
+	pass
+	
+class AttachedData(object):
+	"""
+	Binary data of a COMMAND sent in the DATA packets with its guid
+	"""
+	
+	def __init__(self, size):
+		self.size = size
+		
+	def __eq__(self, other):
+		return isinstance(other, AttachedData) and other.size == self.size
+		
+	def __ne__(self, other):
+		return not self == other
+		
+	def __repr__(self):
+		return "AttachedData(%d)" % self.size
+	
+def decodeCommandBody(body):
+	"""
+	Return (command string, binary data or None) from the body of a COMMAND packet. The binary
+	data is an instance of AttachedData when the body refers to DATA packets.
+	
+	@raise CommandBodyError: with the error message for malformed or too big bodies
+	"""
+	if len(body) > COMMAND_BODY_MAX_SIZE:
+		raise CommandBodyError("COMMAND body too big: %d bytes" % len(body))
+	m = COMMAND_ENVELOPE.match(body)
+	if m != None:
+		cmd, bd, dp = m.groups()
+		if bd == None:
+			bd = []
+		else:
+			# empty elements have no text, as with the parser
+			bd = [bd or None]
+		if dp == None:
+			dp = []
+		else:
+			dp = [dp]
+	else:
+		cmd, bd, dp = _parseCommandBody(body)
+	if not cmd or not cmd.strip():
+		raise CommandBodyError("Malformed command xml received: empty 'commandString'")
+	if len(cmd) > COMMAND_STRING_MAX_SIZE:
+		raise CommandBodyError("Malformed command xml received: 'commandString' too big: %d bytes" % len(cmd))
+	if dp:
+		if len(dp) != 1 or bd:
+			raise CommandBodyError("Malformed command xml received: expected 1 tag 'dataPacket' and no 'binaryData'")
+		try:
+			size = int(dp[0])
+		except (TypeError, ValueError):
+			raise CommandBodyError("Malformed command xml received: 'dataPacket' size %r" % dp[0])
+		if size < 0 or size > DATA_MAX_SIZE:
+			raise CommandBodyError("Malformed command xml received: 'dataPacket' size %d" % size)
+		return cmd, AttachedData(size)
+	if len(bd) != 1:
+		return cmd, None
+	try:
+		return cmd, base64.b64decode(bd[0])
+	except TypeError, te:
+		raise CommandBodyError("Malformed base64encoded binary data: %s" % te)
+		
+def _parseCommandBody(body):
+	"""
+	Return the commandString text, the list of binaryData texts and the list of dataPacket sizes
+	parsing body with ElementTree
+	"""
+	try:
+		xml = et.fromstring(body)
+	except et.ParseError, pe:
+		raise CommandBodyError("Malformed xml: %s" % pe)
+	if xml.tag != "command":
+		raise CommandBodyError("Malformed command xml received: expected tag 'command' received '%s'" % xml.tag)
+	cs = list(xml.findall("commandString"))
+	if len(cs) != 1:
+		raise CommandBodyError("Malformed command xml received: expected 1 tag 'commandString' received %d tags" % len(cs))
+	return cs[0].text, [e.text for e in xml.findall("binaryData")], [e.get("size") for e in xml.findall("dataPacket")]
+
+# replaced by the configured logger when the service is started
+logger = logging.getLogger('serclient')
+
+def escape(data):
+	"""
+	Escape &, < and > as xml.sax.saxutils.escape, that is not imported because it loads urllib
+	"""
+	if "&" in data: data = data.replace("&", "&amp;")
+	if ">" in data: data = data.replace(">", "&gt;")
+	if "<" in data: data = data.replace("<", "&lt;")
+	return data
 	
 class Packet(object):
 	"""
 	Simple class to serialize/deserialize a packet to/from string
 	"""
 	
-	def __init__(self, guid, type, body="", number=1, count=1):
-		assert type in (COMMAND, ACK, RECEIVED, AUTHRESPONSE, RESPONSE), "Unrecognize packet type: %r" % type
+	def __init__(self, guid, type, body="", number=1, count=1, flags=""):
+		assert type in PACKET_TYPES, "Unrecognize packet type: %r" % type
 		assert isinstance(guid, str) and len(guid) == 32, "Packet id is required to be a string of len 32"
 		assert number <= count, "Packet number is bigger of packet count"
 		self.guid = guid
@@ -76,19 +241,52 @@ class Packet(object):
 		self.body = body
 		self.number = number
 		self.count = count
+		self.flags = flags
+		
+	def _header(self):
+		return struct.pack(PROTOCOL_HEADER, HEADER_MAGIC_NUMBER, self.type, self.guid, self.number, self.count, self.flags, len(self.body))
 		
-	def _toStringNoFooter(self):
-		return struct.pack(PROTOCOL_HEADER, HEADER_MAGIC_NUMBER, self.type, self.guid, self.number, self.count, "", len(self.body)) + self.body
-				
 	def toString(self):
-		hb = self._toStringNoFooter()
-		crc = binascii.crc32(hb) & 0xffffffff
-		f = struct.pack(PROTOCOL_FOOTER, crc, FOOTER_MAGIC_NUMBER)
-		return hb + f
+		# the crc is computed on header and body without joining them, the body is copied only once
+		h = self._header()
+		crc = binascii.crc32(self.body, binascii.crc32(h)) & 0xffffffff
+		return ''.join((h, self.body, struct.pack(PROTOCOL_FOOTER, crc, FOOTER_MAGIC_NUMBER)))
 
 	def isSinglePacket(self):
 		return self.number == 1 and self.count == 1
 		
+	def deflate(self, level=None):
+		"""
+		Return a copy of the packet with the body deflated, or the packet itself when the body
+		does not get smaller
+		
+		@param level: zlib level, default to COMPRESS_LEVEL
+		"""
+		if level == None: level = COMPRESS_LEVEL
+		body = zlib.compress(self.body, level)
+		if len(body) >= len(self.body):
+			return self
+		return Packet(self.guid, self.type, body, self.number, self.count, self.flags + HEADER_FLAG_DEFLATED)
+		
+	def inflate(self, max_size):
+		"""
+		Return a copy of the packet with the deflated body inflated, the packet itself when the
+		body is not deflated.
+		
+		@param max_size: maximum size of the inflated body
+		@raise ValueError: if the body is not valid or bigger than max_size once inflated
+		"""
+		if HEADER_FLAG_DEFLATED not in self.flags:
+			return self
+		d = zlib.decompressobj()
+		try:
+			body = d.decompress(self.body, max_size)
+		except zlib.error, e:
+			raise ValueError("invalid deflated body: %s" % e)
+		if d.unconsumed_tail:
+			raise ValueError("deflated body bigger than %d bytes" % max_size)
+		return Packet(self.guid, self.type, body, self.number, self.count, self.flags.replace(HEADER_FLAG_DEFLATED, ""))
+		
 	def __len__(self):
 		return PROTOCOL_HEADER_SIZE + len(self.body) + PROTOCOL_FOOTER_SIZE
 
@@ -98,8 +296,7 @@ class Packet(object):
 		return "Packet(guid=%r, type=%r, body=%r, number=%d, count=%d)" % (self.guid, self.type, self.body, self.number, self.count)
 
 	def crc(self):
-		crc = binascii.crc32(self._toStringNoFooter()) & 0xffffffff
-		return crc
+		return binascii.crc32(self.body, binascii.crc32(self._header())) & 0xffffffff
 
 	@staticmethod
 	def unpackHeader(buffer):
@@ -118,12 +315,14 @@ class Packet(object):
 		_, bs, t, i, packet_number, packet_count = Packet.unpackHeader(string)
 		b = string[PROTOCOL_HEADER_SIZE : PROTOCOL_HEADER_SIZE + bs]
 		f = string[PROTOCOL_HEADER_SIZE + bs : PROTOCOL_HEADER_SIZE + bs + PROTOCOL_FOOTER_SIZE]
-		p = Packet(i, t, b, packet_number, packet_count)
+		flags = string[HEADER_FLAGS_OFFSET:HEADER_FLAGS_OFFSET + 16].split('\x00')[0]
+		p = Packet(i, t, b, packet_number, packet_count, flags)
 		crc, mn = Packet.unpackFooter(f)
 		if mn != FOOTER_MAGIC_NUMBER:
 			raise ValueError("end of packet not found")
-		if crc != p.crc():
-			raise ValueError("%x != %x" % (crc, p.crc()))
+		expected = p.crc()
+		if crc != expected:
+			raise CRCError("%x != %x" % (crc, expected))
 		return p
 
 	@staticmethod
@@ -134,7 +333,7 @@ class Packet(object):
 	def hasValidPacketHeader(buffer):
 		mn, body_size, t, guid, pn, pc = Packet.unpackHeader(buffer)
 		return (mn == HEADER_MAGIC_NUMBER) and \
-			(t in (COMMAND, ACK, RECEIVED, AUTHRESPONSE, RESPONSE)) and \
+			(t in PACKET_TYPES) and \
 			(pn <= pc) and \
 			not(False in map(lambda k: k in string.hexdigits, guid))
 		
@@ -148,9 +347,15 @@ class Packet(object):
 		return Packet(guid=guid, type=ACK)
 
 	@staticmethod
-	def newWithCOMMAND(guid, command, data=None):
+	def newWithCOMMAND(guid, command, data=None, attached=False):
+		"""
+		Return a COMMAND packet, data is its binary data if any. When attached is True the data
+		is sent separately in DATA packets (see -L{newWithDATA}) and the body holds only its size.
+		"""
 		if data == None:
 			cmd = "<command><commandString>%s</commandString></command>" % escape(command)
+		elif attached:
+			cmd = "<command><commandString>%s</commandString><dataPacket size=\"%d\"/></command>" % (escape(command), len(data))
 		else:
 			data = base64.b64encode(data)
 			cmd = "<command><commandString>%s</commandString><binaryData>%s</binaryData></command>" % (escape(command), data)
@@ -164,6 +369,10 @@ class Packet(object):
 			body = "<responseType>Success</responseType>"
 		return Packet(guid=guid, type=RECEIVED, body=body, number=number, count=count)
 		
+	@staticmethod
+	def newWithDATA(guid, data):
+		return Packet(guid=guid, type=DATA, body=data)
+		
 	@staticmethod
 	def newWithAUTHRESPONSE(guid):
 		return Packet(guid=guid, type=AUTHRESPONSE)
@@ -171,17 +380,166 @@ class Packet(object):
 	@staticmethod
 	def newWithRESPONSE(guid, response_type, command_name="", output_string="", return_code=0, result_message=""):
 		assert response_type in ("Success", "Error", "TimeOut"), "Response type '%s' not supported" % response_type
-		# todo: use elementree
-		rt = "<responseType>%s</responseType>" % response_type
-		rc = "<resultCode>%d</resultCode>" % return_code
 		if result_message == None: result_message = ""
-		rm = "<resultMessage>%s</resultMessage>" % escape(result_message)
-		cn = "<commandName>%s</commandName>" % escape(command_name)
 		if output_string == None: output_string = ""
-		os = "<outputString>%s</outputString>" % escape(output_string)
-		body = "<response>" + rt + rc + rm + cn + os + "</response>"
+		# the output can be several MB: it is escaped once (escape returns it as is when there is 
+		# nothing to replace) and copied once by join
+		body = ''.join(("<response><responseType>", response_type, 
+			"</responseType><resultCode>%d</resultCode><resultMessage>" % return_code, escape(result_message),
+			"</resultMessage><commandName>", escape(command_name),
+			"</commandName><outputString>", escape(output_string),
+			"</outputString></response>"))
 		return Packet(guid=guid, type=RESPONSE, body=body)
 
+class Attachment(object):
+	"""
+	Binary data received in the DATA packets of a guid.
+	
+	The packets are written, inflated if deflated, to a partial file as they arrive in order;
+	the file is renamed to the path of the binary data of the COMMAND once the last one is written.
+	Both are in the private attachments directory (see -L{getAttachmentsDirectory}).
+	"""
+	
+	def __init__(self, p):
+		"""
+		@param p: the first DATA packet
+		"""
+		self.guid = p.guid
+		self.count = p.count
+		self.path = os.path.join(getAttachmentsDirectory(), p.guid)
+		self.size = 0
+		self.next = 1
+		self._inflater = None
+		if HEADER_FLAG_DEFLATED in p.flags:
+			self._inflater = zlib.decompressobj()
+		self._file = createPrivateFile(self.path + '.part')
+		
+	def write(self, p):
+		"""
+		Write the DATA packet p, the next one expected. Return True once the data is complete.
+		
+		@raise ValueError: if the body is not valid or the data bigger than DATA_MAX_SIZE
+		"""
+		data = p.body
+		if self._inflater != None:
+			try:
+				data = self._inflater.decompress(data, DATA_MAX_SIZE - self.size + 1)
+			except zlib.error, e:
+				raise ValueError("invalid deflated body: %s" % e)
+		self.size += len(data)
+		if self.size > DATA_MAX_SIZE or (self._inflater != None and self._inflater.unconsumed_tail):
+			raise ValueError("data bigger than %d bytes" % DATA_MAX_SIZE)
+		self._file.write(data)
+		self.next += 1
+		if p.number < self.count:
+			return False
+		# a truncated deflated body is found by the size check of the COMMAND
+		self._file.close()
+		os.rename(self.path + '.part', self.path)
+		return True
+		
+	def abort(self):
+		"""
+		Close and remove the partial file
+		"""
+		self._file.close()
+		try:
+			os.unlink(self.path + '.part')
+		except OSError:
+			pass
+
+class WireTrace(object):
+	"""
+	Sampled dump of the raw bytes read from and written to the serial port.
+	
+	The trace is switched on and off at runtime, without restarting the service, by creating or removing 
+	the wire trace file (see the wiretrace internal module); the file contains the sampling rate N so 
+	that one read/write every N is dumped.
+	"""
+	
+	def __init__(self, path):
+		self._path = path
+		self._rate = 0
+		self._count = 0
+		self._checked = 0
+		
+	def _refresh(self):
+		now = time.time()
+		if now - self._checked < WIRETRACE_CHECK_INTERVAL: return
+		self._checked = now
+		try:
+			rate = max(int(open(self._path).read().strip() or 1), 1)
+		except IOError:
+			rate = 0
+		except ValueError:
+			rate = 1
+		if rate != self._rate:
+			if rate:
+				logger.info("Wire trace enabled, sampling 1 every %d", rate)
+			else:
+				logger.info("Wire trace disabled")
+			self._rate = rate
+			self._count = 0
+			
+	def trace(self, direction, data):
+		"""
+		Dump data if tracing is enabled and this read/write is sampled
+		
+		@param direction: 'IN' or 'OUT'
+		"""
+		self._refresh()
+		if not self._rate or not data: return
+		self._count += 1
+		if self._count % self._rate: return
+		logger.info("[wire] %s %d bytes: %s", direction, len(data), Hexdump(data, WIRETRACE_DUMP_SIZE))
+		
+class CommandTiming(object):
+	"""
+	Time spent by a command in each phase, from its COMMAND packet to the RESPONSE write:
+	queue (waiting in the command queue), blocking (waiting for blocking mode), spawn, exec,
+	auth (waiting for the AUTHRESPONSE), serialize and write, plus the total.
+	"""
+	
+	def __init__(self, guid, module):
+		self.guid = guid
+		self.module = module
+		self.started = self._mark = time.time()
+		self.phases = {}
+		self.blocked = False
+		self.result = None
+		self.output_size = 0
+		
+	def lap(self, phase):
+		"""
+		Account the time since the previous lap to phase
+		"""
+		now = time.time()
+		self.phases[phase] = self.phases.get(phase, 0) + now - self._mark
+		self._mark = now
+		
+	def block(self):
+		"""
+		Called while the command is queued and the service is in blocking mode
+		"""
+		if self.blocked: return
+		self.lap('queue')
+		self.blocked = True
+		
+	def unqueue(self):
+		if self.blocked:
+			self.lap('blocking')
+		else:
+			self.lap('queue')
+			
+	def finish(self, metrics):
+		self.phases['total'] = self._mark - self.started
+		metrics.record(self.module, self.result, self.phases, self.output_size)
+		
+	def __str__(self):
+		phases = self.phases.items()
+		phases.sort()
+		return ' '.join(['%s=%.3f' % p for p in phases])
+		
 class Command(object):
 	"""
 	Simple class that store the logic behind a COMMAND request.
@@ -198,6 +556,7 @@ class Command(object):
 		self.binary_data = binary_data
 		module_name = os.path.basename(split[0])
 		self.cmd_line = None
+		self.module = None
 		for type, upgradable, dirs in MODULE_TYPES.values():
 			if type == MODULE_CUSTOMS: 
 				# custom module must be called using 'exec script'
@@ -208,6 +567,9 @@ class Command(object):
 				if self.binary_data:
 					self.cmd_line.extend([self.binary_data])
 				break
+		name = METRICS_OTHER_MODULE
+		if self.module: name = self.module.aliasName()
+		self.timing = CommandTiming(guid, name)
 		
 	def __repr__(self):
 		return "Command(%r, %r, %r)" % (self.command, self.guid, self.binary_data)
@@ -225,6 +587,13 @@ class Command(object):
 		if self.module == None: return False
 		return self.module.isBlocking()
 		
+	def timeout(self, default):
+		"""
+		Returns the timeout declared by the module or default.
+		"""
+		if self.module == None or self.module.timeout() == None: return default
+		return self.module.timeout()
+		
 	def spawn(self, timeout, service):
 		"""
 		Returns a CommandObserver that takes care of spawning and controlling the process .
@@ -263,6 +632,7 @@ class CommandObserver(threading.Thread):
 		self.return_code = 0
 		self.timedout = 0
 		self.output = ""
+		self.timing = command.timing
 
 	def run(self):
 		"""
@@ -276,7 +646,7 @@ class CommandObserver(threading.Thread):
 			self._service.sendLater(Packet.newWithAUTHRESPONSE(self._command.guid))
 			return
 			
-		logger.info("[%s] Running '%r' with timeout %d sec" % (self._command.guid, self._command.module, self._timeout))
+		logger.info("[%s] Running '%r' with timeout %d sec", self._command.guid, self._command.module, self._timeout)
 		
 		# if the external command is an internal/plugin python script we use ourself as python interpreter
 		if self._command.useServiceAsPythonInterpreter():
@@ -292,8 +662,11 @@ class CommandObserver(threading.Thread):
 		def target():
 			try:
 				self._process = runExternal(cmd_line, close_handles=self._command.isUpdateSoftware())
+				self.timing.lap('spawn')
 				self.output, _ = self._process.communicate()
+				self.timing.lap('exec')
 			except OSError, oe:
+				self.timing.lap('spawn')
 				logger.debug("error executing command: %s" % oe)
 				self.output = str(oe)
 				del oe
@@ -323,7 +696,7 @@ class CommandObserver(threading.Thread):
 		# read the output of the failed updateSoftware command (we should have been killed if the attempt was a success)
 		if self._command.isUpdateSoftware():
 			self.output = getUpdateSoftwareLOG(remove=True)
-			logger.debug("Detected failed updateSoftware attempt with log:\n%s" % self.output)
+			logger.debug("Detected failed updateSoftware attempt with log:\n%s", self.output)
 			
 		if self._kill: return
 		
@@ -353,6 +726,8 @@ class CommandObserver(threading.Thread):
 		else:
 			rt = "Error"
 			rm = self.output
+		self.timing.result = rt
+		self.timing.output_size = len(self.output)
 			
 		p = Packet.newWithRESPONSE(guid=self._command.guid,
 			response_type=rt,
@@ -375,30 +750,274 @@ class ReplyResponseObserver(object):
 	"""
 	def __init__(self, response):
 		self._response = response
+		self.timing = None
 		
 	def responsePacket(self):
 		return self._response
 
+class SerialReader(threading.Thread):
+	"""
+	Read and decode the packets received by the service and pass them to its dispatcher, so
+	that the serial port is read while the dispatcher or the writer are busy.
+	The errors are passed to the dispatcher too, that raises them.
+	"""
+	
+	def __init__(self, service, *args, **kwargs):
+		threading.Thread.__init__(self, *args, **kwargs)
+		self.setDaemon(True)
+		self._service = service
+		self.stopping = False
+		
+	def run(self):
+		try:
+			while not self.stopping:
+				p = self._service.read(timeout=SERIAL_READ_TIMEOUT)
+				if p:
+					self._service.dispatch(Service.PACKET, p)
+				else:
+					# let the dispatcher do its periodic work
+					self._service.dispatch(Service.TICK)
+		except Exception:
+			self._service.dispatch(Service.ERROR, sys.exc_info())
+
+class SerialWriter(threading.Thread):
+	"""
+	Write the packets sent by the service.
+	
+	The control packets are written in order before any other frame. The other packets are
+	written as streams of frames (see L{Service.frames}): the streams take turns frame by
+	frame, so that a small RESPONSE is not stuck behind a large one and a control packet waits
+	at most one batch.
+	The frames ready together are gathered in batches of about WRITE_BATCH_SIZE bytes, each
+	written with a single write of the serial port.
+	The errors are passed to the dispatcher of the service, that raises them.
+	"""
+	
+	def __init__(self, service, *args, **kwargs):
+		threading.Thread.__init__(self, *args, **kwargs)
+		self.setDaemon(True)
+		self._service = service
+		self._condition = threading.Condition()
+		self._control = deque()
+		# (frames iterator, CommandTiming) of the other packets, in turn
+		self._streams = deque()
+		self._stopping = False
+		
+	def put(self, p, k=None, timing=None):
+		"""
+		Queue the packet p, k is its string form if already computed and timing the
+		CommandTiming completed once p is written
+		"""
+		if p.type in CONTROL_PACKETS and k == None:
+			k = p.toString()
+		self._condition.acquire()
+		try:
+			if p.type in CONTROL_PACKETS:
+				self._control.append((p, k))
+			else:
+				self._streams.append((self._service.frames(p, k), timing))
+			self._condition.notify()
+		finally:
+			self._condition.release()
+		
+	def stop(self):
+		"""
+		Stop the thread once the packets already queued are written
+		"""
+		self._condition.acquire()
+		try:
+			self._stopping = True
+			self._condition.notify()
+		finally:
+			self._condition.release()
+		
+	def _next(self):
+		"""
+		Wait for the next batch to write, return the list of (packet, string, timing) where
+		timing is the CommandTiming of the packets written by the frame, None when stopped
+		"""
+		self._condition.acquire()
+		try:
+			while not self._control and not self._streams:
+				if self._stopping: return None
+				self._condition.wait()
+			batch = []
+			size = 0
+			delayed = False
+			while size < WRITE_BATCH_SIZE:
+				if not self._control and not self._streams:
+					# more frames may be coming, as the RECEIVED of a burst of commands
+					if delayed or self._stopping: break
+					delayed = True
+					self._condition.wait(WRITE_BATCH_DELAY)
+					continue
+				timing = None
+				if self._control:
+					p, k = self._control.popleft()
+				else:
+					stream = self._streams.popleft()
+					p, k = stream[0].next()
+					if p.number < p.count:
+						# the stream takes its next turn after the others
+						self._streams.append(stream)
+					else:
+						timing = stream[1]
+				batch.append((p, k, timing))
+				size += len(k)
+			return batch
+		finally:
+			self._condition.release()
+		
+	def run(self):
+		try:
+			while True:
+				batch = self._next()
+				if batch == None: break
+				self._service.writeFrames([(p, k) for p, k, timing in batch])
+				for p, k, timing in batch:
+					if timing:
+						timing.lap('write')
+						self._service.dispatch(Service.WRITTEN, timing)
+		except Exception:
+			self._service.dispatch(Service.ERROR, sys.exc_info())
+
+class Transport(object):
+	"""
+	A kind of channel to the host: it recognizes the ports of its URL scheme and opens them with
+	the settings that apply. -L{TRANSPORTS} lists the kinds from the fastest one.
+	"""
+	name = None
+	# URL scheme of the ports
+	scheme = None
+	
+	def handles(self, port):
+		"""
+		Return True if port is a channel of this kind
+		"""
+		return isinstance(port, basestring) and port.lower().startswith(self.scheme + '://')
+		
+	def open(self, serial_class, port, settings):
+		"""
+		Return the port opened with serial_class. The virtual machine channels have no line
+		settings, only the read timeout is given.
+		
+		@param settings: the SERIAL section of the configuration
+		"""
+		return serial_class(port, timeout=SERIAL_READ_TIMEOUT)
+		
+	def connected(self, sp):
+		"""
+		Return True if the host end of the opened port sp is there, a probed channel is used
+		only then
+		"""
+		return True
+		
+	def __str__(self):
+		return self.name
+		
+class VsockTransport(Transport):
+	"""
+	vsock stream socket to the hypervisor, vsock://cid:port
+	"""
+	name = "vsock"
+	scheme = "vsock"
+	
+class VirtioTransport(Transport):
+	"""
+	virtio-serial character device, virtio://name
+	"""
+	name = "virtio-serial"
+	scheme = "virtio"
+	
+	def connected(self, sp):
+		return sp.hostConnected()
+	
+class UartTransport(Transport):
+	"""
+	Serial port: device names, port numbers and the other URLs of pyserial (socket://, rfc2217://, ...)
+	"""
+	name = "uart"
+	
+	def handles(self, port):
+		return True
+		
+	def open(self, serial_class, port, settings):
+		return serial_class(port,
+							baudrate=settings['baudrate'],
+							bytesize=int(settings['bytesize']),
+							parity=settings['parity'],
+							stopbits=float(settings['stopbits']),
+							timeout=SERIAL_READ_TIMEOUT)
+							
+TRANSPORTS = (VsockTransport(), VirtioTransport(), UartTransport())
+
+def transportFor(port):
+	"""
+	Return the first of -L{TRANSPORTS} that handles port
+	"""
+	for transport in TRANSPORTS:
+		if transport.handles(port):
+			return transport
+			
+def probePorts(settings):
+	"""
+	Return the ports to try with --port auto, fastest first: the vsock port of the host when
+	vsock_port is set, the virtio-serial port named virtio_name then the first serial port.
+	
+	@param settings: the SERIAL section of the configuration
+	"""
+	ports = []
+	try:
+		from serial.tools import list_ports_posix
+	except ImportError:
+		# not a posix system, there is only the serial port
+		pass
+	else:
+		vsock_port = None
+		if settings.get('vsock_port'):
+			vsock_port = int(settings['vsock_port'])
+		virtio_name = settings.get('virtio_name') or None
+		ports = [port for port, desc, hwid in list_ports_posix.channels(vsock_port, virtio_name)]
+	return ports + [0]
+	
 class Service(object):
 	"""
 	service class.
 	Read from the serial port and manage the commands execution.
+	
+	While running, a SerialReader thread reads the port and a SerialWriter thread writes it,
+	the run loop dispatches the events they queue.
 	"""
 	
-	def __init__(self, args, serial_class=serial.Serial):
+	# events of the dispatcher
+	PACKET = 'packet'
+	WRITTEN = 'written'
+	TICK = 'tick'
+	ERROR = 'error'
+	
+	def __init__(self, args, serial_class=None):
 		"""
 		Create a service instance ready to be used calling -L{start} and then -L{run}
 		
 		@param args: Arguments from ArgumentParser, are passed to the serial class constructor
-		@param serial_class: Serial class, default to serial.Serial can be changed for testing
-							 purpose. The class must respond to -B{read} and -B{write}.
+		@param serial_class: Serial class, default to serial.serial_for_url that opens device names
+							 and URLs like socket://host:port, vsock://cid:port and virtio://name,
+							 can be changed for testing purpose.
+							 It is called with the port and the settings, the result must respond
+							 to -B{read_available} and -B{write}.
 		"""
+		if serial_class == None:
+			# serial is imported here so that --exec children do not load it
+			import serial
+			serial_class = serial.serial_for_url
 		assert isinstance(args, dict), "args must be a dictionary"
 		self._args = args
 		self._serial_class = serial_class
+		self.transport = None
 		self._buffer = ""
 		self._threads = {}
-		self._out_queue = Queue()
+		self._events = Queue()
+		self._writer = None
 		self._command_timeout = int(args['PLUGINS']['command_timeout'])
 		self._timers = []
 		self._command_queue = []
@@ -407,48 +1026,298 @@ class Service(object):
 		self._packet_pool = dict()
 		self._logic_timeout = None
 		self._last_data = time.time()
+		self._trace = WireTrace(getWireTraceFileName())
+		self._metrics = Metrics()
+		self._metrics_saved = time.time()
+		self._link = self._metrics.link
+		self._link_logged = time.time()
+		self._link_saved = None
+		# capabilities negotiated with the header flags, see -L{encode}
+		self._peer_flags = ""
+		self._advertise_flags = False
+		# DATA packets being received by guid
+		self._attachments = {}
+		# complete Attachments by guid, until the RESPONSE of their COMMAND
+		self._received = {}
+		# RESPONSE fragments written and not acknowledged yet, by guid and number: [packet, string,
+		# time written or None while queued again, times sent again]. Filled by the writer thread.
+		# The time of the first write by guid and the bytes of the strings are kept to bound them.
+		self._unacked = {}
+		self._unacked_since = {}
+		self._unacked_size = 0
+		self._unacked_lock = threading.Lock()
+
+	def advertiseFlags(self):
+		"""
+		Advertise HEADER_CAPABILITIES from the first packet sent, as a host does. Otherwise they
+		are advertised once the peer did.
+		"""
+		self._advertise_flags = True
+		
+	def peerAccepts(self, flag):
+		"""
+		Return True if the last packet of the peer advertised the capability flag
+		"""
+		return flag in self._peer_flags
+		
+	def encode(self, p):
+		"""
+		Return p ready to be sent: with HEADER_CAPABILITIES when they are advertised and a
+		deflated body when the peer inflates it. The packets for the peers that did not
+		advertise any flag are sent unchanged.
+		
+		@param p: Instance of packet
+		"""
+		if not self._advertise_flags and not self._peer_flags:
+			return p
+		p = Packet(p.guid, p.type, p.body, p.number, p.count, HEADER_CAPABILITIES)
+		if self.peerAccepts(HEADER_FLAG_INFLATE) and p.type in (COMMAND, RESPONSE, DATA) and len(p.body) >= COMPRESS_MIN_SIZE:
+			p = p.deflate()
+		return p
+		
+	def decode(self, p):
+		"""
+		Return the received packet p with its body inflated, None if it is not valid. A COMMAND
+		that is not valid is answered with an Error RESPONSE, as one with a malformed body.
+		
+		@param p: Instance of packet, the aggregation of the sequence for multiple packets
+		"""
+		try:
+			return p.inflate(COMMAND_BODY_MAX_SIZE)
+		except ValueError, ve:
+			logger.error("[%s] Error inflating packet: %s", p.guid, ve)
+			self._link.add('framing_errors')
+			if p.type == COMMAND:
+				self.rejectCommand(p.guid, str(ve))
+			return None
 
 	def idleTime(self):
 		return time.time() - self._last_data
 
-	def send(self, p):
+	def send(self, p, k=None, timing=None):
 		"""
-		Send a packet by writing its string form on the serial port
+		Send a packet: queue it for the writer thread when the service is running, write it
+		otherwise. Can be called by any thread.
 		
 		@param p: Instance of packet
+		@param k: p.toString() when already computed by the caller
+		@param timing: CommandTiming completed once the packet is written
 		"""
 		assert isinstance(p, Packet), "Not a Packet"
+		if k == None:
+			p = self.encode(p)
+		if self._writer != None:
+			self._writer.put(p, k, timing)
+			return
+		self.writeFrames(list(self.frames(p, k)))
+		if timing:
+			timing.lap('write')
+			self.finishTiming(timing)
+		
+	def frames(self, p, k=None):
+		"""
+		Generate the (packet, string) frames sending p: p itself or, for a RESPONSE or DATA whose
+		body is bigger than RESPONSE_FRAGMENT_SIZE or DATA_FRAGMENT_SIZE, its fragments numbered
+		from 1 to count. Fragments are serialized when they are about to be written.
+		A RESPONSE is fragmented only when the peer advertised HEADER_FLAG_FRAGMENTS.
+		
+		@param p: Instance of packet
+		@param k: p.toString() when already computed by the caller
+		"""
+		size = {RESPONSE: RESPONSE_FRAGMENT_SIZE, DATA: DATA_FRAGMENT_SIZE}.get(p.type)
+		if p.type == RESPONSE and not self.peerAccepts(HEADER_FLAG_FRAGMENTS):
+			size = 0
+		if not size or len(p.body) <= size or not p.isSinglePacket():
+			if k == None: k = p.toString()
+			yield p, k
+			return
+		count = (len(p.body) + size - 1) / size
+		for n in range(count):
+			f = Packet(p.guid, p.type, p.body[n * size:(n + 1) * size], n + 1, count, p.flags)
+			yield f, f.toString()
+		
+	def write(self, p, k=None):
+		"""
+		Write the string form of a packet on the serial port
+		
+		@param p: Instance of packet
+		@param k: p.toString() when already computed by the caller
+		"""
+		self.writeFrames([(p, k)])
+		
+	def writeFrames(self, frames):
+		"""
+		Write the string form of several packets on the serial port, with a single write
+		when they fit in WRITE_CHUNK_SIZE
+		
+		@param frames: list of (packet, string) where string is None when not computed yet
+		"""
 		self._last_data = time.time()
-		logger.info("Sending packet: %r" % p)
-		k = p.toString()
-		logger.debug("Writing: %d %r" % (len(k), k))
+		debug = logger.isEnabledFor(logging.DEBUG)
+		data = []
+		fragments = []
+		for p, k in frames:
+			logger.info("Sending packet: %r", p)
+			if k == None: k = p.toString()
+			if debug:
+				logger.debug("Writing: %d bytes %s", len(k), Hexdump(k))
+				if chr(255) in k:
+					logger.debug("IAC FOUND")
+			data.append(k)
+			if p.type == RESPONSE and not p.isSinglePacket():
+				fragments.append((p, k))
+		if len(data) == 1:
+			k = data[0]
+		else:
+			k = ''.join(data)
 		tot = len(k)
-		if chr(255) in k:
-			logger.debug("IAC FOUND")
 		done = 0
 		# chunk write
-		cs = 8192
-		while len(k) != 0:
-			e = k[:cs]
-			k = k[cs:]
+		cs = WRITE_CHUNK_SIZE
+		while done < tot:
+			e = k[done:done + cs]
 			done += len(e)
-			logger.debug("Writing to serial port: %d/%d bytes" % (done, tot))
+			if debug:
+				logger.debug("Writing to serial port: %d/%d bytes", done, tot)
+			self._trace.trace('OUT', e)
 			self.sp.write(e)
-			#time.sleep(20)
+		self._link.add('frames_out', len(frames))
+		self._link.add('bytes_out', tot)
+		if fragments:
+			self._wroteFragments(fragments)
+		
+	def _wroteFragments(self, fragments):
+		"""
+		Wait for the RECEIVED of the RESPONSE fragments just written, see -L{resendFragments}
+		
+		@param fragments: list of (packet, string)
+		"""
+		now = time.time()
+		untracked = []
+		self._unacked_lock.acquire()
+		try:
+			for p, k in fragments:
+				waiting = self._unacked.get(p.guid, {})
+				entry = waiting.get(p.number)
+				if entry:
+					# sent again
+					entry[2] = now
+				elif self._unacked_size + len(k) > FRAGMENT_UNACKED_MAX_SIZE:
+					if p.guid not in untracked: untracked.append(p.guid)
+				else:
+					if not waiting:
+						self._unacked[p.guid] = waiting
+						self._unacked_since.setdefault(p.guid, now)
+					waiting[p.number] = [p, k, now, 0]
+					self._unacked_size += len(k)
+		finally:
+			self._unacked_lock.release()
+		for guid in untracked:
+			logger.warning("[%s] %d bytes of RESPONSE fragments waiting for their RECEIVED, the new ones "
+						   "will not be sent again", guid, self._unacked_size)
+			
+	def _forgetFragments(self, guid):
+		"""
+		Give up sending again the RESPONSE fragments of guid, called holding _unacked_lock
+		"""
+		for entry in self._unacked.pop(guid, {}).values():
+			self._unacked_size -= len(entry[1])
+		self._unacked_since.pop(guid, None)
+			
+	def acknowledgeFragment(self, p):
+		"""
+		Forget the RESPONSE fragment acknowledged by the RECEIVED p
+		
+		@param p: Instance of packet, a RECEIVED numbered n/count
+		"""
+		self._unacked_lock.acquire()
+		try:
+			waiting = self._unacked.get(p.guid)
+			if waiting and p.number in waiting:
+				self._unacked_size -= len(waiting.pop(p.number)[1])
+				if not waiting:
+					self._forgetFragments(p.guid)
+		finally:
+			self._unacked_lock.release()
+			
+	def resendFragments(self):
+		"""
+		Send again the RESPONSE fragments not acknowledged FRAGMENT_ACK_TIMEOUT seconds after
+		being written. A RESPONSE with a fragment sent FRAGMENT_RETRIES times, or first written
+		FRAGMENT_UNACKED_MAX_AGE seconds ago, is given up.
+		"""
+		now = time.time()
+		resend = []
+		self._unacked_lock.acquire()
+		try:
+			for guid, waiting in self._unacked.items():
+				if now - self._unacked_since[guid] > FRAGMENT_UNACKED_MAX_AGE:
+					logger.error("[%s] RESPONSE not acknowledged after %d seconds, giving up", 
+								 guid, FRAGMENT_UNACKED_MAX_AGE)
+					self._forgetFragments(guid)
+					continue
+				for number, entry in waiting.items():
+					if entry[2] == None or now - entry[2] < FRAGMENT_ACK_TIMEOUT:
+						continue
+					if entry[3] >= FRAGMENT_RETRIES:
+						logger.error("[%s] RESPONSE fragment %d/%d not acknowledged, giving up", 
+									 guid, number, entry[0].count)
+						self._forgetFragments(guid)
+						break
+					entry[2] = None
+					entry[3] += 1
+					resend.append((entry[0], entry[1]))
+		finally:
+			self._unacked_lock.release()
+		for p, k in resend:
+			logger.warning("[%s] RESPONSE fragment %d/%d not acknowledged, sending it again", 
+						   p.guid, p.number, p.count)
+			self._link.add('fragments_resent')
+			self.send(p, k)
 		
 	def sendLater(self, p):
 		"""
-		Add the packet in a queue and send it as soon as possible
+		Send the packet as soon as possible, used by the command threads
 		"""
-		assert isinstance(p, Packet), "Not a Packet"
-		self._out_queue.put(p)
+		self.send(p)
+		
+	def finishTiming(self, timing):
+		"""
+		Record the timing of a command whose RESPONSE is written
+		"""
+		timing.finish(self._metrics)
+		logger.info("[%s] Timing: %s", timing.guid, timing)
+		
+	def dispatch(self, event, value=None):
+		"""
+		Queue an event for the run loop, used by the reader and writer threads
+		"""
+		self._events.put((event, value))
+		
+	def nextEvent(self, block=True):
+		"""
+		Wait for the next event of the reader or writer thread and return the received
+		packet if any. The errors of the threads are raised here.
+		
+		@param block: when False, raise Queue.Empty if there is no event yet
+		"""
+		event, value = self._events.get(block)
+		if event == self.ERROR:
+			raise value[0], value[1], value[2]
+		if event == self.WRITTEN:
+			self.finishTiming(value)
+		elif event == self.PACKET:
+			return value
+		return None
 		
 	def addToPacketPool(self, packet):
 		"""
 		Add a packet in pool of packets for waiting all of them
 		"""
+		if packet.number in self._packet_pool.get(packet.guid, ()):
+			self._link.add('retransmits')
 		self._packet_pool.setdefault(packet.guid, dict())[packet.number] = packet
-		print self._packet_pool
+		logger.debug("[%s] Packet %d/%d added to the pool", packet.guid, packet.number, packet.count)
 		
 	def isPacketPoolCompleteForPacket(self, packet):
 		"""
@@ -461,7 +1330,6 @@ class Service(object):
 		Merge all packets together in a big huge packet
 		"""
 		np = len(self._packet_pool.get(guid, dict()).keys())
-		print np
 		up = []
 		for i in range(1, np+1):
 			try:
@@ -470,7 +1338,7 @@ class Service(object):
 				logger.error("Error decoding a sequence of packets: %r" % self._packet_pool.get(guid).keys())
 				return None
 			up.append(p.body)
-		return Packet(p.guid, p.type, ''.join(up), np, np)
+		return Packet(p.guid, p.type, ''.join(up), np, np, p.flags)
 		
 	def removeFromPacketPoolForGUID(self, guid):
 		"""
@@ -495,6 +1363,8 @@ class Service(object):
 					else:
 						if (time.time() - self._logic_timeout) > 30.0:
 							logger.debug("LOGIC TIMEOUT detected, looking for new packet")
+							self._link.add('logic_timeouts')
+							self._link.add('resync_bytes')
 							_, _, _, guid, pn, pc = Packet.unpackHeader(self._buffer)
 							self.send(Packet.newWithRECEIVED(guid, pn, pc, timeout=True))
 							self._buffer = self._buffer[1:]
@@ -505,21 +1375,30 @@ class Service(object):
 						logger.debug("Valid footer received")
 						try:
 							last_packet = Packet.fromString(self._buffer)
-							logger.debug("Packet received: %r" % last_packet)
+							logger.debug("Packet received: %r", last_packet)
 							self._buffer = self._buffer[len(last_packet):]
-							if last_packet.isSinglePacket():
+							self._link.add('frames_in')
+							self._peer_flags = last_packet.flags
+							# DATA fragments are written to disk as they come, see processData
+							if last_packet.type == DATA:
 								return last_packet
+							# a RECEIVED numbered n/count acknowledges a fragment, it is not one
+							if last_packet.isSinglePacket() or last_packet.type == RECEIVED:
+								return self.decode(last_packet)
 							else:
 								# we store this packet in the pool for later aggregation
 								self.addToPacketPool(last_packet)
 								if self.isPacketPoolCompleteForPacket(last_packet):
+									if last_packet.type == RESPONSE:
+										# the sender waits for the RECEIVED of every fragment
+										self.send(Packet.newWithRECEIVED(last_packet.guid, last_packet.number, last_packet.count))
 									# aggregation
 									p = self.aggregatePacketsFromGUID(last_packet.guid)
 									# remove
 									self.removeFromPacketPoolForGUID(last_packet.guid)
 									if p:
-										logging.debug("[%r] Aggregate multiple packets" % p.guid)
-										return p
+										logger.debug("[%r] Aggregate multiple packets", p.guid)
+										return self.decode(p)
 								else:
 									# send the received packet to keep reading the new ones, at this point
 									# we can't check if the XML is valid or the BASE64 data are ok, we wait to
@@ -527,18 +1406,17 @@ class Service(object):
 									self.send(Packet.newWithRECEIVED(last_packet.guid, last_packet.number, last_packet.count))
 						except ValueError, ve:
 							logger.critical("Error decoding packet: %s" % ve)
+							if isinstance(ve, CRCError):
+								self._link.add('crc_errors')
+							else:
+								self._link.add('framing_errors')
+							self._link.add('resync_bytes')
 							# todo: send a response with error crc not valid
 							self._buffer = self._buffer[1:]
 							del ve
 					else:
 						# wait for more bytes
-						p = len(self._buffer)
-						v = self.sp.read(SERIAL_MIN_READ)
-						self._buffer += v 
-						if v:
-								self._last_data = time.time()
-						if p != len(self._buffer):
-							logger.debug("Reading: buffer size %d - %r" % (len(self._buffer), v))
+						self.readSerial(self._readTimeout(started, timeout))
 				else:
 					# skip bytes looking for a new magic number
 					self._buffer = self._buffer[1:]
@@ -546,47 +1424,82 @@ class Service(object):
 					while len(self._buffer) > 0 and self._buffer[0] != chr(0x02) and s < 5000:
 						self._buffer = self._buffer[1:]
 						s = s + 1
+					self._link.add('resync_bytes', s + 1)
 					logger.debug("Header not found: skipped %d byte from read buffer" % s)
 			else:
 				# wait for more bytes
 				self._logic_timeout = None
-				p = len(self._buffer)
-				v = self.sp.read(SERIAL_MIN_READ)
-				self._buffer += v
-				if v:
-						self._last_data = time.time()
-				if p != len(self._buffer):
-					logger.debug("Reading: buffer size %d - %r" % (len(self._buffer), v))
+				self.readSerial(self._readTimeout(started, timeout))
+
+	def _readTimeout(self, started, timeout):
+		"""
+		Return the seconds a serial read can wait without overrunning the timeout of read.
+		"""
+		if not timeout:
+			return SERIAL_READ_TIMEOUT
+		return min(SERIAL_READ_TIMEOUT, max(0, started + timeout - time.time()))
+
+	def readSerial(self, timeout):
+		"""
+		Append to the read buffer the bytes available on the serial port, returning as soon
+		as some are received.
+		
+		@param timeout: seconds to wait for the first byte
+		"""
+		v = self.sp.read_available(SERIAL_MAX_READ, timeout)
+		self._buffer += v
+		if v:
+			self._last_data = time.time()
+			self._link.add('bytes_in', len(v))
+			self._trace.trace('IN', v)
+			logger.debug("Reading: buffer size %d - %s", len(self._buffer), Hexdump(v))
 
 	def start(self):
 		"""
 		Start the service by opening the serial port.
+		
+		With the port -L{PORT_AUTO} the channels to the host are probed (-L{probePorts}) and the
+		fastest one that opens with the host end connected is used, the serial port when the
+		machine has no other.
 		"""
 		logger.info("Opening serial")
 		c = self._args['SERIAL']
-		if c['port'] == '0': 
-			port = 0
+		if c['port'] == PORT_AUTO:
+			ports = probePorts(c)
+		elif c['port'] == '0': 
+			ports = [0]
 		else:
-			port = c['port']
-		try:
-			self.sp = self._serial_class(port=port,
-										 baudrate=c['baudrate'],
-										 bytesize=int(c['bytesize']),
-										 parity=c['parity'],
-										 stopbits=float(c['stopbits']),
-										 timeout=1)
-										 
-		except AttributeError:
-			# happens when the installed pyserial is older than 2.5. use the
-			# Serial class directly then.
-			logger.critical("Serial attribute Error")
-		logger.info("Serial port open with success: %r", self.sp)
+			ports = [c['port']]
+		for i in range(len(ports)):
+			transport = transportFor(ports[i])
+			try:
+				self.sp = transport.open(self._serial_class, ports[i], c)
+			except AttributeError:
+				# happens when the installed pyserial is older than 2.5. use the
+				# Serial class directly then.
+				logger.critical("Serial attribute Error")
+			except IOError, e:
+				# SerialException, the next channel is slower
+				if i == len(ports) - 1:
+					raise
+				logger.info("Channel %s %r not available: %s", transport, ports[i], e)
+				continue
+			if i < len(ports) - 1 and not transport.connected(self.sp):
+				logger.info("Channel %s %r not connected by the host", transport, ports[i])
+				self.sp.close()
+				self.sp = None
+				continue
+			self.transport = transport
+			break
+		logger.info("Serial port open with success: %r (%s)", self.sp, self.transport)
 
 	def run(self, check=lambda: 1):
 		"""
 		Start reading from serial port managing any requested command.
 		"""
 		logger.info("Service version: %s" % getServiceVersion())
+		# once, the lookups of the commands only read the module manifests
+		migrateModuleManifests()
 		# Recovering from a restart ?
 		rg = getRestartGUID(remove=True)
 		if rg != None:
@@ -596,22 +1509,46 @@ class Service(object):
 			self._threads[p.guid] = ReplyResponseObserver(Packet.newWithRESPONSE(p.guid, "Success", "", t))
 			self.send(p)
 		
+		reader = SerialReader(self, name='serial reader')
+		self._writer = SerialWriter(self, name='serial writer')
+		self._writer.start()
+		reader.start()
+		try:
+			return self._dispatch(check)
+		finally:
+			reader.stopping = True
+			self._writer.stop()
+			self._writer.join(WRITER_STOP_TIMEOUT)
+			self._writer = None
+			reader.join(SERIAL_READ_TIMEOUT * 2)
+			self.saveMetrics()
+		
+	def _dispatch(self, check):
+		"""
+		Run loop: process the received packets and the queued commands
+		"""
 		# we store the number of threads before starting accepting any requer
-		# because we monitor its value to undertand when a blocking task can start
-		# Normal values is 1 but under windows services its 2.
+		# because we monitor its value to undertand when a blocking task can start:
+		# the service threads (reader, writer, log handler...) are running already,
+		# only the command threads come and go
 		base_threads = threading.activeCount()
 		while not self._quit and check():
-			# read from the serial waiting for a packer or timeout
-			p = self.read(timeout=1.0)
+			# wait for a packet, the reader wakes us up at least every SERIAL_READ_TIMEOUT
+			p = self.nextEvent()
 			if p: 
 				self.processPacket(p)
+				# answer the packets already received before spawning the commands, their
+				# RECEIVED are written together
+				try:
+					while True:
+						p = self.nextEvent(False)
+						if p: self.processPacket(p)
+				except Empty:
+					pass
 			elif self.idleTime() > IDLE_TIMEOUT:
 				self.send(Packet.newWithACK(guidFromInt(0)))
-			# process AUTHRESPONSE commands generated by running threads
-			while not self._out_queue.empty():
-				p = self._out_queue.get()
-				self.send(p)
-				#self._out_queue.task_done()
+			if self._unacked:
+				self.resendFragments()
 			# are all done ?
 			done = threading.activeCount() == base_threads
 			# if all done and the queue processig is stopped we can restart it
@@ -636,7 +1573,29 @@ class Service(object):
 						done = False
 			else:
 				logger.debug("Waiting for non blocking process to terminate: %d" % threading.activeCount())
+			# the commands still queued wait for the blocking mode to end
+			if self._command_queue_process == False:
+				for c in self._command_queue: c.timing.block()
+			if time.time() - self._metrics_saved > METRICS_SAVE_INTERVAL:
+				self._link.sample()
+				self.saveMetrics()
+			if time.time() - self._link_logged > LINKSTATS_LOG_INTERVAL:
+				self._link_logged = time.time()
+				logger.info("Link statistics: %s", self._link)
 		return self._quit
+		
+	def saveMetrics(self):
+		"""
+		Save the command metrics and link statistics if they changed since the last save
+		"""
+		self._metrics_saved = time.time()
+		link = self._link.values()
+		if not self._metrics.changed and link == self._link_saved: return
+		self._link_saved = link
+		try:
+			self._metrics.save(getMetricsFileName())
+		except (IOError, OSError), e:
+			logger.error("Error saving metrics: %s", e)
 
 	def processCommand(self, p):
 		"""
@@ -648,51 +1607,121 @@ class Service(object):
 		assert p.type == COMMAND, "Packet with type COMMAND expected"
 		
 		# parse the body looking for commandString and binaryData
-		logger.debug("XML: %r" % p.body)
+		logger.debug("XML: %s", Excerpt(p.body))
 		if p.body.startswith('?'): p.body = p.body[1:]
+		tf = ""
 		try:
-			xml = et.fromstring(p.body)
-		except et.ParseError, pe:
-			logger.critical("Malformed xml: %s" % pe)
-			self._threads[p.guid] = ReplyResponseObserver(Packet.newWithRESPONSE(p.guid, "Error"))
-			self.send(Packet.newWithAUTHRESPONSE(p.guid))
-			return
-		if xml.tag != "command":
-			logger.critical("Malformed command xml received: expected tag 'command' received '%s'" % xml.tag)
-			self._threads[p.guid] = ReplyResponseObserver(Packet.newWithRESPONSE(p.guid, "Error"))
-			self.send(Packet.newWithAUTHRESPONSE(p.guid))
-			return
-		cs = list(xml.findall("commandString"))
-		if len(cs) != 1:
-			logger.critical("Malformed command xml received: expected 1 tag 'commandString' received %d tags" % len(cs))
-			self._threads[p.guid] = ReplyResponseObserver(Packet.newWithRESPONSE(p.guid, "Error"))
-			self.send(Packet.newWithAUTHRESPONSE(p.guid))
+			cmd, bd = decodeCommandBody(p.body)
+			if isinstance(bd, AttachedData):
+				# the binary data was received in DATA packets
+				tf = self.takeAttachment(p.guid, bd.size)
+				bd = None
+		except CommandBodyError, e:
+			logger.critical(str(e))
+			self.rejectCommand(p.guid, str(e))
 			return
-		cmd = cs[0].text
-		bd = list(xml.findall("binaryData"))
 		
-		if len(bd) == 1:
-			try:
-				bd = base64.b64decode(bd[0].text)
-			except TypeError, te:
-				logger.critical("Malformed base64encoded binary data: %s" % te)
-				self._threads[p.guid] = ReplyResponseObserver(Packet.newWithRESPONSE(p.guid, "Error"))
-				self.send(Packet.newWithAUTHRESPONSE(p.guid))
-				return
+		if bd != None:
 			# Save binary data in a temporary file and store its path
 			tf = os.path.join(tempfile.gettempdir(), p.guid)
 			open(tf, "wb").write(bd)
-			bd = tf
-		else:
-			bd = ""
 			
 		# We answer that we have received it
 		p = Packet.newWithRECEIVED(p.guid)
 		self.send(p)
 
 		# Add the new request in a queue processed by the main loop
-		c  = Command(cmd, p.guid, bd)
+		if p.guid in self._threads or p.guid in [c.guid for c in self._command_queue]:
+			self._link.add('retransmits')
+		c  = Command(cmd, p.guid, tf)
 		self._command_queue.append(c)
+		
+	def rejectCommand(self, guid, message):
+		"""
+		Answer the COMMAND guid with an Error RESPONSE, sent when the host asks for it with its
+		AUTHRESPONSE
+		
+		@param message: the reason, as result message of the RESPONSE
+		"""
+		reply = Packet.newWithRESPONSE(guid, "Error", result_message=message)
+		self._threads[guid] = ReplyResponseObserver(reply)
+		self.send(Packet.newWithAUTHRESPONSE(guid))
+		
+	def processData(self, p):
+		"""
+		Process Packet with type DATA: write it to the file of its guid and acknowledge the
+		fragments but the last one, the COMMAND is acknowledged instead.
+		The data is dropped in case of errors, the COMMAND then fails.
+		
+		@param p: Instance of Packet
+		"""
+		assert p.type == DATA, "Packet with type DATA expected"
+		a = self._attachments.get(p.guid)
+		if a != None and a.count != p.count:
+			# the host started again with another fragment size
+			a.abort()
+			a = None
+		if a == None:
+			if p.number != 1:
+				logger.error("[%s] DATA %d/%d received without the previous ones", p.guid, p.number, p.count)
+				return
+			try:
+				a = Attachment(p)
+			except (IOError, OSError), e:
+				logger.error("[%s] Error creating the DATA file: %s", p.guid, e)
+				return
+			self._attachments[p.guid] = a
+		if p.number < a.next:
+			self._link.add('retransmits')
+		elif p.number > a.next:
+			logger.error("[%s] DATA %d/%d received, %d expected", p.guid, p.number, p.count, a.next)
+			a.abort()
+			del self._attachments[p.guid]
+			return
+		else:
+			try:
+				if a.write(p):
+					logger.info("[%s] DATA received: %d bytes", p.guid, a.size)
+					del self._attachments[p.guid]
+					self._received[p.guid] = a
+					return
+			except (ValueError, IOError, OSError), e:
+				logger.error("[%s] Error writing DATA %d/%d: %s", p.guid, p.number, p.count, e)
+				a.abort()
+				del self._attachments[p.guid]
+				return
+		if p.number < p.count:
+			self.send(Packet.newWithRECEIVED(p.guid, p.number, p.count))
+			
+	def takeAttachment(self, guid, size):
+		"""
+		Return the path of the binary data received in the DATA packets of guid: only the one of
+		an Attachment completed for guid, never a file found on disk.
+		
+		@param size: size of the data announced by the COMMAND
+		@raise CommandBodyError: if the data is incomplete or its size is not the one announced
+		"""
+		a = self._attachments.pop(guid, None)
+		if a != None:
+			a.abort()
+			raise CommandBodyError("DATA incomplete: %d/%d packets received" % (a.next - 1, a.count))
+		# kept for a retransmitted COMMAND
+		a = self._received.get(guid)
+		if a == None:
+			raise CommandBodyError("DATA not received")
+		if a.size != size:
+			raise CommandBodyError("DATA size %d, %d expected" % (a.size, size))
+		return a.path
+		
+	def sendCommand(self, guid, command, data=None):
+		"""
+		Send a COMMAND with its binary data if any: in DATA packets when the peer accepts them,
+		in the binaryData element otherwise.
+		"""
+		attached = data != None and self.peerAccepts(HEADER_FLAG_DATA)
+		if attached:
+			self.send(Packet.newWithDATA(guid, data))
+		self.send(Packet.newWithCOMMAND(guid, command, data, attached))
 
 	def processAuthResponse(self, p):
 		"""
@@ -703,9 +1732,13 @@ class Service(object):
 		assert p.type == AUTHRESPONSE, "Packet with type AUTHRESPONSE expected"
 		try:
 			co = self._threads[p.guid]
+			timing = co.timing
+			if timing: timing.lap('auth')
 			reply = co.responsePacket()
-			self.send(reply)
+			if timing: timing.lap('serialize')
+			self.send(reply, None, timing)
 			del self._threads[p.guid]
+			self._received.pop(p.guid, None)
 		except KeyError:
 			logger.error("Response requested for an unknow packet id: %s" % p.guid)
 			reply = Packet.newWithRESPONSE(p.guid, "Error")
@@ -725,12 +1758,15 @@ class Service(object):
 			logger.info("[%s] COMMAND Received" % p.guid)
 			self.processCommand(p)
 		if p.type == RECEIVED:
-			pass
+			if not p.isSinglePacket():
+				self.acknowledgeFragment(p)
 		if p.type == AUTHRESPONSE:
 			logger.info("[%s] AUTHRESPONSE Received for request" % p.guid)
 			self.processAuthResponse(p)
 		if p.type == RESPONSE:
 			logger.error("[%s] RESPONSE Received for request" % p.guid)
+		if p.type == DATA:
+			self.processData(p)
 
 	def spawnCommand(self, cmd):
 		"""
@@ -739,11 +1775,12 @@ class Service(object):
 		assert isinstance(cmd, Command), "Expected an instance of type command" 
 		if cmd.command == 'restart' or cmd.command.startswith('updateSoftware'):
 			saveRestartGUID(cmd.guid)
-		timeout = self._args['TIMEOUT'].get(cmd.moduleName(), self._command_timeout)
+		timeout = self._args['TIMEOUT'].get(cmd.moduleName(), cmd.timeout(self._command_timeout))
 		try:
 			timeout = int(timeout)
 		except ValueError:
 			timeout = self._command_timeout
+		cmd.timing.unqueue()
 		co = cmd.spawn(timeout, self)
 		self._threads[cmd.guid] = co
 		co.start()
@@ -768,7 +1805,7 @@ class Service(object):
 		
 		test = [guidFromInt(k+1) for k in range(N_DEBUG_REQUEST)]
 		for k in test:
-			self.send(Packet.newWithCOMMAND(k, command, bd))
+			self.sendCommand(k, command, bd)
 
 		while len(test) != 0:
 			r = self.read()
@@ -787,6 +1824,7 @@ def parseArgs(command_line, silent=False):
 		configuration dictionary generated by parsing passed arguments using ArgumentParser
 		ArgumentParser.Namespace
 	"""
+	import serial
 	parser = argparse.ArgumentParser(
 		description='Execute commands received through the serial port', fromfile_prefix_chars='@')
 		
@@ -801,7 +1839,9 @@ def parseArgs(command_line, silent=False):
 	conf_from_ini = getConfigurationFromINI()
 
 	# serial port arguments
-	parser.add_argument('--port', help='serial port (default: open first serial port)', dest='serial_port', default=conf_from_ini['SERIAL']['port'])
+	parser.add_argument('--port', help='serial port, URL like socket://host:port, vsock://cid:port, virtio://name, or auto to open the fastest channel to the host, the first serial port when there is no other (default: %(default)s)', dest='serial_port', default=conf_from_ini['SERIAL']['port'])
+	parser.add_argument('--vsock-port', help='vsock port of the host tried by --port auto, empty to skip vsock (default: %(default)s)', dest='vsock_port', default=conf_from_ini['SERIAL']['vsock_port'])
+	parser.add_argument('--virtio-name', help='name of the virtio-serial port tried by --port auto, empty to skip it (default: %(default)s)', dest='virtio_name', default=conf_from_ini['SERIAL']['virtio_name'])
 	parser.add_argument('--baudrate', help='serial port baudrate (default: %(default)s)', dest='baudrate', type=int, default=conf_from_ini['SERIAL']['baudrate'])
 	parser.add_argument('--bytesize', help='serial port bytesize (default: %(default)s)', dest='bytesize',
 		choices=[serial.FIVEBITS, serial.SIXBITS, serial.SEVENBITS, serial.EIGHTBITS], default=conf_from_ini['SERIAL']['bytesize'])
@@ -819,6 +1859,8 @@ def parseArgs(command_line, silent=False):
 	parser.add_argument('--log', help='enable logging to file (default: %(default)s)', dest='log', default=conf_from_ini['LOG']['file'])
 	parser.add_argument('--log-level', help='log level (default: %(default)s)', dest='log_level', default=conf_from_ini['LOG']['level'])
 	parser.add_argument('--log-syslog', help='enable logging to syslog server', dest='syslog_address', default=conf_from_ini['LOG']['syslog_address'])
+	parser.add_argument('--log-max-bytes', help='rotate the log file when it reaches this size, 0 to never rotate (default: %(default)s)', dest='log_max_bytes', type=int, default=conf_from_ini['LOG']['max_bytes'])
+	parser.add_argument('--log-queue-size', help='log records buffered before dropping them (default: %(default)s)', dest='log_queue_size', type=int, default=conf_from_ini['LOG']['queue_size'])
 	parser.add_argument('--pid', help='PID file path', dest='pid', metavar='PATH')
 	parser.add_argument('--daemon', help='daemonize', dest='daemon', action='store_true')
 	
@@ -834,7 +1876,13 @@ def shellRun(config, args):
 	"""
 	global logger
 	logger = configureLogging(config)
-	
+	try:
+		return _shellRun(config, args)
+	finally:
+		shutdownLogging(logger)
+		
+def _shellRun(config, args):
+	import serial
 	# start the service
 	s = Service(config)
 	try:
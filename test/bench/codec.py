@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the packet codec.
+
+Measures the throughput (MB/s of payload) of the Packet encoding and decoding
+paths for each payload size, saves the results as JSON and compares them
+with a baseline:
+
+$ cd test/bench && python codec.py --save baseline.json
+$ python codec.py --baseline baseline.json --threshold 15
+
+exits with 1 when a benchmark is slower than the baseline by more than
+THRESHOLD percent.
+"""
+
+import common, argparse, binascii, json, random, struct, sys, time
+from xml.sax.saxutils import escape
+import tools, service
+
+SIZES = (100, 10 * 1024, 1024 * 1024, 50 * 1024 * 1024)
+
+# size of the parts of a multi-packet message aggregated by the service
+PART_SIZE = 64 * 1024
+
+GUID = tools.guidFromInt(1)
+
+
+def payload(size, seed=0):
+    r = random.Random(seed)
+    chunk = ''.join([chr(r.randint(0, 255)) for i in range(4096)])
+    return (chunk * (size / len(chunk) + 1))[:size]
+
+
+def text(size):
+    # output of a command, with characters to escape
+    line = 'eth0 <up> mtu 1500 & "inet" 10.0.0.1\n'
+    return (line * (size / len(line) + 1))[:size]
+
+
+def benchToString(size):
+    p = service.Packet(GUID, service.RESPONSE, text(size))
+    return p.toString
+
+
+def benchFromString(size):
+    s = service.Packet(GUID, service.RESPONSE, text(size)).toString()
+    return lambda: service.Packet.fromString(s)
+
+
+def benchHasValidPacketHeader(size):
+    s = service.Packet(GUID, service.RESPONSE, text(size)).toString()
+    return lambda: service.Packet.hasValidPacketHeader(s)
+
+
+def benchNewWithCOMMAND(size):
+    data = payload(size)
+    return lambda: service.Packet.newWithCOMMAND(GUID, 'upload test.py', data)
+
+
+def benchNewWithRESPONSE(size):
+    output = text(size)
+    return lambda: service.Packet.newWithRESPONSE(GUID, 'Success', 'osinfo', output)
+
+
+def legacyResponseFrame(guid, response_type, command_name, output_string):
+    """RESPONSE frame as built before the single copy builder, for comparison"""
+    rt = "<responseType>%s</responseType>" % response_type
+    rc = "<resultCode>%d</resultCode>" % 0
+    rm = "<resultMessage>%s</resultMessage>" % escape("")
+    cn = "<commandName>%s</commandName>" % escape(command_name)
+    os = "<outputString>%s</outputString>" % escape(output_string)
+    body = "<response>" + rt + rc + rm + cn + os + "</response>"
+    hb = struct.pack(service.PROTOCOL_HEADER, service.HEADER_MAGIC_NUMBER, service.RESPONSE,
+                     guid, 1, 1, "", len(body)) + body
+    crc = binascii.crc32(hb) & 0xffffffff
+    return hb + struct.pack(service.PROTOCOL_FOOTER, crc, service.FOOTER_MAGIC_NUMBER)
+
+
+def benchResponseFrame(size):
+    output = text(size)
+    return lambda: service.Packet.newWithRESPONSE(GUID, 'Success', 'osinfo', output).toString()
+
+
+def benchResponseFrameLegacy(size):
+    output = text(size)
+    return lambda: legacyResponseFrame(GUID, 'Success', 'osinfo', output)
+
+
+def benchAggregatePackets(size):
+    s = service.Service({'PLUGINS': {'command_timeout': '40'}})
+    body = text(size)
+    parts = [body[i:i + PART_SIZE] for i in range(0, len(body), PART_SIZE)]
+    for n, part in enumerate(parts):
+        s.addToPacketPool(service.Packet(GUID, service.COMMAND, part, n + 1, len(parts)))
+    return lambda: s.aggregatePacketsFromGUID(GUID)
+
+
+BENCHMARKS = (
+    ('toString', benchToString),
+    ('fromString', benchFromString),
+    ('hasValidPacketHeader', benchHasValidPacketHeader),
+    ('newWithCOMMAND', benchNewWithCOMMAND),
+    ('newWithRESPONSE', benchNewWithRESPONSE),
+    ('responseFrame', benchResponseFrame),
+    ('responseFrameLegacy', benchResponseFrameLegacy),
+    ('aggregatePacketsFromGUID', benchAggregatePackets),
+)
+
+
+def measure(function, repeat, min_time=0.2):
+    """Return the best seconds per call, calibrating the calls per round to last min_time"""
+    number = 1
+    while 1:
+        started = time.time()
+        for i in xrange(number):
+            function()
+        elapsed = time.time() - started
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for r in range(repeat - 1):
+        started = time.time()
+        for i in xrange(number):
+            function()
+        best = min(best, (time.time() - started) / number)
+    return best
+
+
+def run(names, sizes, repeat):
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        for size in sizes:
+            seconds = measure(setup(size), repeat)
+            key = '%s/%d' % (name, size)
+            results[key] = {'seconds': seconds, 'mbps': size / seconds / (1024 * 1024)}
+            print '%-32s %12.6f s %10.2f MB/s' % (key, seconds, results[key]['mbps'])
+            sys.stdout.flush()
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Return the (key, mbps, baseline mbps) slower than baseline by more than threshold percent"""
+    r = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        limit = baseline[key]['mbps'] * (100 - threshold) / 100.0
+        if result['mbps'] < limit:
+            r.append((key, result['mbps'], baseline[key]['mbps']))
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description='packet codec micro-benchmark')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)',
+                        metavar='name')
+    parser.add_argument('--sizes', type=lambda s: [int(v) for v in s.split(',')],
+                        default=SIZES, help='comma separated payload sizes in bytes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare with the JSON results of a previous run')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='allowed slowdown in percent (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run(args.names, args.sizes, args.repeat)
+    if args.save:
+        json.dump(results, open(args.save, 'w'), indent=1, sort_keys=True)
+    if args.baseline:
+        slower = regressions(results, json.load(open(args.baseline)), args.threshold)
+        for key, mbps, base in slower:
+            print 'REGRESSION %s: %.2f MB/s, baseline %.2f MB/s' % (key, mbps, base)
+        return len(slower) != 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os, sys
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, q):
+    """Nearest rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def resources():
+    """Return (cpu seconds of this process and its children, max RSS in KB or None)"""
+    t = os.times()
+    rss = None
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            rss /= 1024
+    except ImportError:
+        pass
+    return t[0] + t[1] + t[2] + t[3], rss
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Effective throughput of the negotiated compression on typical bodies.
+
+Each body is sent as the agent does, once to a host that does not advertise
+compression (plain frames) and once to a host that does (deflated body).
+The effective throughput is the body size over the time to deflate, transfer
+the frames at the line rate and inflate:
+
+$ cd test/bench && python compression.py
+$ python compression.py --level 1 --rates 5760,11520,104857600
+
+the rates are in bytes/sec, 5760 is a 57600 baud line with 10 bits per byte.
+"""
+
+import common, argparse, imp, os, random, sys, time
+import tools, service
+
+GUID = tools.guidFromInt(1)
+
+RATES = (5760, 11520, 1024 * 1024, 100 * 1024 * 1024)
+
+
+def loadPlugin(name):
+    return imp.load_source('serclient_' + name, os.path.join(common.ROOT, 'plugins', name + '.py'))
+
+
+def systemStatus():
+    """osinfo of a host with 16 cpus and 8 disks"""
+    systemstatus = loadPlugin('systemstatus')
+    cores = [{'id': str(c), 'used': '%.2f' % (c * 3.7 % 100)} for c in range(4)]
+    return systemstatus.formatSystemStatus({
+        'datetime': time.localtime(0),
+        'cpus': [{'value': 'Intel(R) Xeon(R) CPU E5-2680 v4 @ 2.40GHz', 'used': '%.2f' % (i * 5.3),
+                  'cores': cores} for i in range(16)],
+        'ram': {'total': '67430969344', 'available': '40218734592'},
+        'disks': [{'name': '/dev/sd%s1' % chr(97 + i), 'mount': '/data%d' % i,
+                   'total': str(1000204886016 - i), 'available': str(500107862016 + i * 4096)}
+                  for i in range(8)],
+    })
+
+
+def netConfigurations():
+    """netconf list of 8 adapters with 4 addresses each"""
+    netconf = loadPlugin('netconf')
+    top = netconf.Element('NetConfigurations')
+    for a in range(8):
+        netconf.formatNetworkAdapterConfig(top, {
+            'mac': '52:54:00:12:34:%02x' % a,
+            'configurations': [{'ip': '10.%d.%d.1' % (a, c), 'netmask': '255.255.255.0',
+                                'gateway': '10.%d.%d.254' % (a, c)} for c in range(4)],
+        })
+    return netconf.tostring(top)
+
+
+def commandOutput(size):
+    """Log lines as printed by exec, with characters to escape"""
+    r = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = '2016-03-%02d 10:%02d:%02d kernel: [%d.%06d] eth%d: <link up> rx=%d tx=%d & "ok"\n' % (
+            r.randint(1, 28), r.randint(0, 59), r.randint(0, 59), r.randint(0, 99999),
+            r.randint(0, 999999), r.randint(0, 3), r.randint(0, 1 << 30), r.randint(0, 1 << 30))
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)[:size]
+
+
+def bodies(size):
+    """(name, packet) of the typical bodies"""
+    r = random.Random(0)
+    binary = ''.join([chr(r.randint(0, 255)) for i in range(size)])
+    source = open(os.path.join(common.ROOT, 'service.py')).read()
+    return [
+        ('osinfo', service.Packet.newWithRESPONSE(GUID, 'Success', 'osinfo', systemStatus())),
+        ('netconf list', service.Packet.newWithRESPONSE(GUID, 'Success', 'netconf', netConfigurations())),
+        ('exec output', service.Packet.newWithRESPONSE(GUID, 'Success', 'exec', commandOutput(size))),
+        ('upload script', service.Packet.newWithCOMMAND(GUID, 'upload service.py', source)),
+        ('upload binary', service.Packet.newWithCOMMAND(GUID, 'upload data.bin', binary)),
+    ]
+
+
+def send(agent, p):
+    """Return (seconds to encode p, frames sent by the agent)"""
+    started = time.time()
+    frames = [k for f, k in agent.frames(agent.encode(p))]
+    return time.time() - started, frames
+
+
+class FramesPort(object):
+    """Return the frames to Service.read, drop what it writes"""
+
+    def __init__(self, frames):
+        self._frames = list(frames)
+
+    def read_available(self, size, timeout=None):
+        return self._frames.pop(0)
+
+    def write(self, data):
+        pass
+
+
+def receive(frames):
+    """Return the seconds to read, aggregate and inflate frames as the host does"""
+    host = service.Service({'PLUGINS': {'command_timeout': '40'}})
+    host.sp = FramesPort(frames)
+    started = time.time()
+    host.read()
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compression effective throughput')
+    parser.add_argument('--size', type=int, default=1024 * 1024,
+                        help='bytes of the exec output and of the binary upload')
+    parser.add_argument('--level', type=int, default=service.COMPRESS_LEVEL,
+                        help='zlib level (default: %(default)s)')
+    parser.add_argument('--rates', type=lambda s: [int(v) for v in s.split(',')],
+                        default=RATES, help='comma separated line rates in bytes/sec')
+    args = parser.parse_args()
+    service.COMPRESS_LEVEL = args.level
+
+    plain = service.Service({'PLUGINS': {'command_timeout': '40'}})
+    deflating = service.Service({'PLUGINS': {'command_timeout': '40'}})
+    deflating._peer_flags = service.HEADER_FLAG_INFLATE + service.HEADER_FLAG_FRAGMENTS
+
+    print '%-14s %9s %9s %6s %8s %8s  %s' % ('body', 'bytes', 'on wire', 'ratio', 'deflate', 'inflate',
+                                           '  '.join(['%17s' % ('%d B/s' % rate) for rate in args.rates]))
+    for name, p in bodies(args.size):
+        _, frames = send(plain, p)
+        wire = sum([len(k) for k in frames])
+        encode, frames = send(deflating, p)
+        deflated = sum([len(k) for k in frames])
+        decode = receive(frames)
+        rates = []
+        for rate in args.rates:
+            before = len(p.body) / (float(wire) / rate)
+            after = len(p.body) / (encode + float(deflated) / rate + decode)
+            rates.append('%8s > %-8s' % (size(before), size(after)))
+        print '%-14s %9d %9d %5.1f%% %6.1fms %6.1fms  %s' % (name, wire, deflated, deflated * 100.0 / wire,
+                                                           encode * 1000, decode * 1000, '  '.join(rates))
+
+
+def size(rate):
+    """rate as B/s, KB/s or MB/s in at most 8 characters"""
+    if rate < 1024:
+        return '%.0fB' % rate
+    if rate < 1024 * 1024:
+        return '%.1fK' % (rate / 1024)
+    return '%.1fM' % (rate / 1024 / 1024)
+
+if __name__ == '__main__':
+    sys.exit(main())
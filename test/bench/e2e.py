@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of the agent.
+
+A Service runs in a thread on a socket:// port (Service.start opens URLs)
+while a host simulator, listening on the other end of the socket, keeps
+CONCURRENCY commands in flight through the full COMMAND / RECEIVED /
+AUTHRESPONSE / RESPONSE cycle. The commands run the benchecho module
+(test/bench/modules) that answers with RESPONSE_SIZE bytes.
+
+$ cd test/bench && python e2e.py --commands 200 --concurrency 4
+
+service.py is the interpreter of the python modules, it must be executable
+as in an installed agent (chmod +x service.py).
+
+loop:// is not used: it is a single endpoint, the agent would read back its
+own packets.
+"""
+
+import common, argparse, os, random, select, socket, sys, threading, time
+import tools, service
+
+MODULES = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'modules')
+
+# junk inserted between two packets when noise is enabled, 0x02 would look
+# like the start of a header
+JUNK = ''.join([chr(c) for c in range(256) if c != 0x02])
+
+
+class SocketPort(object):
+    """The host side of the link"""
+
+    def __init__(self, sock):
+        self._socket = sock
+        # the RECEIVED of the fragments must not hold back the next COMMAND
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def read_available(self, size, timeout=None):
+        ready, _, _ = select.select([self._socket], [], [], timeout)
+        if not ready:
+            return ''
+        return self._socket.recv(size)
+
+    def write(self, data):
+        self._socket.sendall(data)
+
+
+class HostSimulator(service.Service):
+    """
+    Host side of the protocol, like Service.simulate but with many commands
+    in flight, payloads of the requested size and line noise.
+    """
+
+    def __init__(self, port, noise=0.0, seed=0):
+        service.Service.__init__(self, {'PLUGINS': {'command_timeout': '40'}})
+        self.sp = port
+        self._noise = noise
+        self._random = random.Random(seed)
+        self.latencies = []
+        self.errors = 0
+
+    def send(self, p, k=None):
+        if self._noise and self._random.random() < self._noise:
+            self.sp.write(''.join([self._random.choice(JUNK)
+                                   for i in range(self._random.randint(1, 16))]))
+        service.Service.send(self, p, k)
+
+    def bench(self, commands, concurrency, request_size, response_size,
+              stall_timeout=60):
+        data = None
+        if request_size:
+            data = ''.join([chr(self._random.randint(0, 255))
+                            for i in range(request_size)])
+        pending = {}
+        sent = 0
+        progress = time.time()
+        while len(self.latencies) + self.errors < commands:
+            while sent < commands and len(pending) < concurrency:
+                sent += 1
+                guid = tools.guidFromInt(sent)
+                pending[guid] = time.time()
+                self.sendCommand(guid, 'benchecho %d' % response_size, data)
+            p = self.read(timeout=1.0)
+            if p == None:
+                if time.time() - progress > stall_timeout:
+                    raise RuntimeError('no progress in %d seconds, %d commands pending'
+                                       % (stall_timeout, len(pending)))
+                continue
+            progress = time.time()
+            if p.type == service.AUTHRESPONSE:
+                self.send(service.Packet.newWithAUTHRESPONSE(p.guid))
+            elif p.type == service.RESPONSE and p.guid in pending:
+                started = pending.pop(p.guid)
+                if '<responseType>Success</responseType>' in p.body and \
+                        p.body.count('x') >= response_size:
+                    self.latencies.append(time.time() - started)
+                else:
+                    self.errors += 1
+
+
+class WriteCounter(object):
+    """Stand in front of the socket of a socket:// port to count its sendall
+    calls, one write syscall each for the small packets"""
+
+    def __init__(self, port):
+        self.calls = 0
+        self._socket = port._socket
+        port._socket = self
+
+    def sendall(self, data, *args):
+        self.calls += 1
+        return self._socket.sendall(data, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._socket, name)
+
+
+def addBenchModules():
+    """Make the modules of test/bench/modules available as plugins"""
+    type, upgradable, dirs = tools.MODULE_TYPES[tools.MODULE_PLUGINS]
+    tools.MODULE_TYPES[tools.MODULE_PLUGINS] = (type, upgradable, dirs + (MODULES,))
+
+
+def startAgent(url, prepare=None):
+    """Run a Service on the url port in a daemon thread, prepare is called
+    with the Service once the port is open"""
+    config = {
+        'SERIAL': {'port': url, 'baudrate': 115200,
+                   'bytesize': '8', 'parity': 'N', 'stopbits': '1'},
+        'PLUGINS': {'command_timeout': '40'},
+        'TIMEOUT': {},
+    }
+    agent = service.Service(config)
+    agent.start()
+    if prepare:
+        prepare(agent)
+    stop = threading.Event()
+    thread = threading.Thread(target=agent.run,
+                              kwargs={'check': lambda: not stop.isSet()})
+    thread.setDaemon(True)
+    thread.start()
+    return agent, stop, thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='agent end-to-end benchmark')
+    parser.add_argument('--commands', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--request-size', type=int, default=0,
+                        help='bytes of binary data sent with each command')
+    parser.add_argument('--response-size', type=int, default=100,
+                        help='bytes printed by each command')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='probability of junk bytes before a host packet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--advertise', action='store_true',
+                        help='the host advertises compression and DATA packets')
+    args = parser.parse_args()
+
+    if not os.access(tools.getPythonBin(), os.X_OK):
+        parser.error('%s is not executable' % tools.getPythonBin())
+
+    addBenchModules()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    agent, stop, thread = startAgent('socket://127.0.0.1:%d' % server.getsockname()[1])
+    sock, _ = server.accept()
+    host = HostSimulator(SocketPort(sock), args.noise, args.seed)
+    writes = WriteCounter(agent.sp)
+    if args.advertise:
+        host.advertiseFlags()
+
+    cpu, _ = common.resources()
+    started = time.time()
+    host.bench(args.commands, args.concurrency, args.request_size,
+               args.response_size)
+    elapsed = time.time() - started
+    cpu_end, rss = common.resources()
+    stop.set()
+    thread.join()
+
+    latencies = sorted(host.latencies)
+    print 'commands:     %d (%d errors)' % (len(latencies), host.errors)
+    print 'commands/sec: %.2f' % (args.commands / elapsed)
+    print 'latency p50:  %.3f s' % common.percentile(latencies, 0.5)
+    print 'latency p99:  %.3f s' % common.percentile(latencies, 0.99)
+    print 'cpu:          %.2f s (agent, simulator and commands)' % (cpu_end - cpu)
+    print 'agent writes: %.2f per command (%d frames)' % (writes.calls / float(args.commands),
+                                                          agent._link.frames_out)
+    if rss != None:
+        print 'max rss:      %d KB' % rss
+    print 'agent link:   %s' % agent._link
+    return host.errors != 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Round-trip latency of a single COMMAND.
+
+The host simulator of e2e.py sends COMMAND packets of --size bytes one at a
+time and measures the time until the agent answers with RECEIVED (the link
+and the packet decoding only) and with the RESPONSE (including the run of
+the benchecho module).
+
+$ cd test/bench && python latency.py --transport pty --commands 50
+
+pty runs the agent on the PosixSerial of a pseudo terminal, socket on
+socket://. --legacy-read makes the agent read with Serial.read as it did
+before read_available, that waits for the line to be silent for the whole
+port timeout.
+
+--background keeps a command printing that many bytes running during the
+measure, with the host reading at most --host-rate bytes/sec as on a slow
+line, to see the latency while a large RESPONSE is being sent:
+
+$ python latency.py --background 1000000 --host-rate 1000000
+"""
+
+import common, argparse, os, select, socket, sys, time
+import tools, service
+from e2e import HostSimulator, SocketPort, addBenchModules, startAgent
+
+
+class PtyPort(object):
+    """The host side of a pseudo terminal"""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def read_available(self, size, timeout=None):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return ''
+        return os.read(self._fd, size)
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self._fd, data):]
+
+
+class ThrottledPort(object):
+    """Read from port at most rate bytes/sec"""
+
+    def __init__(self, port, rate):
+        self._port = port
+        self._rate = rate
+
+    def read_available(self, size, timeout=None):
+        data = self._port.read_available(min(size, 4096), timeout)
+        time.sleep(len(data) / float(self._rate))
+        return data
+
+    def write(self, data):
+        self._port.write(data)
+
+
+class Background(object):
+    """Keep one command printing size bytes running"""
+
+    def __init__(self, size):
+        self.size = size
+        self.guid = None
+        self.count = 0
+
+    def start(self, host):
+        self.count += 1
+        self.guid = tools.guidFromInt(1000000 + self.count)
+        host.send(service.Packet.newWithCOMMAND(self.guid, 'benchecho %d' % self.size))
+
+    def handle(self, host, r):
+        """Handle r if it belongs to the background command"""
+        if r.guid != self.guid:
+            return False
+        if r.type == service.AUTHRESPONSE:
+            host.send(service.Packet.newWithAUTHRESPONSE(r.guid))
+        elif r.type == service.RESPONSE:
+            self.start(host)
+        return True
+
+
+def command(guid, size):
+    """A COMMAND packet of about size bytes running benchecho"""
+    p = service.Packet.newWithCOMMAND(guid, 'benchecho 0')
+    padding = max(size - len(p.toString()), 0)
+    return service.Packet.newWithCOMMAND(guid, 'benchecho 0', 'x' * padding)
+
+
+def roundTrip(host, p, background=None, timeout=60):
+    """Return the seconds until the RECEIVED and the RESPONSE of p"""
+    started = time.time()
+    received = None
+    host.send(p)
+    while time.time() - started < timeout:
+        r = host.read(timeout=1.0)
+        if r == None:
+            continue
+        if background and background.handle(host, r):
+            continue
+        if r.guid != p.guid:
+            continue
+        if r.type == service.RECEIVED and received == None:
+            received = time.time() - started
+        elif r.type == service.AUTHRESPONSE:
+            host.send(service.Packet.newWithAUTHRESPONSE(r.guid))
+        elif r.type == service.RESPONSE:
+            return received, time.time() - started
+    raise RuntimeError('no RESPONSE in %d seconds' % timeout)
+
+
+def legacyRead(agent):
+    agent.sp.read_available = lambda size, timeout=None: agent.sp.read(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='COMMAND round-trip latency')
+    parser.add_argument('--transport', choices=['pty', 'socket'], default='pty')
+    parser.add_argument('--commands', type=int, default=20)
+    parser.add_argument('--size', type=int, default=200,
+                        help='bytes of each COMMAND packet (at least the size of an empty one)')
+    parser.add_argument('--legacy-read', action='store_true',
+                        help='read with Serial.read(%d)' % service.SERIAL_MAX_READ)
+    parser.add_argument('--background', type=int, default=0,
+                        help='bytes printed by a command kept running during the measure')
+    parser.add_argument('--host-rate', type=int, default=0,
+                        help='bytes/sec read by the host (default: unlimited)')
+    args = parser.parse_args()
+
+    if not os.access(tools.getPythonBin(), os.X_OK):
+        parser.error('%s is not executable' % tools.getPythonBin())
+    addBenchModules()
+
+    prepare = None
+    if args.legacy_read:
+        prepare = legacyRead
+    if args.transport == 'pty':
+        master, slave = os.openpty()
+        agent, stop, thread = startAgent(os.ttyname(slave), prepare)
+        port = PtyPort(master)
+    else:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        agent, stop, thread = startAgent('socket://127.0.0.1:%d' % server.getsockname()[1], prepare)
+        sock, _ = server.accept()
+        port = SocketPort(sock)
+    if args.host_rate:
+        port = ThrottledPort(port, args.host_rate)
+    host = HostSimulator(port)
+
+    background = None
+    if args.background:
+        background = Background(args.background)
+        background.start(host)
+        # wait for the RESPONSE transfer to start
+        while background.count == 1:
+            r = host.read(timeout=1.0)
+            if r != None:
+                background.handle(host, r)
+                if r.type == service.AUTHRESPONSE:
+                    break
+
+    received, response = [], []
+    for i in range(args.commands):
+        r, t = roundTrip(host, command(tools.guidFromInt(i + 1), args.size), background)
+        received.append(r)
+        response.append(t)
+    stop.set()
+    # the agent may be writing a RESPONSE, read until it stops
+    while thread.isAlive():
+        host.read(timeout=0.2)
+
+    received.sort()
+    response.sort()
+    print 'commands:      %d x %d bytes over %s' % (args.commands, len(command(tools.guidFromInt(1), args.size)), args.transport)
+    print 'RECEIVED p50:  %.4f s' % common.percentile(received, 0.5)
+    print 'RECEIVED p99:  %.4f s' % common.percentile(received, 0.99)
+    print 'RESPONSE p50:  %.4f s' % common.percentile(response, 0.5)
+    print 'RESPONSE p99:  %.4f s' % common.percentile(response, 0.99)
+    if background:
+        print 'background:    %d commands of %d bytes' % (background.count, args.background)
+
+if __name__ == '__main__':
+    sys.exit(main())
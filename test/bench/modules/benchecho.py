@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark module: print SIZE bytes, after reading the binary data if any"""
+
+import sys
+
+size = int(sys.argv[1])
+if len(sys.argv) > 2:
+    open(sys.argv[2], 'rb').read()
+sys.stdout.write('x' * size)
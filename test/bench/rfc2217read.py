@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Receive throughput of RFC2217Serial.
+
+A stand-in server, a PortManager in front of loop:// as a hypervisor
+console would be, sends --size MB of random bytes (so IAC is escaped about
+once every 256 bytes) that the port reads with read(--chunk).
+
+$ cd test/bench && python rfc2217read.py --size 16
+"""
+
+import common, argparse, random, socket, sys, threading, time
+import serial
+from serial import rfc2217
+
+
+class StandInServer(object):
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.url = 'rfc2217://127.0.0.1:%d' % self.listener.getsockname()[1]
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._serve)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _serve(self):
+        self.connection, _ = self.listener.accept()
+        manager = rfc2217.PortManager(serial.serial_for_url('loop://'), self)
+        while True:
+            try:
+                data = self.connection.recv(4096)
+            except socket.error:
+                break
+            if not data:
+                break
+            for byte in manager.filter(data):
+                pass
+
+    def write(self, data):
+        self._lock.acquire()
+        try:
+            self.connection.sendall(data)
+        finally:
+            self._lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RFC2217Serial receive throughput')
+    parser.add_argument('--size', type=float, default=16, help='MB to receive')
+    parser.add_argument('--chunk', type=int, default=100000,
+                        help='bytes asked to each read')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    block = random.Random(args.seed)
+    block = ''.join([chr(block.randint(0, 255)) for i in range(1024 * 1024)])
+    server = StandInServer()
+    port = serial.serial_for_url(server.url, timeout=5)
+
+    def send():
+        left = size
+        while left > 0:
+            server.write(block[:left].replace(rfc2217.IAC, rfc2217.IAC_DOUBLED))
+            left -= len(block)
+    sender = threading.Thread(target=send)
+    sender.setDaemon(True)
+
+    cpu, _ = common.resources()
+    started = time.time()
+    sender.start()
+    left = size
+    while left > 0:
+        r = port.read(min(args.chunk, left))
+        if not r:
+            raise RuntimeError('read timeout, %d bytes left' % left)
+        left -= len(r)
+    elapsed = time.time() - started
+    cpu_end, _ = common.resources()
+    port.close()
+
+    print 'received: %.1f MB in %.2f s' % (size / 1048576.0, elapsed)
+    print 'rate:     %.1f MB/s' % (size / elapsed / 1048576)
+    print 'cpu:      %.2f s' % (cpu_end - cpu)
+
+if __name__ == '__main__':
+    sys.exit(main())
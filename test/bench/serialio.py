@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of PosixSerial read and write on a pseudo terminal pair.
+
+A thread on the master side of the pty feeds (or drains) --size bytes while
+the port reads them with read(--chunk) (or writes them with a single
+write). --legacy runs the implementations that grew a bytearray per
+os.read and copied the rest of the data after each partial os.write.
+
+$ cd test/bench && python serialio.py --size 8
+$ python serialio.py --size 8 --legacy
+"""
+
+import common, argparse, errno, os, select, sys, threading, time
+from serial import serialposix
+from serial.serialutil import portNotOpenError, writeTimeoutError
+
+
+class LegacySerial(serialposix.Serial):
+    def read(self, size=1):
+        if not self._isOpen: raise portNotOpenError
+        read = bytearray()
+        while len(read) < size:
+            ready,_,_ = select.select([self.fd],[],[], self._timeout)
+            if not ready:
+                break
+            read.extend(os.read(self.fd, size-len(read)))
+        return bytes(read)
+
+    def write(self, data):
+        if not self._isOpen: raise portNotOpenError
+        d = data
+        while d:
+            try:
+                d = d[os.write(self.fd, d):]
+            except OSError, v:
+                if v.errno != errno.EAGAIN:
+                    raise
+        return len(data)
+
+
+def feed(fd, data):
+    view = memoryview(data)
+    while len(view):
+        view = view[os.write(fd, view[:65536]):]
+
+
+def drain(fd, size):
+    while size > 0:
+        size -= len(os.read(fd, min(size, 65536)))
+
+
+def bench(serial_class, size, chunk):
+    """Return the seconds to read and to write size bytes"""
+    master, slave = os.openpty()
+    port = serial_class(os.ttyname(slave), timeout=5)
+    os.close(slave)
+    data = 'x' * size
+    try:
+        t = threading.Thread(target=feed, args=(master, data))
+        started = time.time()
+        t.start()
+        left = size
+        while left > 0:
+            r = port.read(min(chunk, left))
+            if not r:
+                raise RuntimeError('read timeout, %d bytes left' % left)
+            left -= len(r)
+        read = time.time() - started
+        t.join()
+
+        t = threading.Thread(target=drain, args=(master, size))
+        started = time.time()
+        t.start()
+        port.write(data)
+        t.join()
+        write = time.time() - started
+    finally:
+        port.close()
+        os.close(master)
+    return read, write
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PosixSerial throughput on a pty')
+    parser.add_argument('--size', type=float, default=8, help='MB to transfer')
+    parser.add_argument('--chunk', type=int, default=100000,
+                        help='bytes asked to each read')
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    classes = [serialposix.Serial, serialposix.PosixPollSerial]
+    if args.legacy:
+        classes = [LegacySerial]
+    for serial_class in classes:
+        read, write = bench(serial_class, size, args.chunk)
+        print '%-16s read %7.1f MB/s   write %7.1f MB/s' % (
+            serial_class.__name__, size / read / 1048576, size / write / 1048576)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of the socket:// port against a local echo server.
+
+A thread writes --size MB through the port while the main thread reads the
+echo back with read(--chunk).
+
+$ cd test/bench && python socketecho.py --size 64
+"""
+
+import common, argparse, socket, sys, threading, time
+import serial
+
+
+def echo(listener):
+    connection, _ = listener.accept()
+    while True:
+        data = connection.recv(65536)
+        if not data:
+            break
+        connection.sendall(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='socket:// echo throughput')
+    parser.add_argument('--size', type=float, default=64, help='MB to send')
+    parser.add_argument('--chunk', type=int, default=100000,
+                        help='bytes asked to each read')
+    parser.add_argument('--options', default='',
+                        help='URL options, e.g. /rcvbuf=1048576/sndbuf=1048576')
+    args = parser.parse_args()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    server = threading.Thread(target=echo, args=(listener,))
+    server.setDaemon(True)
+    server.start()
+    port = serial.serial_for_url('socket://127.0.0.1:%d%s'
+                                 % (listener.getsockname()[1], args.options), timeout=5)
+
+    size = int(args.size * 1024 * 1024)
+    block = 'x' * (1024 * 1024)
+    def send():
+        left = size
+        while left > 0:
+            port.write(block[:left])
+            left -= len(block)
+    writer = threading.Thread(target=send)
+    writer.setDaemon(True)
+
+    cpu, _ = common.resources()
+    started = time.time()
+    writer.start()
+    left = size
+    while left > 0:
+        r = port.read(min(args.chunk, left))
+        if not r:
+            raise RuntimeError('read timeout, %d bytes left' % left)
+        left -= len(r)
+    elapsed = time.time() - started
+    cpu_end, _ = common.resources()
+    port.close()
+
+    print 'echoed: %.1f MB in %.2f s' % (size / 1048576.0, elapsed)
+    print 'rate:   %.1f MB/s' % (size / elapsed / 1048576)
+    print 'cpu:    %.2f s' % (cpu_end - cpu)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -65,5 +65,26 @@ class TestModuleMngGet(unittest.TestCase, utils.Assert):
         result = utils.callRpcCommandError("modulemng get thismoduledoesnotexist")
 
 
+
+class TestModuleMngCache(unittest.TestCase, utils.Assert):
+    def testList(self):
+        tree = utils.callRpcCommand("modulemng cache list")
+
+        self.assertEquals('artifacts', tree.tag)
+
+        for artifact in tree.findall('artifact'):
+            self.assertHasChild(artifact, 'sha256')
+            self.assertHasChild(artifact, 'size')
+            self.assertHasChild(artifact, 'lastUsed')
+
+    def testPurge(self):
+        utils.callRpcCommand("modulemng cache purge", no_xml=True)
+        tree = utils.callRpcCommand("modulemng cache list")
+
+        self.assertEquals(0, len(tree.findall('artifact')))
+
+    def testPurgeInvalid(self):
+        result = utils.callRpcCommandError("modulemng cache purge %s" % ('0' * 64))
+
 if __name__ == '__main__':
     utils.main()
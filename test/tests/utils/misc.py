@@ -137,8 +137,10 @@ def restorePristineState():
         'path': api.env.aruba_host.install_path,
     }
 
-    api.run("test -f '%(path)s/plugins.tar' && ((%(rw)s) && tar -C '%(path)s' -x -f '%(path)s/plugins.tar' && rm '%(path)s/plugins.tar' && (%(ro)s))" % attrs)
-    api.run("(%(rw)s) && rm -f %(path)s/update/* %(path)s/usermodules/* %(path)s/plugins/*.version && (%(ro)s)" % attrs)
+    # the module metadata are in the manifest of each directory, legacy .version files are migrated
+    # into it: remove both before extracting the pristine ones
+    api.run("test -f '%(path)s/plugins.tar' && ((%(rw)s) && rm -f %(path)s/plugins/modules.ini %(path)s/plugins/*.version && tar -C '%(path)s' -x -f '%(path)s/plugins.tar' && rm '%(path)s/plugins.tar' && (%(ro)s))" % attrs)
+    api.run("(%(rw)s) && rm -f %(path)s/update/* %(path)s/usermodules/* && (%(ro)s)" % attrs)
 
 
 class FatalError(Exception):
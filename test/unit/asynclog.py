@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile, logging, threading
+import tools
+
+
+class BlockingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record):
+        self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+class TestAsyncHandler(unittest.TestCase):
+    def setUp(self):
+        self.target = BlockingHandler()
+        self.logger = logging.getLogger('serclient.test.async')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        self.target.gate.set()
+        tools.shutdownLogging(self.logger)
+
+    def testWritesInOrder(self):
+        h = tools.AsyncHandler([self.target], 100)
+        self.logger.addHandler(h)
+        for i in range(50):
+            self.logger.info('message %d', i)
+        h.flush()
+        self.assertEquals(['message %d' % i for i in range(50)],
+                          self.target.messages)
+
+    def testTargetLevel(self):
+        self.target.setLevel(logging.WARNING)
+        h = tools.AsyncHandler([self.target], 100)
+        self.logger.addHandler(h)
+        self.logger.debug('hidden')
+        self.logger.warning('shown')
+        h.flush()
+        self.assertEquals(['shown'], self.target.messages)
+
+    def testDropsWhenFull(self):
+        self.target.gate.clear()
+        h = tools.AsyncHandler([self.target], 2)
+        self.logger.addHandler(h)
+        for i in range(10):
+            self.logger.info('message %d', i)
+        # one record is held by the writer, two are queued
+        self.assertTrue(h.dropped >= 7)
+        dropped = h.dropped
+        self.target.gate.set()
+        h.flush()
+        self.logger.info('last')
+        h.flush()
+        prefix = 'Logging queue full: '
+        reported = [int(m[len(prefix):].split()[0])
+                    for m in self.target.messages if m.startswith(prefix)]
+        self.assertEquals(dropped, sum(reported))
+        self.assertEquals(10 - dropped + 1 + len(reported),
+                          len(self.target.messages))
+        self.assertEquals('last', self.target.messages[-1])
+
+    def testCloseWritesQueued(self):
+        h = tools.AsyncHandler([self.target], 100)
+        self.logger.addHandler(h)
+        for i in range(20):
+            self.logger.info('message %d', i)
+        tools.shutdownLogging(self.logger)
+        self.assertEquals(20, len(self.target.messages))
+        self.assertEquals([], self.logger.handlers)
+
+
+class TestConfigureLogging(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tools.shutdownLogging(logging.getLogger('serclient'))
+        shutil.rmtree(self.dir)
+
+    def testRotation(self):
+        path = os.path.join(self.dir, 'serclient.log')
+        logger = tools.configureLogging({'LOG': {
+            'level': str(logging.DEBUG), 'file': path, 'syslog_address': '',
+            'max_bytes': '1000', 'queue_size': '100'}})
+        self.assertTrue(isinstance(logger.handlers[0], tools.AsyncHandler))
+        for i in range(100):
+            logger.debug('line %d', i)
+        tools.shutdownLogging(logger)
+        self.assertTrue(os.path.exists(path + '.1'))
+        self.assertTrue(os.path.getsize(path) <= 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile, hashlib, time
+import tools
+
+from httpserver import HTTPServer
+
+MODULE = 'echo module\n' * 1000
+INSTALLER = 'installer' * 10000
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = tools.ArtifactCache(os.path.join(self.dir, 'cache'),
+                                         max_size=100000)
+        self.server = HTTPServer({
+            '/module': MODULE,
+            '/installer': INSTALLER,
+        }).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def testDownload(self):
+        path, headers = self.cache.download(self.server.url('/module'))
+
+        self.assertEquals(self.cache.path(sha256(MODULE)), path)
+        self.assertEquals(MODULE, open(path).read())
+        self.assertNotEquals(None, headers)
+
+    def testHitByDigest(self):
+        self.cache.download(self.server.url('/module'))
+        path, headers = self.cache.download(self.server.url('/module'),
+                                            sha256=sha256(MODULE))
+
+        self.assertEquals(MODULE, open(path).read())
+        self.assertEquals(None, headers)
+        self.assertEquals(1, len(self.server.requests))
+
+    def testHitByETag(self):
+        self.cache.download(self.server.url('/module'))
+        path, headers = self.cache.download(self.server.url('/module'))
+
+        self.assertEquals(MODULE, open(path).read())
+        self.assertEquals(None, headers)
+        # the second request is only a revalidation
+        self.assertEquals(['GET', 'HEAD'], self.server.methods)
+
+    def testChangedOnServer(self):
+        self.cache.download(self.server.url('/module'))
+        self.server._server.files['/module'] = MODULE + 'v2'
+        path, headers = self.cache.download(self.server.url('/module'))
+
+        self.assertEquals(MODULE + 'v2', open(path).read())
+        self.assertEquals(2, len(self.cache.entries()))
+        self.assertEquals(['GET', 'HEAD', 'GET'], self.server.methods)
+
+    def testEviction(self):
+        self.cache.download(self.server.url('/module'))
+        old = time.time() - 60
+        os.utime(self.cache.path(sha256(MODULE)), (old, old))
+        self.cache.download(self.server.url('/installer'))
+
+        self.assertEquals([sha256(INSTALLER)],
+                          [e['sha256'] for e in self.cache.entries()])
+        self.assertEquals([self.server.url('/installer')],
+                          self.cache.entries()[0]['urls'])
+
+    def testPurge(self):
+        self.cache.download(self.server.url('/module'))
+        self.cache.purge()
+
+        self.assertEquals([], self.cache.entries())
+        self.assertEquals(['cache'], os.listdir(self.dir))
+        self.assertEquals([], os.listdir(os.path.join(self.dir, 'cache')))
+
+    def testInvalidDigest(self):
+        victim = os.path.join(self.dir, 'victim')
+        open(victim, 'w').write('keep')
+        for name in ('../victim', '..', '0' * 63, 'g' * 64, '../' + '0' * 61):
+            self.assertRaises(ValueError, self.cache.path, name)
+            self.assertRaises(ValueError, self.cache.remove, name)
+            self.assertEquals(None, self.cache.get(name))
+        self.assertTrue(os.path.exists(victim))
+        self.assertFalse(self.cache.remove('0' * 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, base64, random
+import tools, service
+
+VALID = (
+    '<command><commandString>modulemng list</commandString></command>',
+    '<command><commandString>exec "ls -l" &gt; x</commandString></command>',
+    '<command><commandString>upload test.py</commandString>'
+    '<binaryData>%s</binaryData></command>' % base64.b64encode('print 1\n' * 10),
+    '<command><binaryData>YQ==</binaryData><commandString>a</commandString></command>',
+    '<?xml version="1.0"?>\n<command>\n  <commandString>osinfo</commandString>\n</command>',
+    '<command><commandString>caf\xc3\xa9</commandString></command>',
+)
+
+
+def reference(body):
+    """Decode body with the XML parser only"""
+    try:
+        cmd, bd, dp = service._parseCommandBody(body)
+        if not cmd or not cmd.strip():
+            raise service.CommandBodyError('empty')
+        if len(bd) != 1:
+            return cmd, None
+        return cmd, base64.b64decode(bd[0])
+    except (service.CommandBodyError, TypeError):
+        return None
+
+
+def decode(body):
+    try:
+        return service.decodeCommandBody(body)
+    except service.CommandBodyError:
+        return None
+
+
+class TestCommandBody(unittest.TestCase):
+    def testFastPath(self):
+        self.assertEquals(('modulemng list', None), decode(VALID[0]))
+        self.assertEquals(('upload test.py', 'print 1\n' * 10), decode(VALID[2]))
+        self.assertEquals(('a b', None), decode(
+            '<command><commandString>a b</commandString></command>'))
+
+    def testFallback(self):
+        self.assertEquals(('exec "ls -l" > x', None), decode(VALID[1]))
+        self.assertEquals(('a', 'a'), decode(VALID[3]))
+        self.assertEquals(('osinfo', None), decode(VALID[4]))
+        self.assertEquals((u'caf\xe9', None), decode(VALID[5]))
+
+    def testDataPacket(self):
+        self.assertEquals(('upload a.bin', service.AttachedData(5)), decode(
+            '<command><commandString>upload a.bin</commandString><dataPacket size="5"/></command>'))
+        self.assertEquals(('upload a.bin', service.AttachedData(0)), decode(
+            "<command><commandString>upload a.bin</commandString><dataPacket size='0' /></command>"))
+        p = service.Packet.newWithCOMMAND(tools.guidFromInt(1), 'upload <a>', 'data', True)
+        self.assertEquals(('upload <a>', service.AttachedData(4)), decode(p.body))
+
+    def testErrors(self):
+        for body, message in (
+                ('<command>', 'Malformed xml'),
+                ('<cmd><commandString>a</commandString></cmd>', "expected tag 'command'"),
+                ('<command></command>', "expected 1 tag 'commandString' received 0"),
+                ('<command><commandString></commandString></command>', 'empty'),
+                ('<command><commandString>  </commandString></command>', 'empty'),
+                ('<command><commandString>a</commandString><binaryData></binaryData></command>',
+                 'Malformed base64'),
+                ('<command><commandString>a</commandString><binaryData>YQ=</binaryData></command>',
+                 'Malformed base64'),
+                ('<command><commandString>%s</commandString></command>'
+                 % ('a' * (service.COMMAND_STRING_MAX_SIZE + 1)), 'too big'),
+                ('<command><commandString>a</commandString><binaryData>YQ==</binaryData>'
+                 '<dataPacket size="1"/></command>', "no 'binaryData'"),
+                ('<command><commandString>a</commandString><dataPacket/></command>', "size None"),
+                ('<command><commandString>a</commandString><dataPacket size="x"/></command>', "size 'x'"),
+                ('<command><commandString>a</commandString><dataPacket size="%d"/></command>'
+                 % (service.DATA_MAX_SIZE + 1), 'size %d' % (service.DATA_MAX_SIZE + 1))):
+            try:
+                service.decodeCommandBody(body)
+                self.fail('no error for %r' % body)
+            except service.CommandBodyError, e:
+                self.assertTrue(message in str(e), '%r: %s' % (body, e))
+
+    def testBodyLimit(self):
+        limit = service.COMMAND_BODY_MAX_SIZE
+        service.COMMAND_BODY_MAX_SIZE = 100
+        try:
+            self.assertRaises(service.CommandBodyError, service.decodeCommandBody, VALID[2])
+        finally:
+            service.COMMAND_BODY_MAX_SIZE = limit
+
+    def testFuzz(self):
+        r = random.Random(0)
+        alphabet = '<>/&;#x\x00\r\n\t ]]\xff=cabYQ' + 'commandStringbinaryData'
+        for i in range(3000):
+            body = list(r.choice(VALID))
+            for j in range(r.randint(1, 4)):
+                op = r.randint(0, 2)
+                pos = r.randint(0, len(body))
+                if op == 0:
+                    body.insert(pos, r.choice(alphabet))
+                elif op == 1 and body:
+                    del body[min(pos, len(body) - 1)]
+                elif body:
+                    body[min(pos, len(body) - 1)] = r.choice(alphabet)
+            body = ''.join(body)
+            self.assertEquals(reference(body), decode(body), repr(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
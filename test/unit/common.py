@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os, sys, imp
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+FILES = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'files')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def loadScript(path):
+    """Load a plugin/internal script (ie 'plugins/netconf.py') as a module"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    return imp.load_source('serclient_' + name, os.path.join(ROOT, path))
+
+
+def filePath(name):
+    return os.path.join(FILES, name)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile, hashlib, threading
+import tools
+
+from httpserver import HTTPServer
+
+DATA = ''.join(chr(i % 251) for i in range(300000))
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.target = os.path.join(self.dir, 'installer.bin')
+        self.server = HTTPServer({'/installer.bin': DATA}).start()
+        self.url = self.server.url('/installer.bin')
+        self.delay = tools.DOWNLOAD_RETRY_DELAY
+        tools.DOWNLOAD_RETRY_DELAY = 0
+
+    def tearDown(self):
+        tools.DOWNLOAD_RETRY_DELAY = self.delay
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def testDownload(self):
+        path, headers = tools.downloadFile(self.url, self.target,
+                                           sha256=hashlib.sha256(DATA).hexdigest())
+
+        self.assertEquals(self.target, path)
+        self.assertEquals(DATA, open(path, 'rb').read())
+        self.assertEquals(str(len(DATA)), headers['Content-Length'])
+        self.assertFalse(os.path.exists(path + tools.EXTENSION_PARTIAL))
+
+    def testResume(self):
+        self.server.dropAfter(100000, 50000)
+        tools.downloadFile(self.url, self.target)
+
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+        self.assertEquals([None, 'bytes=100000-', 'bytes=150000-'],
+                          [r for _, r in self.server.requests])
+
+    def testResumeBetweenCalls(self):
+        self.server.dropAfter(100000)
+        self.assertRaises(tools.DownloadError, tools.downloadFile,
+                          self.url, self.target, retries=0)
+        self.assertEquals(100000, os.path.getsize(
+            self.target + tools.EXTENSION_PARTIAL))
+
+        tools.downloadFile(self.url, self.target)
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+        self.assertEquals('bytes=100000-', self.server.requests[-1][1])
+
+    def testNoRangeSupport(self):
+        self.server.stop()
+        self.server = HTTPServer({'/installer.bin': DATA},
+                                 ranges=False).start()
+        self.server.dropAfter(100000)
+        tools.downloadFile(self.server.url('/installer.bin'), self.target)
+
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+
+    def testChecksumMismatch(self):
+        self.assertRaises(tools.DownloadError, tools.downloadFile,
+                          self.url, self.target, sha256='0' * 64)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(
+            self.target + tools.EXTENSION_PARTIAL))
+
+    def testPlantedPartial(self):
+        partial = self.target + tools.EXTENSION_PARTIAL
+        victim = os.path.join(self.dir, 'victim')
+        open(victim, 'wb').write('keep')
+        os.symlink(victim, partial)
+        tools.downloadFile(self.url, self.target)
+        self.assertEquals('keep', open(victim, 'rb').read())
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+        self.assertEquals([None], [r for _, r in self.server.requests])
+
+        # readable by the others: not resumed either
+        open(partial, 'wb').write(DATA[:1000])
+        os.chmod(partial, 0644)
+        tools.downloadFile(self.url, self.target)
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+        self.assertEquals([None, None], [r for _, r in self.server.requests])
+
+    def testPrivatePartial(self):
+        self.server.dropAfter(100000)
+        self.assertRaises(tools.DownloadError, tools.downloadFile,
+                          self.url, self.target, retries=0)
+        mode = os.stat(self.target + tools.EXTENSION_PARTIAL).st_mode
+        self.assertEquals(0600, mode & 0777)
+
+    def testConcurrent(self):
+        # another process is downloading the same target
+        lock = tools._lockFile(self.target + tools.EXTENSION_LOCK)
+        thread = threading.Thread(target=tools.downloadFile,
+                                  args=(self.url, self.target))
+        thread.start()
+        thread.join(0.5)
+        self.assertTrue(thread.isAlive())
+        self.assertEquals([], self.server.requests)
+        self.assertFalse(os.path.exists(
+            self.target + tools.EXTENSION_PARTIAL))
+
+        lock.close()
+        thread.join(10)
+        self.assertFalse(thread.isAlive())
+        self.assertEquals(DATA, open(self.target, 'rb').read())
+
+    def testDownloadPath(self):
+        path = tools.downloadPath(self.url)
+        self.assertEquals(tools.getArtifactCacheDirectory(), os.path.dirname(path))
+        self.assertFalse(path.startswith(tempfile.gettempdir()))
+
+    def testNotFound(self):
+        self.assertRaises(tools.DownloadError, tools.downloadFile,
+                          self.server.url('/missing'), self.target)
+        self.assertEquals(1, len(self.server.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run service.py with the given arguments (ie --exec script) timing the imports
+of modules not loaded yet; print on stderr the total import time in seconds
+and the imported modules, one per line.
+"""
+
+import sys, time, __builtin__
+
+_import = __builtin__.__import__
+_elapsed = [0.0]
+_depth = [0]
+
+
+def _timedImport(name, *args, **kwargs):
+    if _depth[0] or sys.modules.get(name) is not None:
+        return _import(name, *args, **kwargs)
+    _depth[0] += 1
+    started = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        _depth[0] -= 1
+        _elapsed[0] += time.time() - started
+
+
+def report():
+    sys.stderr.write('%f\n' % _elapsed[0])
+    for name in sorted(sys.modules):
+        if sys.modules[name] is not None:
+            sys.stderr.write(name + '\n')
+
+
+service = sys.argv[1]
+sys.argv = sys.argv[1:]
+sys.path.insert(0, '.')
+__builtin__.__import__ = _timedImport
+try:
+    execfile(service, {'__name__': '__main__', '__file__': service})
+finally:
+    report()
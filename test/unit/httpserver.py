@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading, re, hashlib
+import BaseHTTPServer, SocketServer
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('Range')))
+        server.methods.append(self.command)
+
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if server.etags and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if match and server.ranges:
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+
+        if server.etags:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        if not body:
+            return
+
+        body = data[start:]
+        if server.drops:
+            # simulate a broken connection after sending part of the body
+            body = body[:server.drops.pop(0)]
+        self.wfile.write(body)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class HTTPServer(object):
+    """
+    Local stand-in for the download server.
+
+    files maps a path (ie '/installer.bin') to its content; every entry of
+    drops cuts the body of one response after that many bytes.
+    """
+    def __init__(self, files, ranges=True, etags=True):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.files = files
+        self._server.ranges = ranges
+        self._server.etags = etags
+        self._server.drops = []
+        self._server.requests = []
+        self._server.methods = []
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    @property
+    def methods(self):
+        return self._server.methods
+
+    def dropAfter(self, *sizes):
+        self._server.drops.extend(sizes)
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self._server.server_address[1], path)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, sys, shutil, tempfile
+from StringIO import StringIO
+from elementtree import ElementTree as et
+import tools, service
+
+
+class FakeSerial(object):
+    def __init__(self, data=''):
+        self.data = data
+        self.written = []
+
+    def read_available(self, size, timeout=None):
+        r, self.data = self.data[:size], self.data[size:]
+        return r
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class TestLinkStats(unittest.TestCase):
+    def setUp(self):
+        self.service = service.Service({'PLUGINS': {'command_timeout': '40'}})
+
+    def receive(self, data, packets):
+        self.service.sp = FakeSerial(data)
+        for i in range(packets):
+            self.assertTrue(self.service.read(timeout=1) != None)
+
+    def testCounters(self):
+        ack = service.Packet.newWithACK(tools.guidFromInt(1)).toString()
+        bad = service.Packet.newWithACK(tools.guidFromInt(2)).toString()
+        bad = bad[:-5] + '\x00\x00\x00\x00' + bad[-1]
+        self.receive('garbage' + ack + bad + ack, 2)
+
+        link = self.service._link
+        self.assertEquals(len(ack) * 3 + 7, link.bytes_in)
+        self.assertEquals(2, link.frames_in)
+        self.assertEquals(1, link.crc_errors)
+        self.assertEquals(0, link.framing_errors)
+        # 7 garbage bytes, the bad packet minus the byte skipped on the crc error
+        self.assertEquals(7 + len(bad), link.resync_bytes)
+
+        self.service.send(service.Packet.newWithACK(tools.guidFromInt(1)))
+        self.assertEquals(1, link.frames_out)
+        self.assertEquals(len(ack), link.bytes_out)
+
+    def testRetransmit(self):
+        guid = tools.guidFromInt(3)
+        first = service.Packet(guid, service.COMMAND, 'a', 1, 2).toString()
+        second = service.Packet(guid, service.COMMAND, 'b', 2, 2).toString()
+        self.receive(first + first + second, 1)
+        self.assertEquals(1, self.service._link.retransmits)
+        self.assertEquals(3, self.service._link.frames_in)
+
+    def testThroughput(self):
+        link = tools.LinkStats()
+        started = link._window[0]
+        link.add('bytes_in', 1000)
+        link.sample(started + 30)
+        self.assertEquals(0, link.throughput_in)
+        link.add('bytes_out', 500)
+        link.sample(started + 120)
+        self.assertEquals(500, link.throughput_in)
+        self.assertEquals(250, link.throughput_out)
+
+
+class TestLinkStatsCommand(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # the metrics file of the service is in the plugins root
+        self.metrics = tools.getMetricsFileName, service.getMetricsFileName
+        tools.getMetricsFileName = service.getMetricsFileName = \
+            lambda: os.path.join(self.dir, 'serclient-metrics.prom')
+
+    def tearDown(self):
+        tools.getMetricsFileName, service.getMetricsFileName = self.metrics
+        shutil.rmtree(self.dir)
+
+    def testReport(self):
+        m = tools.Metrics()
+        m.link.add('bytes_in', 1234)
+        m.link.add('crc_errors', 2)
+        m.link.throughput_out = 99
+        m.save(tools.getMetricsFileName())
+
+        loaded = tools.Metrics.load(tools.getMetricsFileName())
+        self.assertEquals(m.link.values(), loaded.link.values())
+
+        linkstats = common.loadScript('internals/linkstats.py')
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv, sys.stdout = ['linkstats'], StringIO()
+        try:
+            self.assertEquals(0, linkstats.main())
+            out = sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+        top = et.fromstring(out)
+        self.assertEquals('1234', top.find('bytesIn').text)
+        self.assertEquals('2', top.find('crcErrors').text)
+        self.assertEquals('99', top.find('throughputOut').text)
+        self.assertEquals('0', top.find('logicTimeouts').text)
+
+
+if __name__ == '__main__':
+    unittest.main()
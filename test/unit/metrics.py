@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, sys, shutil, tempfile, time
+from StringIO import StringIO
+from elementtree import ElementTree as et
+import tools, service
+
+
+class FakeSerial(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class FakeObserver(object):
+    def __init__(self, timing, output):
+        self.timing = timing
+        self.output = output
+
+    def responsePacket(self):
+        self.timing.result = 'Success'
+        self.timing.output_size = len(self.output)
+        return service.Packet.newWithRESPONSE(self.timing.guid, 'Success',
+                                              'osinfo', self.output)
+
+
+class TestHistogram(unittest.TestCase):
+    def testQuantile(self):
+        h = tools.Histogram((1, 10, 100))
+        self.assertEquals(None, h.quantile(0.5))
+        for v in (0.5, 1, 2, 3, 50, 500):
+            h.observe(v)
+        self.assertEquals([2, 2, 1, 1], h.counts)
+        self.assertEquals(1, h.quantile(0.1))
+        self.assertEquals(10, h.quantile(0.5))
+        self.assertEquals(100, h.quantile(0.8))
+        self.assertEquals(500, h.quantile(0.99))
+        self.assertEquals(500, h.max)
+
+    def testQuantileCappedByMax(self):
+        h = tools.Histogram((1, 10, 100))
+        h.observe(2)
+        self.assertEquals(2, h.quantile(0.5))
+
+
+class TestMetrics(unittest.TestCase):
+    def testRoundTrip(self):
+        m = tools.Metrics()
+        m.record('osinfo', 'Success', {'exec': 0.2, 'total': 0.3}, 100)
+        m.record('osinfo', 'Error', {'exec': 7.0, 'total': 7.5}, 20000)
+        m.record('exec', 'TimeOut', {'exec': 400, 'total': 400}, 0)
+        text = m.toString()
+        self.assertTrue('serclient_command_phase_seconds_bucket'
+                        '{module="osinfo",phase="exec",le="0.5"} 1' in text)
+        self.assertTrue('serclient_command_phase_seconds_bucket'
+                        '{module="osinfo",phase="exec",le="+Inf"} 2' in text)
+        self.assertTrue('serclient_commands_total'
+                        '{module="exec",result="TimeOut"} 1' in text)
+
+        loaded = tools.Metrics.fromString(text)
+        self.assertEquals(text, loaded.toString())
+        self.assertEquals(m.commands, loaded.commands)
+        h = loaded.histograms[(tools.Metrics.PHASES, ('osinfo', 'exec'))]
+        self.assertEquals(2, h.count)
+        self.assertEquals(7.0, h.max)
+        self.assertEquals(0.5, h.quantile(0.5))
+
+    def testEscapedLabels(self):
+        m = tools.Metrics()
+        module = 'a\\b"c}\nd e'
+        m.record(module, 'Success', {'exec': 0.2}, 10)
+        text = m.toString()
+        self.assertTrue('serclient_commands_total'
+                        '{module="a\\\\b\\"c}\\nd e",result="Success"} 1\n' in text)
+        loaded = tools.Metrics.fromString(text)
+        self.assertEquals({(module, 'Success'): 1}, loaded.commands)
+        self.assertEquals(text, loaded.toString())
+
+    def testFileName(self):
+        self.assertEquals(os.path.join(tools.getRoot(), 'serclient-metrics.prom'),
+                          tools.getMetricsFileName())
+
+    def testLoadMissing(self):
+        m = tools.Metrics.load('/nonexistent/serclient-metrics.prom')
+        self.assertEquals([], m.phases())
+
+
+class TestCommandMetrics(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # the metrics file of the service is in the plugins root
+        self.metrics = tools.getMetricsFileName, service.getMetricsFileName
+        tools.getMetricsFileName = service.getMetricsFileName = \
+            lambda: os.path.join(self.dir, 'serclient-metrics.prom')
+        self.service = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        self.service.sp = FakeSerial()
+
+    def tearDown(self):
+        tools.getMetricsFileName, service.getMetricsFileName = self.metrics
+        shutil.rmtree(self.dir)
+
+    def testTiming(self):
+        t = service.CommandTiming(tools.guidFromInt(1), 'osinfo')
+        t.block()
+        t.block()
+        t.unqueue()
+        t.lap('exec')
+        self.assertEquals(['blocking', 'exec', 'queue'], sorted(t.phases))
+        t.lap('exec')
+        t.finish(self.service._metrics)
+        self.assertTrue(t.phases['total'] >= sum([t.phases[p] for p in
+                                                  ('blocking', 'exec', 'queue')]))
+
+    def testUnknownModule(self):
+        guid = tools.guidFromInt(1)
+        self.assertEquals('osinfo', service.Command('osinfo', guid, None).timing.module)
+        for command in ('nosuchmodule', '"no such\nmodule" a'):
+            self.assertEquals(tools.METRICS_OTHER_MODULE,
+                              service.Command(command, guid, None).timing.module)
+
+    def testResponseRecorded(self):
+        guid = tools.guidFromInt(7)
+        timing = service.CommandTiming(guid, 'osinfo')
+        timing.unqueue()
+        self.service._threads[guid] = FakeObserver(timing, 'x' * 300)
+        self.service.processAuthResponse(
+            service.Packet.newWithAUTHRESPONSE(guid))
+
+        self.assertEquals(1, len(self.service.sp.written))
+        self.assertEquals(['auth', 'queue', 'serialize', 'total', 'write'],
+                          sorted(timing.phases))
+        self.assertEquals({('osinfo', 'Success'): 1},
+                          self.service._metrics.commands)
+
+        self.service.saveMetrics()
+        self.assertTrue(os.path.exists(tools.getMetricsFileName()))
+        self.assertFalse(self.service._metrics.changed)
+
+        stats = common.loadScript('internals/stats.py')
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv, sys.stdout = ['stats', 'osinfo'], StringIO()
+        try:
+            self.assertEquals(0, stats.main())
+            out = sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdout = argv, stdout
+        top = et.fromstring(out)
+        module = top.find('module')
+        self.assertEquals('osinfo', module.get('name'))
+        self.assertEquals('1', module.find('commands').text)
+        self.assertEquals('300', module.find('output/max').text)
+        self.assertEquals(['auth', 'queue', 'serialize', 'total', 'write'],
+                          [p.get('name') for p in module.findall('phase')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile, stat, hashlib
+import tools
+
+
+class ModulesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, 'source.py')
+        open(self.source, 'w').write('print "new"\n')
+        self.plugins = os.path.join(self.dir, 'plugins')
+        os.mkdir(self.plugins)
+        self.target = os.path.join(self.plugins, 'module.py')
+        tools.ModuleManifest._cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def module(self):
+        return tools.moduleFromPathAndType(self.target, tools.MODULE_PLUGINS)
+
+
+class TestCopyModule(ModulesTestCase):
+    def testInstall(self):
+        tools.copyModule(self.source, self.target, version=2.0,
+                         blocking=True)
+
+        self.assertEquals('print "new"\n', open(self.target).read())
+        self.assertTrue(os.stat(self.target).st_mode & stat.S_IXUSR)
+        # the staging directory is gone
+        self.assertEquals(['module.py', 'modules.ini'],
+                          sorted(os.listdir(self.plugins)))
+
+        m = self.module()
+        self.assertEquals(2.0, m.version())
+        self.assertTrue(m.isBlocking())
+        self.assertEquals(hashlib.sha256('print "new"\n').hexdigest(),
+                          m.checksum())
+
+    def testReplace(self):
+        open(self.target, 'w').write('print "old"\n')
+        tools.copyModule(self.source, self.target, version=1.0,
+                         blocking=True)
+        tools.copyModule(self.source, self.target, version=1.5,
+                         blocking=False)
+
+        self.assertEquals('print "new"\n', open(self.target).read())
+        self.assertEquals(1.5, self.module().version())
+        self.assertFalse(self.module().isBlocking())
+
+    def testMetadataUntouched(self):
+        tools.copyModule(self.source, self.target, version=1.0,
+                         blocking=True)
+        tools.copyModule(self.source, self.target)
+
+        self.assertEquals(1.0, self.module().version())
+        self.assertTrue(self.module().isBlocking())
+
+    def testMissingSource(self):
+        self.assertRaises(IOError, tools.copyModule,
+                          os.path.join(self.dir, 'missing'), self.target)
+        self.assertEquals([], os.listdir(self.plugins))
+
+    def testRemove(self):
+        tools.copyModule(self.source, self.target, version=1.0)
+        tools.removeModule(self.target)
+
+        self.assertEquals(None, self.module())
+        self.assertEquals([], tools.ModuleManifest.load(self.plugins).names())
+
+
+class TestModuleManifest(ModulesTestCase):
+    def testDefaults(self):
+        open(self.target, 'w').write('')
+        m = self.module()
+
+        self.assertEquals(0, m.version())
+        self.assertFalse(m.isBlocking())
+        self.assertEquals(None, m.timeout())
+        self.assertEquals('module.py', m.aliasName())
+
+    def testProperties(self):
+        open(self.target, 'w').write('')
+        open(os.path.join(self.plugins, 'modules.ini'), 'w').write(
+            '[module.py]\nversion = 3.5\nblocking = true\n'
+            'timeout = 120\nalias = mymodule\n')
+        m = self.module()
+
+        self.assertEquals(3.5, m.version())
+        self.assertTrue(m.isBlocking())
+        self.assertEquals(120, m.timeout())
+        self.assertEquals('mymodule', m.aliasName())
+
+    def testMigration(self):
+        open(self.target, 'w').write('print "old"\n')
+        open(self.target + '.version', 'w').write('1.0 \n')
+        open(self.target + '.blocking', 'w').write('')
+
+        # a lookup merges the legacy files without writing
+        m = self.module()
+        self.assertEquals(1.0, m.version())
+        self.assertTrue(m.isBlocking())
+        self.assertEquals(['module.py', 'module.py.blocking', 'module.py.version'],
+                          sorted(os.listdir(self.plugins)))
+
+        self.assertTrue(tools.ModuleManifest.migrate(self.plugins))
+        self.assertFalse(tools.ModuleManifest.migrate(self.plugins))
+        m = self.module()
+        self.assertEquals(1.0, m.version())
+        self.assertTrue(m.isBlocking())
+        self.assertEquals(hashlib.sha256('print "old"\n').hexdigest(),
+                          m.checksum())
+        self.assertEquals(['module.py', 'modules.ini'],
+                          sorted(os.listdir(self.plugins)))
+
+        # the stored manifest is used once the legacy files are gone
+        tools.ModuleManifest._cache.clear()
+        self.assertEquals(1.0, self.module().version())
+
+    def testCopyMigrates(self):
+        open(self.target + '.version', 'w').write('1.0\n')
+        tools.copyModule(self.source, self.target, version=2.0)
+        self.assertEquals(['module.py', 'modules.ini'], sorted(os.listdir(self.plugins)))
+        self.assertEquals(2.0, self.module().version())
+
+    def testCache(self):
+        open(self.target, 'w').write('')
+        first = tools.ModuleManifest.load(self.plugins)
+
+        self.assertTrue(first is tools.ModuleManifest.load(self.plugins))
+
+        open(os.path.join(self.plugins, 'modules.ini'), 'w').write(
+            '[module.py]\nversion = 2.0\nblocking = false\n')
+        self.assertEquals(2.0, self.module().version())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile
+
+netconf = common.loadScript('plugins/netconf.py')
+
+
+class TestPfSenseConfig(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'config.xml')
+        shutil.copy(common.filePath('pfsense-config.xml'), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testSections(self):
+        sections = netconf.pfsenseParseConfig(self.path)
+
+        self.assertEquals(['wan', 'lan', 'opt1'],
+                          [i.tag for i in sections['interfaces']])
+        self.assertEquals(1, len(sections['gateways']))
+        self.assertEquals(3, len(sections['virtualip']))
+
+    def testNetworkCfg(self):
+        config = netconf.pfsenseGetNetworkCfg(self.path)
+
+        self.assertEquals([
+            {'device': 'em0:0', 'ip': '192.168.10.2',
+             'netmask': '255.255.255.0', 'gateway': '192.168.10.1',
+             'enabled': 'True'},
+            {'device': 'em0:1', 'ip': '172.16.0.2',
+             'netmask': '255.255.0.0', 'gateway': None},
+            # all the aliases of a device are numbered 1
+            {'device': 'em0:1', 'ip': '172.16.0.3',
+             'netmask': '255.255.0.0', 'gateway': None},
+            {'device': 'em2:0', 'ip': '10.0.0.1',
+             'netmask': '255.0.0.0', 'gateway': None,
+             'enabled': 'False'},
+        ], config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, binascii
+import tools, service
+
+
+class TestPacket(unittest.TestCase):
+    def setUp(self):
+        self.guid = tools.guidFromInt(5)
+
+    def testResponseBody(self):
+        p = service.Packet.newWithRESPONSE(self.guid, 'Error', 'exec <x>',
+                                           'a & b', 3, 'not <found>')
+        self.assertEquals(
+            '<response><responseType>Error</responseType>'
+            '<resultCode>3</resultCode>'
+            '<resultMessage>not &lt;found&gt;</resultMessage>'
+            '<commandName>exec &lt;x&gt;</commandName>'
+            '<outputString>a &amp; b</outputString></response>', p.body)
+
+    def testResponseDefaults(self):
+        p = service.Packet.newWithRESPONSE(self.guid, 'Success', output_string=None,
+                                           result_message=None)
+        self.assertEquals(
+            '<response><responseType>Success</responseType>'
+            '<resultCode>0</resultCode><resultMessage></resultMessage>'
+            '<commandName></commandName><outputString></outputString></response>',
+            p.body)
+
+    def testFrame(self):
+        p = service.Packet(self.guid, service.RESPONSE, 'x' * 1000, 2, 3)
+        s = p.toString()
+        self.assertEquals(len(p), len(s))
+        self.assertEquals(binascii.crc32(s[:-service.PROTOCOL_FOOTER_SIZE]) & 0xffffffff,
+                          p.crc())
+        q = service.Packet.fromString(s)
+        self.assertEquals((p.guid, p.type, p.body, p.number, p.count),
+                          (q.guid, q.type, q.body, q.number, q.count))
+
+    def testFlags(self):
+        p = service.Packet(self.guid, service.RESPONSE, 'x', flags='zZ')
+        q = service.Packet.fromString(p.toString())
+        self.assertEquals('zZ', q.flags)
+        # without flags the reserved field stays empty, as the old peers expect it
+        s = service.Packet(self.guid, service.ACK).toString()
+        self.assertEquals('\x00' * 16, s[service.HEADER_FLAGS_OFFSET:service.HEADER_FLAGS_OFFSET + 16])
+        self.assertEquals('', service.Packet.fromString(s).flags)
+
+    def testDeflate(self):
+        body = '<response>' + 'eth0 <up> mtu 1500\n' * 100 + '</response>'
+        p = service.Packet(self.guid, service.RESPONSE, body, flags='z').deflate()
+        self.assertEquals('zZ', p.flags)
+        self.assertTrue(len(p.body) < len(body) / 10)
+        q = service.Packet.fromString(p.toString()).inflate(len(body))
+        self.assertEquals((body, 'z'), (q.body, q.flags))
+        self.assertRaises(ValueError, p.inflate, len(body) - 1)
+        broken = service.Packet(self.guid, service.RESPONSE, 'not zlib', flags='Z')
+        self.assertRaises(ValueError, broken.inflate, 1000)
+
+    def testDeflateIncompressible(self):
+        p = service.Packet(self.guid, service.RESPONSE, 'abc')
+        self.assertTrue(p.deflate() is p)
+        self.assertTrue(p.inflate(10) is p)
+
+    def testCRCError(self):
+        s = service.Packet.newWithACK(self.guid).toString()
+        s = s[:-5] + '\x00\x00\x00\x00' + s[-1]
+        self.assertRaises(service.CRCError, service.Packet.fromString, s)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, array, os, threading
+import serial
+
+if os.name == 'posix':
+    from serial import serialposix
+
+
+def pattern(size):
+    return ''.join([chr(i % 251) for i in range(size)])
+
+
+class PtyMixin(object):
+    """self.port is a serial_class opened on the slave side of a pty"""
+    serial_class = None
+
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.port = self.serial_class(os.ttyname(slave), timeout=2)
+        os.close(slave)
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.master)
+
+    def feed(self, data):
+        t = threading.Thread(target=self._feed, args=(data,))
+        t.start()
+        return t
+
+    def _feed(self, data):
+        while data:
+            data = data[os.write(self.master, data[:4096]):]
+
+    def drain(self, size):
+        result = []
+        t = threading.Thread(target=self._drain, args=(size, result))
+        t.start()
+        return t, result
+
+    def _drain(self, size, result):
+        while size > 0:
+            b = os.read(self.master, size)
+            result.append(b)
+            size -= len(b)
+
+    def testRead(self):
+        data = pattern(1024 * 1024 + 17)
+        t = self.feed(data)
+        r = self.port.read(len(data))
+        t.join()
+        self.assertEquals(data, r)
+
+    def testReadTimeout(self):
+        self.port.timeout = 0.2
+        self.feed('abc').join()
+        self.assertEquals('abc', self.port.read(10))
+        self.assertEquals('', self.port.read(10))
+
+    def testReadReusesItsBuffer(self):
+        self.feed('first second').join()
+        first = self.port.read(6)
+        second = self.port.read(6)
+        self.assertEquals('first ', first)
+        self.assertEquals('second', second)
+
+    def testReadInto(self):
+        b = bytearray(10)
+        self.feed('0123456789').join()
+        self.assertEquals(4, self.port.readinto(memoryview(b)[3:7]))
+        self.assertEquals('\x00\x00\x000123\x00\x00\x00', str(b))
+        b = array.array('b', [0] * 6)
+        self.assertEquals(6, self.port.readinto(b))
+        self.assertEquals('456789', b.tostring())
+
+    def testWrite(self):
+        data = pattern(1024 * 1024 + 17)
+        t, result = self.drain(len(data))
+        self.assertEquals(len(data), self.port.write(data))
+        t.join()
+        self.assertEquals(data, ''.join(result))
+        t, result = self.drain(3)
+        self.port.write(bytearray('abc'))
+        t.join()
+        self.assertEquals('abc', ''.join(result))
+
+
+if os.name == 'posix' and hasattr(os, 'openpty'):
+    class TestPosixSerial(PtyMixin, unittest.TestCase):
+        serial_class = serialposix.Serial
+
+    class TestPosixPollSerial(PtyMixin, unittest.TestCase):
+        serial_class = serialposix.PosixPollSerial
+
+
+if __name__ == '__main__':
+    unittest.main()
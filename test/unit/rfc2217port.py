@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, socket, threading, time
+import serial
+from serial import rfc2217
+from serial.rfc2217 import IAC, IAC_DOUBLED, SB, SE, NOP, COM_PORT_OPTION, SERVER_NOTIFY_LINESTATE
+
+
+class StandInServer(object):
+    """RFC 2217 server on 127.0.0.1: a PortManager in front of loop://"""
+
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.url = 'rfc2217://127.0.0.1:%d' % self.listener.getsockname()[1]
+        self.connection = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _serve(self):
+        self.connection, _ = self.listener.accept()
+        self.listener.close()
+        manager = rfc2217.PortManager(serial.serial_for_url('loop://'), self)
+        while True:
+            try:
+                data = self.connection.recv(4096)
+            except socket.error:
+                break
+            if not data:
+                break
+            for byte in manager.filter(data):
+                pass
+
+    def write(self, data):
+        """Send raw Telnet data, used by the PortManager too"""
+        self._lock.acquire()
+        try:
+            self.connection.sendall(data)
+        finally:
+            self._lock.release()
+
+    def send(self, data):
+        """Send data as the serial port would"""
+        self.write(data.replace(IAC, IAC_DOUBLED))
+
+    def close(self):
+        self.connection.shutdown(socket.SHUT_RDWR)
+        self.connection.close()
+
+
+class TestRFC2217Read(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.port = serial.serial_for_url(self.server.url, timeout=2)
+
+    def tearDown(self):
+        self.port.close()
+        if self.server.connection:
+            self.server.connection.close()
+
+    def testRead(self):
+        data = ''.join([chr(i % 256) for i in range(100000)])
+        self.server.send(data)
+        self.assertEquals(data, self.port.read(len(data)))
+
+    def testTelnetInData(self):
+        self.server.write('ab' + IAC + NOP + 'c' + IAC_DOUBLED + 'd' +
+                          IAC + SB + COM_PORT_OPTION + SERVER_NOTIFY_LINESTATE + '\x42' + IAC + SE + 'e')
+        self.assertEquals('abc' + IAC + 'de', self.port.read(6))
+        self.assertEquals(0x42, self.port._linestate)
+
+    def testSplitChunks(self):
+        # IAC IAC and a sub option split over two recv
+        self.server.write('a' + IAC)
+        time.sleep(0.1)
+        self.server.write(IAC + 'b' + IAC + SB + COM_PORT_OPTION)
+        time.sleep(0.1)
+        self.server.write(SERVER_NOTIFY_LINESTATE + '\x07' + IAC + SE + 'c')
+        self.assertEquals('a' + IAC + 'bc', self.port.read(4))
+        self.assertEquals(0x07, self.port._linestate)
+
+    def testTimeout(self):
+        self.port.timeout = 0.2
+        self.server.send('abc')
+        started = time.time()
+        self.assertEquals('abc', self.port.read(10))
+        self.assertTrue(time.time() - started < 1)
+        self.assertEquals('', self.port.read(10))
+
+    def testReadAvailable(self):
+        self.server.send('hello')
+        time.sleep(0.1)
+        self.assertEquals(5, self.port.inWaiting())
+        self.assertEquals('he', self.port.read_available(2))
+        self.assertEquals('llo', self.port.read_available(100))
+        self.assertEquals('', self.port.read_available(100, 0.1))
+        t = threading.Timer(0.2, self.server.send, ['late'])
+        t.start()
+        self.assertEquals('late', self.port.read_available(100, 2))
+        t.join()
+
+    def testFlushInput(self):
+        self.server.send('old')
+        time.sleep(0.1)
+        self.port.flushInput()
+        self.assertEquals(0, self.port.inWaiting())
+
+    def testConnectionLost(self):
+        self.server.send('last')
+        time.sleep(0.1)
+        self.server.close()
+        time.sleep(0.1)
+        self.assertEquals('last', self.port.read(10))
+        self.assertRaises(serial.SerialException, self.port.read, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
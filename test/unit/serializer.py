@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, random, time
+from elementtree import ElementTree as et
+from elementtree.ElementTree import Element, SubElement, Comment, PI, QName
+import tools
+
+
+def systemStatusTree():
+    systemstatus = common.loadScript('plugins/systemstatus.py')
+    info = {
+        'datetime': time.struct_time((2013, 1, 2, 3, 4, 5, 2, 2, 0)),
+        'cpus': [{'value': 'Intel(R) Xeon(R) CPU E5-2650 "0" @ 2.00GHz',
+                  'used': '12',
+                  'cores': [{'number': str(i), 'used': str(i * 7)}
+                            for i in range(4)]}],
+        'ram': {'total': '4096', 'used': '1024'},
+        'disks': [{'name': 'C:', 'total': '100', 'used': '50'},
+                  {'name': '/dev/sda1 <root> & more', 'total': '10', 'used': '1'}],
+    }
+    return et.fromstring(systemstatus.formatSystemStatus(info))
+
+
+def netconfTree():
+    netconf = common.loadScript('plugins/netconf.py')
+    top = Element('NetConfigurations')
+    for i in range(3):
+        netconf.formatNetworkAdapterConfig(top, {
+            'mac': '00:11:22:33:44:%02x' % i,
+            'configurations': [
+                {'ip': '10.0.%d.1' % i, 'netmask': '255.255.255.0',
+                 'gateway': '10.0.%d.254' % i},
+                {'ip': '192.168.%d.1' % i, 'netmask': '255.255.0.0'},
+            ]})
+    return top
+
+
+def modulesTree():
+    top = Element('modules')
+    for name, type in (('restart', tools.MODULE_INTERNALS),
+                       ('osinfo', tools.MODULE_PLUGINS),
+                       ('my <custom> & co.sh', tools.MODULE_CUSTOMS)):
+        m = tools.Module(type, '/opt/serclient/%s' % name, 1.5, True, False,
+                         alias=name)
+        top.append(m.toElementTree(True))
+    return top
+
+
+def edgeTree():
+    top = Element('root', {'b': 'x"y\n<z>&', 'a': u'caf\xe9'})
+    top.text = u'text \xe8 & <more>'
+    empty = SubElement(top, 'empty')
+    empty.tail = 'tail > 1'
+    SubElement(top, 'attrs', c='3', a='1', b='2').text = ''
+    nested = SubElement(top, 'nested')
+    for i in range(3):
+        nested = SubElement(nested, 'level%d' % i)
+        nested.text = str(i)
+        nested.tail = '\n'
+    SubElement(top, 'last').text = 'end'
+    top.tail = 'root tail'
+    return top
+
+
+def namespaceTree():
+    top = Element('{http://example.com/ns}root')
+    SubElement(top, '{http://example.com/ns}child', {'{http://www.w3.org/XML/1998/namespace}lang': 'en'})
+    top.append(Comment('a -- comment & more'))
+    top.append(PI('target', 'data'))
+    SubElement(top, QName('qname'))
+    return top
+
+
+TREES = (
+    ('systemstatus', systemStatusTree),
+    ('netconf', netconfTree),
+    ('modules', modulesTree),
+    ('edge', edgeTree),
+    ('namespace', namespaceTree),
+)
+
+
+def randomTree(r, depth=0):
+    chars = u'ab <>&"\n\xe9'
+    text = lambda: r.choice([None, '', ''.join([r.choice(chars) for i in range(r.randint(0, 8))])])
+    e = Element(r.choice(['a', 'b', 'item', 'x-y']))
+    for i in range(r.randint(0, 3)):
+        e.set(r.choice(['k', 'v', 'name', 'z']), text() or '')
+    e.text = text()
+    if depth < 4:
+        for i in range(r.randint(0, 4)):
+            c = randomTree(r, depth + 1)
+            c.tail = text()
+            e.append(c)
+    return e
+
+
+def goldenPath(name, encoding):
+    return common.filePath(os.path.join('xml', '%s-%s.xml' % (name, encoding or 'default')))
+
+
+class TestSerializer(unittest.TestCase):
+    def testGolden(self):
+        for name, tree in TREES:
+            for encoding in (None, 'utf-8'):
+                expected = open(goldenPath(name, encoding), 'rb').read()
+                self.assertEquals(expected, et.tostring(tree(), encoding), name)
+
+    def testRandom(self):
+        r = random.Random(0)
+        for i in range(300):
+            tree = randomTree(r)
+            self.assertEquals(et._generic_tostring(tree, 'utf-8'),
+                              et.tostring(tree, 'utf-8'))
+
+    def testErrors(self):
+        e = Element('root')
+        SubElement(e, 'child').text = 3
+        self.assertRaises(TypeError, et.tostring, e)
+        self.assertRaises(UnicodeEncodeError, et.tostring, Element(u'\xe9'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, socket, threading, time
+import serial
+import tools, service
+
+
+def delayed(seconds, function, *args):
+    t = threading.Timer(seconds, function, args)
+    t.start()
+    return t
+
+
+class ReadAvailableMixin(object):
+    """Checks shared by all the ports, self.port is open with a 5 sec timeout"""
+
+    def feed(self, data):
+        raise NotImplementedError
+
+    def testReturnsWhatIsAvailable(self):
+        self.feed('hello')
+        time.sleep(0.1)
+        started = time.time()
+        self.assertEquals('hello', self.port.read_available(4096))
+        self.assertTrue(time.time() - started < 1)
+
+    def testSize(self):
+        self.feed('hello')
+        time.sleep(0.1)
+        self.assertEquals('he', self.port.read_available(2))
+        self.assertEquals('llo', self.port.read_available(4096))
+
+    def testWaitsForTheFirstByte(self):
+        t = delayed(0.2, self.feed, 'late')
+        started = time.time()
+        data = self.port.read_available(4096)
+        elapsed = time.time() - started
+        t.join()
+        self.assertEquals('late', data)
+        self.assertTrue(0.1 < elapsed < 2, elapsed)
+
+    def testTimeout(self):
+        started = time.time()
+        self.assertEquals('', self.port.read_available(4096, 0.2))
+        self.assertTrue(time.time() - started < 2)
+        self.assertEquals('', self.port.read_available(4096, 0))
+
+
+class TestLoop(ReadAvailableMixin, unittest.TestCase):
+    def setUp(self):
+        self.port = serial.serial_for_url('loop://', timeout=5)
+
+    def tearDown(self):
+        self.port.close()
+
+    def feed(self, data):
+        self.port.write(data)
+
+
+class TestSocket(ReadAvailableMixin, unittest.TestCase):
+    def setUp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.port = serial.serial_for_url('socket://127.0.0.1:%d' % server.getsockname()[1], timeout=5)
+        self.peer, _ = server.accept()
+        server.close()
+
+    def tearDown(self):
+        self.port.close()
+        self.peer.close()
+
+    def feed(self, data):
+        self.peer.sendall(data)
+
+    def testClosed(self):
+        self.peer.close()
+        self.assertRaises(serial.SerialException, self.port.read_available, 4096)
+
+
+if hasattr(os, 'openpty') and os.name == 'posix':
+    class TestPosix(ReadAvailableMixin, unittest.TestCase):
+        def setUp(self):
+            self.master, slave = os.openpty()
+            self.port = serial.Serial(os.ttyname(slave), timeout=5)
+            os.close(slave)
+
+        def tearDown(self):
+            self.port.close()
+            os.close(self.master)
+
+        def feed(self, data):
+            os.write(self.master, data)
+
+        def testReusedBuffer(self):
+            self.feed('hello')
+            time.sleep(0.1)
+            self.assertEquals('hello', self.port.read_available(4096))
+            buf = self.port._read_buffer
+            self.feed('world')
+            time.sleep(0.1)
+            self.assertEquals('world', self.port.read_available(4096))
+            self.assertTrue(buf is self.port._read_buffer)
+
+        def testServiceRead(self):
+            # a packet is decoded when it arrives, not after the read timeout
+            agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+            agent.sp = self.port
+            p = service.Packet.newWithACK(tools.guidFromInt(1))
+            t = delayed(0.2, self.feed, p.toString())
+            started = time.time()
+            r = agent.read(timeout=5)
+            elapsed = time.time() - started
+            t.join()
+            self.assertEquals(p.guid, r.guid)
+            self.assertTrue(elapsed < service.SERIAL_READ_TIMEOUT, elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, random, shutil, tempfile, threading
+import serial
+import tools, service
+
+
+class FakeService(object):
+    """Records what the writer thread writes, the first write waits for release"""
+
+    def __init__(self):
+        self.written = []
+        self.frames_written = []
+        self.batches = []
+        self.events = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.peer_flags = service.HEADER_FLAG_FRAGMENTS
+
+    def writeFrames(self, frames):
+        if not self.written:
+            self.writing.set()
+            self.release.wait(5)
+        self.batches.append(len(frames))
+        for p, k in frames:
+            self.written.append(p.type)
+            self.frames_written.append((p.guid, p.number, p.count, p.body))
+
+    def frames(self, p, k=None):
+        return service.Service.frames.im_func(self, p, k)
+
+    def peerAccepts(self, flag):
+        return flag in self.peer_flags
+
+    def dispatch(self, event, value=None):
+        self.events.append((event, value))
+
+
+class FakePort(object):
+    """Return data once, then fail as a disconnected device"""
+
+    def __init__(self, data):
+        self.data = data
+        self.written = []
+
+    def read_available(self, size, timeout=None):
+        if not self.data:
+            raise serial.SerialException('device disconnected')
+        r, self.data = self.data, ''
+        return r
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class TestSerialWriter(unittest.TestCase):
+    def testPriority(self):
+        fake = FakeService()
+        writer = service.SerialWriter(fake)
+        guid = tools.guidFromInt(1)
+        writer.put(service.Packet.newWithRESPONSE(guid, 'Success'))
+        writer.start()
+        fake.writing.wait(5)
+        # the first RESPONSE is being written, the others wait
+        for p in [service.Packet.newWithRESPONSE(guid, 'Success'),
+                  service.Packet.newWithACK(guid),
+                  service.Packet.newWithRESPONSE(guid, 'Error'),
+                  service.Packet.newWithRECEIVED(guid)]:
+            writer.put(p)
+        writer.stop()
+        fake.release.set()
+        writer.join(5)
+        self.assertFalse(writer.isAlive())
+        self.assertEquals(['RESPONSE', 'ACK', 'RECEIVED', 'RESPONSE', 'RESPONSE'], fake.written)
+        # the packets queued meanwhile are written together
+        self.assertEquals([1, 4], fake.batches)
+
+    def testBatchSize(self):
+        fake = FakeService()
+        fake.release.set()
+        writer = service.SerialWriter(fake)
+        guid = tools.guidFromInt(1)
+        body = 'x' * (service.WRITE_BATCH_SIZE / 2)
+        for i in range(5):
+            writer.put(service.Packet(guid, service.RESPONSE, body))
+        writer.stop()
+        writer.run()
+        self.assertEquals([2, 2, 1], fake.batches)
+
+    def testTiming(self):
+        fake = FakeService()
+        fake.release.set()
+        writer = service.SerialWriter(fake)
+        timing = service.CommandTiming(tools.guidFromInt(1), 'test')
+        writer.put(service.Packet.newWithRESPONSE(timing.guid, 'Success'), None, timing)
+        writer.stop()
+        writer.run()
+        self.assertEquals([(service.Service.WRITTEN, timing)], fake.events)
+        self.assertTrue('write' in timing.phases)
+
+
+class TestFragments(unittest.TestCase):
+    def setUp(self):
+        self.size = service.RESPONSE_FRAGMENT_SIZE
+        service.RESPONSE_FRAGMENT_SIZE = 4
+
+    def tearDown(self):
+        service.RESPONSE_FRAGMENT_SIZE = self.size
+
+    def testSmallResponse(self):
+        p = service.Packet(tools.guidFromInt(1), service.RESPONSE, 'Ok')
+        self.assertEquals([(p, p.toString())], list(FakeService().frames(p)))
+
+    def testFairness(self):
+        fake = FakeService()
+        fake.release.set()
+        writer = service.SerialWriter(fake)
+        a = service.CommandTiming(tools.guidFromInt(1), 'test')
+        b = service.CommandTiming(tools.guidFromInt(2), 'test')
+        writer.put(service.Packet(a.guid, service.RESPONSE, 'a' * 10), None, a)
+        writer.put(service.Packet(b.guid, service.RESPONSE, 'b' * 6), None, b)
+        writer.put(service.Packet.newWithACK(a.guid))
+        writer.stop()
+        writer.run()
+        # the ACK goes first, then the fragments of the two responses take turns
+        self.assertEquals([(a.guid, 1, 1, ''),
+                           (a.guid, 1, 3, 'aaaa'), (b.guid, 1, 2, 'bbbb'),
+                           (a.guid, 2, 3, 'aaaa'), (b.guid, 2, 2, 'bb'),
+                           (a.guid, 3, 3, 'aa')],
+                          [(g, n, c, body) for g, n, c, body in fake.frames_written])
+        self.assertEquals([(service.Service.WRITTEN, b), (service.Service.WRITTEN, a)], fake.events)
+
+    def testPlainHost(self):
+        p = service.Packet(tools.guidFromInt(1), service.RESPONSE, 'x' * 10)
+        fake = FakeService()
+        fake.peer_flags = service.HEADER_FLAG_INFLATE
+        self.assertEquals([(p, p.toString())], list(fake.frames(p)))
+
+    def testReassembly(self):
+        guid = tools.guidFromInt(1)
+        p = service.Packet.newWithRESPONSE(guid, 'Success', 'ls', 'x' * 20 + '\xff')
+        agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        agent._peer_flags = service.HEADER_FLAG_FRAGMENTS
+        agent.sp = FakePort(''.join([k for f, k in agent.frames(p)]))
+        r = agent.read(timeout=1)
+        self.assertEquals((guid, service.RESPONSE, p.body), (r.guid, r.type, r.body))
+        # every fragment is acknowledged, the last one too
+        count = (len(p.body) + 3) / 4
+        self.assertEquals([(n, count) for n in range(1, count + 1)],
+                          [(a.number, a.count) for a in map(service.Packet.fromString, agent.sp.written)])
+
+    def testResend(self):
+        guid = tools.guidFromInt(1)
+        agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        agent._peer_flags = service.HEADER_FLAG_FRAGMENTS
+        agent.sp = FakePort('')
+        agent.send(service.Packet(guid, service.RESPONSE, 'a' * 10))
+        self.assertEquals([1, 2, 3], [p.number for p in parse(agent.sp.written)])
+        for n in (1, 3):
+            agent.processPacket(service.Packet.newWithRECEIVED(guid, n, 3))
+        agent.sp.written = []
+        agent.resendFragments()
+        self.assertEquals([], agent.sp.written)
+        # fragment 2 was lost
+        timeout = service.FRAGMENT_ACK_TIMEOUT
+        service.FRAGMENT_ACK_TIMEOUT = 0
+        try:
+            agent.resendFragments()
+            self.assertEquals([(2, 3, 'aaaa')], [(p.number, p.count, p.body) for p in parse(agent.sp.written)])
+            self.assertEquals(1, agent._link.fragments_resent)
+            agent.processPacket(service.Packet.newWithRECEIVED(guid, 2, 3))
+            self.assertEquals({}, agent._unacked)
+            # a peer that never acknowledges: given up after FRAGMENT_RETRIES
+            agent.send(service.Packet(guid, service.RESPONSE, 'b' * 10))
+            for i in range(service.FRAGMENT_RETRIES + 1):
+                agent.resendFragments()
+            self.assertEquals({}, agent._unacked)
+            self.assertEquals(1 + 3 * service.FRAGMENT_RETRIES, agent._link.fragments_resent)
+        finally:
+            service.FRAGMENT_ACK_TIMEOUT = timeout
+        self.assertEquals(0, agent._unacked_size)
+
+    def testUnackedBounds(self):
+        agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        agent._peer_flags = service.HEADER_FLAG_FRAGMENTS
+        agent.sp = FakePort('')
+        size = service.FRAGMENT_UNACKED_MAX_SIZE
+        # the three fragments of the first RESPONSE
+        limit = 3 * len(service.Packet(tools.guidFromInt(1), service.RESPONSE, 'a' * 4))
+        service.FRAGMENT_UNACKED_MAX_SIZE = limit
+        try:
+            # only the fragments within the limit are kept to be sent again
+            agent.send(service.Packet(tools.guidFromInt(1), service.RESPONSE, 'a' * 10))
+            agent.send(service.Packet(tools.guidFromInt(2), service.RESPONSE, 'b' * 10))
+        finally:
+            service.FRAGMENT_UNACKED_MAX_SIZE = size
+        self.assertEquals([tools.guidFromInt(1)], agent._unacked.keys())
+        self.assertEquals([1, 2, 3], sorted(agent._unacked[tools.guidFromInt(1)]))
+        self.assertTrue(agent._unacked_size <= limit)
+        agent.processPacket(service.Packet.newWithRECEIVED(tools.guidFromInt(2), 1, 3))
+        # a RESPONSE is given up after FRAGMENT_UNACKED_MAX_AGE
+        agent._unacked_since[tools.guidFromInt(1)] -= service.FRAGMENT_UNACKED_MAX_AGE + 1
+        agent.resendFragments()
+        self.assertEquals(({}, {}, 0), (agent._unacked, agent._unacked_since, agent._unacked_size))
+
+    def testFragmentReceived(self):
+        ack = service.Packet.newWithRECEIVED(tools.guidFromInt(1), 2, 7)
+        agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        agent.sp = FakePort(ack.toString())
+        r = agent.read(timeout=1)
+        self.assertEquals((service.RECEIVED, 2, 7), (r.type, r.number, r.count))
+        self.assertEquals([], agent.sp.written)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.guid = tools.guidFromInt(1)
+        self.agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        self.output = ''.join(['eth%d <up> mtu 1500 & "inet" 10.%d.%d.1\n' % (i, i * 7 % 256, i * 13 % 256)
+                               for i in range(2000)])
+
+    def receive(self, agent, p):
+        agent.sp = FakePort(p.toString())
+        return agent.read(timeout=1)
+
+    def testPlainHost(self):
+        self.receive(self.agent, service.Packet.newWithCOMMAND(self.guid, 'osinfo'))
+        self.agent.sp = FakePort('')
+        p = service.Packet.newWithRESPONSE(self.guid, 'Success', 'osinfo', self.output)
+        self.agent.send(p)
+        self.assertEquals(''.join([k for f, k in self.agent.frames(p)]), ''.join(self.agent.sp.written))
+
+    def testNegotiation(self):
+        host = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        host.advertiseFlags()
+        host.sp = FakePort('')
+        host.send(service.Packet.newWithCOMMAND(self.guid, 'osinfo'))
+        # the host does not know yet if the agent inflates
+        self.assertEquals([service.HEADER_CAPABILITIES],
+                          [service.Packet.fromString(s).flags for s in host.sp.written])
+        self.receive(self.agent, service.Packet.fromString(host.sp.written[0]))
+        self.agent.sp = FakePort('')
+        self.agent.send(service.Packet.newWithRECEIVED(self.guid))
+        self.agent.send(service.Packet.newWithRESPONSE(self.guid, 'Success', 'osinfo', self.output))
+        frames = [service.Packet.fromString(s) for s in self.agent.sp.written]
+        self.assertEquals([service.HEADER_CAPABILITIES, service.HEADER_CAPABILITIES + 'Z'],
+                          [f.flags for f in frames])
+        self.assertTrue(len(frames[1].body) < len(self.output) / 2)
+        host.sp = FakePort(''.join(self.agent.sp.written))
+        self.assertEquals(service.RECEIVED, host.read(timeout=1).type)
+        r = host.read(timeout=1)
+        self.assertTrue(service.escape(self.output) in r.body)
+
+    def testFragments(self):
+        size = service.RESPONSE_FRAGMENT_SIZE
+        service.RESPONSE_FRAGMENT_SIZE = 512
+        try:
+            self.agent._peer_flags = service.HEADER_FLAG_INFLATE + service.HEADER_FLAG_FRAGMENTS
+            p = self.agent.encode(service.Packet(self.guid, service.RESPONSE, self.output))
+            frames = list(self.agent.frames(p))
+        finally:
+            service.RESPONSE_FRAGMENT_SIZE = size
+        # the body is deflated once, then split
+        self.assertTrue(len(frames) > 1)
+        self.assertEquals([service.HEADER_CAPABILITIES + 'Z'], list(set([f.flags for f, k in frames])))
+        host = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        host.sp = FakePort(''.join([k for f, k in frames]))
+        self.assertEquals(self.output, host.read(timeout=1).body)
+
+    def testInvalidBody(self):
+        p = service.Packet(self.guid, service.COMMAND, 'not zlib', flags='zZ')
+        self.assertEquals(None, self.receive(self.agent, p))
+        self.assertEquals(1, self.agent._link.framing_errors)
+        # the COMMAND is answered with an Error RESPONSE instead of being dropped
+        self.assertEquals([(service.AUTHRESPONSE, self.guid)],
+                          [(a.type, a.guid) for a in parse(self.agent.sp.written)])
+        self.agent.sp = FakePort('')
+        self.agent.processPacket(service.Packet.newWithAUTHRESPONSE(self.guid))
+        r = parse(self.agent.sp.written)[0]
+        self.assertEquals(service.RESPONSE, r.type)
+        self.assertTrue('<responseType>Error</responseType>' in r.body)
+        self.assertTrue('invalid deflated body' in r.body)
+
+
+def parse(written):
+    """The packets in the data written to a FakePort"""
+    data = ''.join(written)
+    packets = []
+    while data:
+        packets.append(service.Packet.fromString(data))
+        data = data[len(packets[-1]):]
+    return packets
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tempdir = tempfile.tempdir
+        tempfile.tempdir = self.dir
+        self.root = tools._PLUGINS_ROOT
+        tools._PLUGINS_ROOT = self.dir
+        self.attachments = os.path.join(self.dir, 'attachments')
+        self.size = service.DATA_FRAGMENT_SIZE
+        service.DATA_FRAGMENT_SIZE = 1000
+        self.guid = tools.guidFromInt(1)
+        r = random.Random(0)
+        self.data = ''.join([chr(r.randint(0, 255)) for i in range(3000)]) + 'print 1\n' * 500
+        self.agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        self.host = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        self.host.advertiseFlags()
+        self.host.sp = FakePort('')
+
+    def tearDown(self):
+        service.DATA_FRAGMENT_SIZE = self.size
+        tempfile.tempdir = self.tempdir
+        tools._PLUGINS_ROOT = self.root
+        shutil.rmtree(self.dir)
+
+    def transfer(self, frames):
+        """Process frames with the agent until the COMMAND, return what it wrote"""
+        self.agent.sp = FakePort(''.join(frames))
+        while True:
+            p = self.agent.read(timeout=1)
+            self.agent.processPacket(p)
+            if p.type == service.COMMAND:
+                return parse(self.agent.sp.written)
+
+    def testPlainPeer(self):
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        self.assertEquals([service.COMMAND], [p.type for p in parse(self.host.sp.written)])
+        self.transfer(self.host.sp.written)
+        self.assertEquals(self.data, open(self.agent._command_queue[0].binary_data).read())
+
+    def testTransfer(self):
+        self.host._peer_flags = service.HEADER_FLAG_DATA
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        frames = parse(self.host.sp.written)
+        self.assertEquals([service.DATA] * 7 + [service.COMMAND], [f.type for f in frames])
+        self.assertTrue('<dataPacket size="%d"/>' % len(self.data) in frames[-1].body)
+        written = self.transfer(self.host.sp.written)
+        # the fragments but the last one are acknowledged, then the COMMAND
+        self.assertEquals([(n, 7) for n in range(1, 7)] + [(1, 1)],
+                          [(p.number, p.count) for p in written])
+        c = self.agent._command_queue[0]
+        self.assertEquals(os.path.join(self.attachments, self.guid), c.binary_data)
+        self.assertEquals(self.data, open(c.binary_data).read())
+        self.assertEquals({}, self.agent._attachments)
+        if hasattr(os, 'getuid'):
+            self.assertEquals(0700, os.stat(self.attachments).st_mode & 0777)
+            self.assertEquals(0600, os.stat(c.binary_data).st_mode & 0777)
+
+    def testPlantedPartial(self):
+        # a symbolic link in place of the partial file is replaced, not followed
+        target = os.path.join(self.dir, 'target')
+        open(target, 'w').write('keep')
+        os.mkdir(self.attachments, 0700)
+        os.symlink(target, os.path.join(self.attachments, self.guid + '.part'))
+        self.host._peer_flags = service.HEADER_FLAG_DATA
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        self.transfer(self.host.sp.written)
+        self.assertEquals('keep', open(target).read())
+        self.assertEquals(self.data, open(self.agent._command_queue[0].binary_data).read())
+
+    def testPlantedData(self):
+        # a file of the announced size is not taken without its DATA packets
+        os.mkdir(self.attachments, 0700)
+        open(os.path.join(self.attachments, self.guid), 'wb').write(self.data)
+        open(os.path.join(self.dir, self.guid), 'wb').write(self.data)
+        p = service.Packet.newWithCOMMAND(self.guid, 'upload a.bin', self.data, True)
+        written = self.transfer([p.toString()])
+        self.assertEquals(service.AUTHRESPONSE, written[-1].type)
+        self.assertTrue('Error' in self.agent._threads[self.guid].responsePacket().body)
+        self.assertEquals([], self.agent._command_queue)
+
+    def testDeflated(self):
+        self.host._peer_flags = service.HEADER_CAPABILITIES
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        frames = parse(self.host.sp.written)
+        self.assertEquals(service.HEADER_CAPABILITIES + 'Z', frames[0].flags)
+        self.assertTrue(len(frames) < 7)
+        self.transfer(self.host.sp.written)
+        self.assertEquals(self.data, open(self.agent._command_queue[0].binary_data).read())
+
+    def testRetransmit(self):
+        self.host._peer_flags = service.HEADER_FLAG_DATA
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        frames = [p.toString() for p in parse(self.host.sp.written)]
+        self.transfer(frames[:3] + frames[2:])
+        self.assertEquals(self.data, open(self.agent._command_queue[0].binary_data).read())
+        self.assertEquals(1, self.agent._link.retransmits)
+
+    def testMissingFragment(self):
+        self.host._peer_flags = service.HEADER_FLAG_DATA
+        self.host.sendCommand(self.guid, 'upload a.bin', self.data)
+        frames = [p.toString() for p in parse(self.host.sp.written)]
+        written = self.transfer(frames[:2] + frames[3:])
+        # the COMMAND is answered with an Error RESPONSE
+        self.assertEquals(service.AUTHRESPONSE, written[-1].type)
+        self.assertTrue('Error' in self.agent._threads[self.guid].responsePacket().body)
+        self.assertEquals([], os.listdir(self.attachments))
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.metrics = service.getMetricsFileName
+        service.getMetricsFileName = lambda: self.dir + '/metrics.prom'
+
+    def tearDown(self):
+        service.getMetricsFileName = self.metrics
+        shutil.rmtree(self.dir)
+
+    def testReaderError(self):
+        agent = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        ack = service.Packet.newWithACK(tools.guidFromInt(1))
+        agent.sp = FakePort(ack.toString())
+        self.assertRaises(serial.SerialException, agent.run)
+        # the ACK answer queued before the error is written
+        self.assertEquals([ack.toString()], agent.sp.written)
+
+
+if __name__ == '__main__':
+    unittest.main()
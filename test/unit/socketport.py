@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, socket, threading, time
+import serial
+from serial.urlhandler import protocol_socket
+import service
+
+
+class EchoServer(object):
+    """Accept one connection on 127.0.0.1 and send back what it receives"""
+
+    def __init__(self, echo=True):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.url = 'socket://127.0.0.1:%d' % self.listener.getsockname()[1]
+        self.connection = None
+        self._echo = echo
+        self._accepted = threading.Event()
+        thread = threading.Thread(target=self._serve)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _serve(self):
+        self.connection, _ = self.listener.accept()
+        self.listener.close()
+        self._accepted.set()
+        while self._echo:
+            try:
+                data = self.connection.recv(65536)
+            except socket.error:
+                break
+            if not data:
+                break
+            self.connection.sendall(data)
+
+    def peer(self):
+        self._accepted.wait(5)
+        return self.connection
+
+
+class TestSocketSerial(unittest.TestCase):
+    def tearDown(self):
+        self.port.close()
+
+    def testEcho(self):
+        self.port = serial.serial_for_url(EchoServer().url, timeout=5)
+        data = ''.join([chr(i % 256) for i in range(4 * 1024 * 1024)])
+        writer = threading.Thread(target=self.port.write, args=(data,))
+        writer.start()
+        received = []
+        left = len(data)
+        while left > 0:
+            r = self.port.read(min(left, 100000))
+            self.assertTrue(r)
+            received.append(r)
+            left -= len(r)
+        writer.join()
+        self.assertEquals(data, ''.join(received))
+
+    def testInWaitingAndFlush(self):
+        server = EchoServer(echo=False)
+        self.port = serial.serial_for_url(server.url, timeout=1)
+        server.peer().sendall('hello')
+        time.sleep(0.1)
+        self.assertEquals(5, self.port.inWaiting())
+        self.assertEquals('he', self.port.read(2))
+        self.assertEquals(3, self.port.inWaiting())
+        self.port.flushInput()
+        self.assertEquals(0, self.port.inWaiting())
+
+    def testTimeout(self):
+        server = EchoServer(echo=False)
+        self.port = serial.serial_for_url(server.url, timeout=0.2)
+        server.peer().sendall('abc')
+        started = time.time()
+        self.assertEquals('abc', self.port.read(10))
+        self.assertTrue(time.time() - started < 1)
+        self.assertEquals('', self.port.read(10))
+        self.port.timeout = 0
+        self.assertEquals('', self.port.read(10))
+
+    def testConnectionClosed(self):
+        server = EchoServer(echo=False)
+        self.port = serial.serial_for_url(server.url, timeout=1)
+        server.peer().sendall('last')
+        server.peer().close()
+        time.sleep(0.1)
+        self.assertEquals('last', self.port.read(10))
+        self.assertRaises(serial.SerialException, self.port.read, 1)
+
+    def testOptions(self):
+        server = EchoServer()
+        self.port = serial.serial_for_url(server.url + '/rcvbuf=262144/sndbuf=131072', timeout=1)
+        s = self.port._socket
+        self.assertTrue(s.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 262144)
+        self.assertTrue(s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 131072)
+        self.assertRaises(serial.SerialException, serial.serial_for_url, server.url + '/nobuf=1')
+
+
+class TestServiceStart(unittest.TestCase):
+    def testURL(self):
+        server = EchoServer()
+        agent = service.Service({'SERIAL': {'port': server.url, 'baudrate': 115200,
+                                            'bytesize': '8', 'parity': 'N', 'stopbits': '1'},
+                                 'PLUGINS': {'command_timeout': '40'}})
+        agent.start()
+        try:
+            self.assertTrue(isinstance(agent.sp, protocol_socket.SocketSerial))
+            p = service.Packet.newWithACK('0' * 32)
+            agent.send(p)
+            self.assertEquals(p.guid, agent.read(timeout=5).guid)
+        finally:
+            agent.sp.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, subprocess, sys, tempfile, shutil
+
+# seconds spent importing modules by an --exec child, generous to not fail on
+# slow machines but low enough to catch heavy imports coming back
+IMPORT_BUDGET = 0.25
+
+# modules that the --exec children must not load unless they use them
+NOT_AT_STARTUP = ('serial', 'urllib', 'urllib2', 'httplib', 'socket', 'ssl',
+                  'xml.sax', 'logging.handlers')
+
+
+def execChild(*args):
+    """Return (import seconds, imported module names) of service.py --exec args"""
+    p = subprocess.Popen([sys.executable, common.filePath('importtime.py'),
+                          os.path.join(common.ROOT, 'service.py'), '--exec'] + list(args),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         cwd=common.ROOT)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    lines = err.splitlines()
+    return float(lines[0]), set(lines[1:])
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, *args):
+        seconds, modules = execChild(*args)
+        self.assertEquals([], [m for m in NOT_AT_STARTUP if m in modules])
+        self.assertTrue(seconds < IMPORT_BUDGET,
+                        'imports took %.3f s' % seconds)
+
+    def testOneLineScript(self):
+        script = os.path.join(self.dir, 'hello.py')
+        open(script, 'w').write('print "hello"\n')
+        self.check(script)
+
+    def testModuleList(self):
+        self.check('internals/modulemng.py', 'list')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, socket, tempfile, time
+import serial
+from serial.tools import list_ports_posix
+from serial.urlhandler import protocol_virtio, protocol_vsock
+import service, tools
+
+SETTINGS = {'port': 'auto', 'baudrate': '57600', 'bytesize': '8', 'parity': 'N',
+            'stopbits': '1', 'vsock_port': '1234', 'virtio_name': 'org.serclient.0'}
+
+
+class VirtioPorts(object):
+    """A /dev/virtio-ports stand-in: the ports are FIFOs, opened read/write
+    they return what is written like a host echoing, and they are no tty"""
+
+    def __init__(self, *names):
+        self.root = tempfile.mkdtemp()
+        self.dir = os.path.join(self.root, 'virtio-ports')
+        os.mkdir(self.dir)
+        for name in names:
+            os.mkfifo(os.path.join(self.dir, name))
+        self.vsock = os.path.join(self.root, 'vsock')
+        self._saved = (list_ports_posix.VIRTIO_PORTS_DIR, list_ports_posix.VSOCK_DEVICE,
+                       protocol_virtio.VIRTIO_PORTS_DIR)
+        list_ports_posix.VIRTIO_PORTS_DIR = self.dir
+        list_ports_posix.VSOCK_DEVICE = self.vsock
+        protocol_virtio.VIRTIO_PORTS_DIR = self.dir
+
+    def addVsock(self):
+        open(self.vsock, 'w').close()
+
+    def close(self):
+        list_ports_posix.VIRTIO_PORTS_DIR, list_ports_posix.VSOCK_DEVICE, \
+            protocol_virtio.VIRTIO_PORTS_DIR = self._saved
+        shutil.rmtree(self.root)
+
+
+def hangUp(port):
+    """replace the device of the open port by a pipe whose writer is gone, as a
+    virtio port whose host end is disconnected: hangup and EOF"""
+    r, w = os.pipe()
+    os.close(w)
+    os.dup2(r, port.fd)
+    os.close(r)
+
+
+class SocketpairVsock(protocol_vsock.Serial):
+    """vsock:// port connected to one end of a socketpair instead of the host"""
+
+    def _connect(self, address):
+        self.address = address
+        self._socket, self.peer = socket.socketpair()
+
+
+class TestVirtioSerial(unittest.TestCase):
+    def setUp(self):
+        self.ports = VirtioPorts('org.serclient.0')
+
+    def tearDown(self):
+        self.ports.close()
+
+    def testEcho(self):
+        port = serial.serial_for_url('virtio://org.serclient.0', baudrate=57600, timeout=1)
+        try:
+            self.assertTrue(isinstance(port, protocol_virtio.VirtioSerial))
+            self.assertEquals(os.path.join(self.ports.dir, 'org.serclient.0'), port.portstr)
+            self.assertEquals('', port.read_available(10, timeout=0))
+            data = ''.join([chr(i % 256) for i in range(20000)])
+            port.write(data)
+            received = []
+            while sum([len(r) for r in received]) < len(data):
+                r = port.read_available(8192, timeout=1)
+                self.assertTrue(r)
+                received.append(r)
+            self.assertEquals(data, ''.join(received))
+            # no termios: the settings and the modem lines are ignored
+            port.baudrate = 115200
+            port.setRTS(True)
+            port.write('left')
+            self.assertEquals(1, port.inWaiting())
+            port.flushInput()
+            self.assertEquals(0, port.inWaiting())
+        finally:
+            port.close()
+
+    def testHostDisconnected(self):
+        port = serial.serial_for_url('virtio://org.serclient.0', timeout=1, writeTimeout=0.2)
+        try:
+            self.assertTrue(port.hostConnected())
+            hangUp(port)
+            self.assertFalse(port.hostConnected())
+            self.assertEquals(0, port.inWaiting())
+            # no data after a delay, not an error
+            started = time.time()
+            self.assertEquals('', port.read_available(10, timeout=5))
+            self.assertTrue(time.time() - started < 5)
+            self.assertEquals('', port.read_available(10, timeout=0))
+            # writes wait for the host
+            self.assertRaises(serial.SerialTimeoutException, port.write, 'hello')
+        finally:
+            port.close()
+
+    def testPath(self):
+        path = os.path.join(self.ports.dir, 'org.serclient.0')
+        port = serial.serial_for_url('virtio://' + path, timeout=1)
+        port.close()
+        self.assertEquals(path, port.portstr)
+
+    def testMissing(self):
+        self.assertRaises(serial.SerialException, serial.serial_for_url, 'virtio://org.other.0')
+        self.assertRaises(serial.SerialException, serial.serial_for_url, 'virtio://')
+
+
+class TestVsockSerial(unittest.TestCase):
+    def testURL(self):
+        port = protocol_vsock.Serial(None)
+        port._socket_options = []
+        self.assertEquals((2, 1234), port.fromURL('vsock://host:1234'))
+        self.assertEquals((1, 5), port.fromURL('vsock://LOCAL:5'))
+        self.assertEquals((3, 70000), port.fromURL('vsock://3:70000/sndbuf=65536'))
+        for url in ('vsock://3', 'vsock://guest:1', 'vsock://3:x', 'vsock://-1:2',
+                    'vsock://3:4294967296', 'vsock://3:4/nobuf=1'):
+            try:
+                port.fromURL(url)
+            except serial.SerialException, e:
+                self.assertTrue('vsock://<cid>:<port>' in str(e), e)
+            else:
+                self.fail(url)
+
+    def testEcho(self):
+        port = SocketpairVsock('vsock://host:1234', timeout=1)
+        try:
+            self.assertEquals((2, 1234), port.address)
+            port.write('hello')
+            self.assertEquals('hello', port.peer.recv(5))
+            port.peer.sendall('world')
+            self.assertEquals('world', port.read_available(10))
+            self.assertEquals('', port.read_available(10, timeout=0))
+        finally:
+            port.close()
+            port.peer.close()
+
+    def testNoHost(self):
+        # nothing listens on the port, or there is no vsock at all
+        self.assertRaises(serial.SerialException, serial.serial_for_url, 'vsock://host:1')
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.ports = VirtioPorts('org.qemu.guest_agent.0', 'org.serclient.0')
+
+    def tearDown(self):
+        self.ports.close()
+
+    def testChannels(self):
+        self.assertEquals(['virtio://org.qemu.guest_agent.0', 'virtio://org.serclient.0'],
+                          sorted([c[0] for c in list_ports_posix.virtio_ports()]))
+        self.assertEquals(['virtio://org.serclient.0'],
+                          [c[0] for c in list_ports_posix.channels(1234, 'org.serclient.0')])
+        self.ports.addVsock()
+        self.assertEquals(['vsock://2:1234', 'virtio://org.serclient.0'],
+                          [c[0] for c in list_ports_posix.channels(1234, 'org.serclient.0')])
+        self.assertEquals([], list_ports_posix.channels())
+        self.assertEquals(['vsock://2:1234', 'virtio://org.serclient.0', 0], service.probePorts(SETTINGS))
+        settings = dict(SETTINGS, vsock_port='', virtio_name='')
+        self.assertEquals([0], service.probePorts(settings))
+
+    def testTransportFor(self):
+        self.assertEquals('vsock', service.transportFor('VSOCK://2:1').name)
+        self.assertEquals('virtio-serial', service.transportFor('virtio://org.serclient.0').name)
+        for port in (0, '/dev/ttyS1', 'socket://127.0.0.1:1'):
+            self.assertEquals('uart', service.transportFor(port).name)
+
+
+class TestServiceStart(unittest.TestCase):
+    def setUp(self):
+        self.ports = VirtioPorts('org.serclient.0')
+        self.opened = []
+
+    def tearDown(self):
+        self.ports.close()
+
+    def open(self, port, **kwargs):
+        self.opened.append((port, kwargs))
+        if port == 0:
+            return 'uart'
+        return serial.serial_for_url(port, **kwargs)
+
+    def start(self, **settings):
+        agent = service.Service({'SERIAL': dict(SETTINGS, **settings),
+                                 'PLUGINS': {'command_timeout': '40'}}, self.open)
+        agent.start()
+        return agent
+
+    def testFastest(self):
+        self.ports.addVsock()
+        agent = self.start()
+        try:
+            # there is no vsock host in the stand-in, virtio-serial is the next channel
+            self.assertEquals(['vsock://2:1234', 'virtio://org.serclient.0'], [p for p, k in self.opened])
+            self.assertEquals({'timeout': service.SERIAL_READ_TIMEOUT}, self.opened[1][1])
+            self.assertEquals('virtio-serial', agent.transport.name)
+            p = service.Packet.newWithACK('0' * 32)
+            agent.send(p)
+            self.assertEquals(p.guid, agent.read(timeout=5).guid)
+        finally:
+            agent.sp.close()
+
+    def testHostNotConnected(self):
+        hungUp = []
+        def open(port, **kwargs):
+            sp = self.open(port, **kwargs)
+            if port != 0:
+                hangUp(sp)
+                hungUp.append(sp)
+            return sp
+        agent = service.Service({'SERIAL': SETTINGS, 'PLUGINS': {'command_timeout': '40'}}, open)
+        agent.start()
+        self.assertEquals(['virtio://org.serclient.0', 0], [p for p, k in self.opened])
+        self.assertEquals('uart', agent.transport.name)
+        self.assertFalse(hungUp[0].isOpen())
+        # a virtio port given explicitly is used anyway, the host may connect later
+        agent = service.Service({'SERIAL': dict(SETTINGS, port='virtio://org.serclient.0'),
+                                 'PLUGINS': {'command_timeout': '40'}}, open)
+        agent.start()
+        try:
+            self.assertEquals('virtio-serial', agent.transport.name)
+            self.assertEquals('', agent.sp.read_available(10, timeout=0))
+        finally:
+            agent.sp.close()
+
+    def testDefault(self):
+        # the serial port, the channels are probed on request only
+        self.assertEquals('0', tools._getConfigurationDefaults()['SERIAL']['port'])
+
+    def testSerialPort(self):
+        agent = self.start(virtio_name='org.other.0')
+        self.assertEquals('uart', agent.sp)
+        self.assertEquals('uart', agent.transport.name)
+        self.assertEquals([(0, {'baudrate': '57600', 'bytesize': 8, 'parity': 'N', 'stopbits': 1.0,
+                                'timeout': service.SERIAL_READ_TIMEOUT})], self.opened)
+
+    def testExplicit(self):
+        agent = self.start(port='0')
+        self.assertEquals([0], [p for p, k in self.opened])
+        self.assertRaises(serial.SerialException, self.start, port='virtio://org.other.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import common, unittest, os, shutil, tempfile, logging
+import tools, service
+
+
+class RecordHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class FakeSerial(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class TestLogData(unittest.TestCase):
+    def testHexdump(self):
+        self.assertEquals('02 41 ff', str(tools.Hexdump('\x02A\xff')))
+        self.assertEquals('00 01 ... (10 bytes)',
+                          str(tools.Hexdump('\x00\x01' * 5, 2)))
+
+    def testExcerpt(self):
+        self.assertEquals("'abc'", str(tools.Excerpt('abc')))
+        self.assertEquals("'ab' ... (6 bytes)",
+                          str(tools.Excerpt('abcdef', 2)))
+
+
+class TestWireTrace(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'serclient.wiretrace')
+        self.handler = RecordHandler()
+        self.logger = logging.getLogger('serclient')
+        self.level = self.logger.level
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+        self.interval = service.WIRETRACE_CHECK_INTERVAL
+        service.WIRETRACE_CHECK_INTERVAL = 0
+
+        self.service = service.Service({'PLUGINS': {'command_timeout': '40'}})
+        self.service.sp = FakeSerial()
+        self.service._trace = service.WireTrace(self.path)
+
+    def tearDown(self):
+        service.WIRETRACE_CHECK_INTERVAL = self.interval
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        shutil.rmtree(self.dir)
+
+    def traced(self):
+        return [m for m in self.handler.messages if m.startswith('[wire]')]
+
+    def send(self, count):
+        for i in range(count):
+            self.service.send(service.Packet.newWithACK(tools.guidFromInt(i)))
+
+    def testDisabled(self):
+        self.send(3)
+
+        self.assertEquals([], self.traced())
+        self.assertEquals(3, len(self.service.sp.written))
+
+    def testSampling(self):
+        self.send(1)
+        open(self.path, 'w').write('2\n')
+        self.send(4)
+
+        self.assertEquals(2, len(self.traced()))
+        self.assertTrue(self.traced()[0].startswith('[wire] OUT 96 bytes: 02 41 43 4b 00'))
+
+        os.remove(self.path)
+        self.send(4)
+        self.assertEquals(2, len(self.traced()))
+
+
+if __name__ == '__main__':
+    unittest.main()
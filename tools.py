@@ -26,14 +26,21 @@ import subprocess
 from elementtree.ElementTree import Element, SubElement
 from ConfigParser import *
 import logging
-import serial
 import argparse
-from logging.handlers import *
 import time
-import urllib
+import hashlib
+import tempfile
+import string
+import binascii
+import threading
+import bisect
+import re
+from Queue import Queue, Full
 
-EXTENSION_BLOCKING = ".blocking" 	# this extension will match for plugins that are blocking ones
-EXTENSION_VERSION = ".version"		# this extension will match for plugins that have a version
+EXTENSION_BLOCKING = ".blocking" 	# legacy: this extension will match for plugins that are blocking ones
+EXTENSION_VERSION = ".version"		# legacy: this extension will match for plugins that have a version
+
+MANIFEST_FILE = "modules.ini"		# per directory file with the metadata of its modules
 
 MODULE_VALID_EXTENSIONS = ("", ".exe", ".py", ".sh", ".bat")
 
@@ -63,6 +70,46 @@ _SERVICE_RESTART_FILE = "serclient.restart"
 # Name of the file where the updateSoftware log is stored
 _UPDATESOFTWARE_LOG_FILE = "updateSoftware.log"
 
+# Name of the file that enables the wire trace, it contains the sampling rate
+_WIRETRACE_FILE = "serclient.wiretrace"
+
+# Bytes shown by default by Hexdump and Excerpt
+LOG_DATA_LIMIT = 64
+
+# Command metrics saved by the service in the plugins root, Prometheus text format
+_METRICS_FILE = "serclient-metrics.prom"
+
+# Histogram upper bounds for the command phases (seconds) and the command output (bytes)
+METRICS_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+METRICS_SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Module label of the commands naming no installed module: the names come from the host and
+# would add a series each
+METRICS_OTHER_MODULE = "other"
+
+# Minimum seconds between two samples of the serial link throughput
+LINK_THROUGHPUT_WINDOW = 60
+
+# Default size of the log file before it is rotated and number of records buffered by AsyncHandler
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+# Downloads are streamed into a partial file with this extension until they are complete,
+# the lock file with the other extension is held meanwhile so that only one process writes it
+EXTENSION_PARTIAL = ".part"
+EXTENSION_LOCK = ".lock"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30				# socket timeout in seconds
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_RETRY_DELAY = 1			# seconds to wait before resuming an interrupted download
+DOWNLOAD_PROGRESS_INTERVAL = 5		# seconds between two progress log lines
+
+# Name of the directory where downloaded artifacts are cached and its default size limit in bytes
+_ARTIFACT_CACHE_DIR = "cache"
+DEFAULT_CACHE_SIZE = 200 * 1024 * 1024
+
+# Name of the directory where the binary data received in DATA packets is stored
+_ATTACHMENTS_DIR = "attachments"
+
 def _getConfigurationDefaults():
 	"""
 	Return default values for arguments.
@@ -74,17 +121,24 @@ def _getConfigurationDefaults():
 			'level': str(logging.DEBUG),
 			'file': 'stdout',
 			'syslog_address': '',
+			'max_bytes': str(DEFAULT_LOG_MAX_BYTES),
+			'queue_size': str(DEFAULT_LOG_QUEUE_SIZE),
 		}, 
 		'SERIAL': {
-			'port': '0', #default port for PySerial
+			'port': '0', #default port for PySerial, 'auto' for the fastest channel to the host
+			# channels probed by port auto, see service.probePorts
+			'vsock_port': '',
+			'virtio_name': 'org.serclient.0',
 			'baudrate':'57600',
-			'bytesize': str(serial.EIGHTBITS),
-			'parity': str(serial.PARITY_NONE),
-			'stopbits': str(serial.STOPBITS_ONE),
+			# serial.EIGHTBITS, PARITY_NONE and STOPBITS_ONE, pyserial is not imported by --exec children
+			'bytesize': '8',
+			'parity': 'N',
+			'stopbits': '1',
 		},
 		'PLUGINS': {
 			'command_timeout': '40',
 			'root': _ROOT,
+			'cache_size': str(DEFAULT_CACHE_SIZE),
 		},
 		'TIMEOUT': {
 			'updateSoftware': '90',
@@ -101,13 +155,18 @@ def getConfigurationDictFromArgparse(args):
 			'file': args.log,
 			'level': str(args.log_level),
 			'syslog_address': args.syslog_address,
+			'max_bytes': str(args.log_max_bytes),
+			'queue_size': str(args.log_queue_size),
 		},
 		'PLUGINS': {
 			'command_timeout': str(args.command_timeout),
 			'root': _ROOT, # do not allow root changes from the command line, external process can not access it!
+			'cache_size': str(DEFAULT_CACHE_SIZE),
 		},
 		'SERIAL': {
 			'port': str(args.serial_port),
+			'vsock_port': str(args.vsock_port),
+			'virtio_name': str(args.virtio_name),
 			'baudrate': str(args.baudrate),
 			'bytesize': str(args.bytesize),
 			'parity': str(args.parity),
@@ -136,27 +195,120 @@ def getConfigurationFromINI():
 			v.update(c[k])
 	return defaults
 	
+class AsyncHandler(logging.Handler):
+	"""
+	Logging handler that passes the records to a background thread writing them to the target handlers,
+	so the thread logging never waits for file or network I/O.
+	
+	The queue is bounded: when it is full the records are dropped and counted, and a warning with the 
+	number of lost records is written as soon as the writer catches up. Call `close` (or `shutdownLogging`)
+	before exiting to write the queued records.
+	
+	The writer thread is restarted in a forked child (see `daemonize`), records still queued in the parent
+	are lost.
+	"""
+	
+	def __init__(self, handlers, queue_size=DEFAULT_LOG_QUEUE_SIZE):
+		logging.Handler.__init__(self)
+		self._handlers = handlers
+		self._queue_size = queue_size
+		self._start()
+		
+	def _start(self):
+		self._pid = os.getpid()
+		self._queue = Queue(self._queue_size)
+		self._dropped_lock = threading.Lock()
+		self.dropped = 0
+		self._reported = 0
+		self._thread = threading.Thread(target=self._run, name="AsyncLogWriter")
+		self._thread.setDaemon(True)
+		self._thread.start()
+		
+	def emit(self, record):
+		if self._pid != os.getpid(): self._start()
+		try:
+			self._queue.put_nowait(record)
+		except Full:
+			self._dropped_lock.acquire()
+			self.dropped += 1
+			self._dropped_lock.release()
+			
+	def _write(self, record):
+		for h in self._handlers:
+			if record.levelno >= h.level:
+				h.handle(record)
+				
+	def _run(self):
+		while 1:
+			record = self._queue.get()
+			try:
+				if record == None: return
+				dropped = self.dropped
+				if dropped != self._reported:
+					self._write(logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+						"Logging queue full: %d records dropped", (dropped - self._reported,), None))
+					self._reported = dropped
+				self._write(record)
+			finally:
+				self._queue.task_done()
+				
+	def flush(self, timeout=5.0):
+		"""
+		Wait up to timeout seconds for the queued records to be written
+		"""
+		deadline = time.time() + timeout
+		self._queue.all_tasks_done.acquire()
+		try:
+			while self._queue.unfinished_tasks and time.time() < deadline:
+				self._queue.all_tasks_done.wait(0.1)
+		finally:
+			self._queue.all_tasks_done.release()
+		for h in self._handlers:
+			h.flush()
+			
+	def close(self):
+		"""
+		Write the queued records, stop the writer thread and close the target handlers
+		"""
+		if self._pid == os.getpid() and self._thread.isAlive():
+			self.flush()
+			try:
+				self._queue.put(None, True, 1.0)
+			except Full:
+				pass
+			self._thread.join(1.0)
+		for h in self._handlers:
+			h.close()
+		logging.Handler.close(self)
+		
 def configureLogging(config):
 	"""
 	Configure logging capabilities
+	
+	File and syslog records are written by a background thread (see AsyncHandler).
 	"""
+	from logging.handlers import RotatingFileHandler, SysLogHandler
 	logging.basicConfig()
 	logger = logging.getLogger('serclient')
 	formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 	c = config['LOG']
 	level = int(c['level'])
 	logger.setLevel(level)
+	handlers = []
 	# todo add handlers to root logger
 	if c['file'] == 'stdout':
 		root = logging.getLogger('')
 		root.setLevel(level=level)
 		logger.debug("logging to stdout")
 	elif c['file'] != '':
-		rf = RotatingFileHandler(filename=c['file'], encoding='utf-8', backupCount=50)
+		rf = RotatingFileHandler(filename=c['file'], encoding='utf-8', maxBytes=int(c['max_bytes']), backupCount=50)
 		rf.setFormatter(formatter)
+		# the previous log is closed synchronously before rolling it over
 		logger.addHandler(rf)
 		logger.info('\n---------\nLog closed on %s.\n---------\n' % time.asctime())
 		if getRestartGUID(remove=False) == None: rf.doRollover()
+		logger.removeHandler(rf)
+		handlers.append(rf)
 	address = c['syslog_address']
 	if address != '':
 		if '/' not in address: 
@@ -168,11 +320,302 @@ def configureLogging(config):
 				address = (s[0], int(s[1]))
 		s = SysLogHandler(address=address)
 		s.setFormatter(formatter)
-		logger.addHandler(s)
+		handlers.append(s)
+	if handlers:
+		logger.addHandler(AsyncHandler(handlers, int(c['queue_size'])))
+	if address != '':
 		logger.debug("logging to syslog: %s" % repr(address))
 	logger.info('\n---------\nLog started on %s.\n---------\n' % time.asctime())
 	logger.info('Configuration arguments: %r' % config)
 	return logger
+	
+def shutdownLogging(logger):
+	"""
+	Flush and close the logger handlers; to be called when the service stops
+	"""
+	for h in logger.handlers[:]:
+		h.close()
+		logger.removeHandler(h)
+
+class Hexdump(object):
+	"""
+	Lazy hex representation of binary data for log calls, truncated to limit bytes. 
+	
+	The dump is built only if the message is actually emitted: logger.debug("%s", Hexdump(data))
+	"""
+	
+	def __init__(self, data, limit=LOG_DATA_LIMIT):
+		self._data = data
+		self._limit = limit
+		
+	def __str__(self):
+		h = binascii.hexlify(self._data[:self._limit])
+		h = ' '.join([h[i:i+2] for i in range(0, len(h), 2)])
+		if len(self._data) > self._limit:
+			return "%s ... (%d bytes)" % (h, len(self._data))
+		return h
+		
+class Excerpt(Hexdump):
+	"""
+	Lazy repr of the first limit bytes of a string for log calls
+	"""
+	
+	def __str__(self):
+		if len(self._data) > self._limit:
+			return "%r ... (%d bytes)" % (self._data[:self._limit], len(self._data))
+		return repr(self._data)
+
+class Histogram(object):
+	"""
+	Histogram with fixed upper bounds, the last bucket being +Inf as in the Prometheus text format
+	"""
+	
+	def __init__(self, buckets):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+		
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+		self.max = max(self.max, value)
+		
+	def quantile(self, q):
+		"""
+		Return the upper bound of the bucket holding the q quantile (the max for the last bucket), None if empty
+		"""
+		if self.count == 0: return None
+		rank = max(1, q * self.count)
+		seen = 0
+		for i in range(len(self.buckets)):
+			seen += self.counts[i]
+			if seen >= rank: return min(self.buckets[i], self.max)
+		return self.max
+		
+class LinkStats(object):
+	"""
+	Serial link counters: bytes and frames in both directions, decoding errors, bytes skipped 
+	to find the next header, logic timeouts, retransmitted packets received and RESPONSE 
+	fragments sent again.
+	
+	The throughput is the bytes per minute measured over the last complete window of at least
+	LINK_THROUGHPUT_WINDOW seconds.
+	"""
+	
+	COUNTERS = ('bytes_in', 'bytes_out', 'frames_in', 'frames_out', 'crc_errors', 'framing_errors',
+				'resync_bytes', 'logic_timeouts', 'retransmits', 'fragments_resent')
+	
+	def __init__(self):
+		for name in self.COUNTERS:
+			setattr(self, name, 0)
+		self.throughput_in = 0
+		self.throughput_out = 0
+		self._window = (time.time(), 0, 0)
+		# counters are updated by the serial reader and writer threads
+		self._lock = threading.Lock()
+		
+	def add(self, name, count=1):
+		self._lock.acquire()
+		try:
+			setattr(self, name, getattr(self, name) + count)
+		finally:
+			self._lock.release()
+		
+	def sample(self, now=None):
+		"""
+		Update the throughput if the current window is complete
+		"""
+		if now == None: now = time.time()
+		started, bytes_in, bytes_out = self._window
+		elapsed = now - started
+		if elapsed < LINK_THROUGHPUT_WINDOW: return
+		self.throughput_in = int((self.bytes_in - bytes_in) * 60 / elapsed)
+		self.throughput_out = int((self.bytes_out - bytes_out) * 60 / elapsed)
+		self._window = (now, self.bytes_in, self.bytes_out)
+		
+	def values(self):
+		"""
+		Return a list of (name, value) including the throughput
+		"""
+		return [(name, getattr(self, name)) for name in self.COUNTERS + ('throughput_in', 'throughput_out')]
+		
+	def __str__(self):
+		return ' '.join(['%s=%d' % v for v in self.values()])
+		
+class Metrics(object):
+	"""
+	Histograms of the command phases and output size by module.
+	
+	Filled by the service as the commands complete and saved periodically in the Prometheus text 
+	format, from which the stats internal (or a node exporter textfile collector) reads them back.
+	"""
+	
+	PHASES = 'serclient_command_phase_seconds'
+	OUTPUT = 'serclient_command_output_bytes'
+	COMMANDS = 'serclient_commands_total'
+	LINK = 'serclient_link_'
+	
+	_LINE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+	_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+	
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.histograms = {}
+		self.commands = {}
+		self.link = LinkStats()
+		self.changed = False
+		
+	def _histogram(self, name, labels, buckets):
+		h = self.histograms.get((name, labels))
+		if h == None:
+			h = self.histograms[(name, labels)] = Histogram(buckets)
+		return h
+		
+	def record(self, module, result, phases, output_size):
+		"""
+		Add a completed command
+		
+		@param phases: dict phase name -> seconds
+		@param result: response type (Success, Error, TimeOut)
+		"""
+		self._lock.acquire()
+		try:
+			for phase, seconds in phases.items():
+				self._histogram(self.PHASES, (module, phase), METRICS_TIME_BUCKETS).observe(seconds)
+			self._histogram(self.OUTPUT, (module,), METRICS_SIZE_BUCKETS).observe(output_size)
+			self.commands[(module, result)] = self.commands.get((module, result), 0) + 1
+			self.changed = True
+		finally:
+			self._lock.release()
+			
+	def phases(self):
+		"""
+		Return a sorted list of (module, phase, Histogram)
+		"""
+		r = [(k[1][0], k[1][1], h) for k, h in self.histograms.items() if k[0] == self.PHASES]
+		r.sort()
+		return r
+		
+	def toString(self):
+		out = []
+		self._lock.acquire()
+		try:
+			for name, labels, kind in ((self.PHASES, ('module', 'phase'), 'histogram'), 
+									   (self.OUTPUT, ('module',), 'histogram'),
+									   (self.COMMANDS, ('module', 'result'), 'counter')):
+				out.append('# TYPE %s %s' % (name, kind))
+				if kind == 'counter':
+					items = self.commands.items()
+					items.sort()
+					for values, count in items:
+						out.append('%s{%s} %d' % (name, _labels(labels, values), count))
+					continue
+				items = [(k[1], h) for k, h in self.histograms.items() if k[0] == name]
+				items.sort()
+				for values, h in items:
+					l = _labels(labels, values)
+					cumulative = 0
+					for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+						cumulative += count
+						out.append('%s_bucket{%s,le="%s"} %d' % (name, l, bound, cumulative))
+					out.append('%s_sum{%s} %r' % (name, l, float(h.sum)))
+					out.append('%s_count{%s} %d' % (name, l, h.count))
+					out.append('%s_max{%s} %r' % (name, l, float(h.max)))
+			for name, value in self.link.values():
+				if name.startswith('throughput'):
+					out.append('# TYPE %s%s_bytes_per_minute gauge' % (self.LINK, name))
+					out.append('%s%s_bytes_per_minute %d' % (self.LINK, name, value))
+				else:
+					out.append('# TYPE %s%s_total counter' % (self.LINK, name))
+					out.append('%s%s_total %d' % (self.LINK, name, value))
+		finally:
+			self._lock.release()
+		return '\n'.join(out) + '\n'
+		
+	def save(self, path):
+		"""
+		Atomically replace path with the current metrics, written to a private temporary file in 
+		the same directory then renamed
+		"""
+		directory, name = os.path.split(path)
+		fd, tmp = tempfile.mkstemp(prefix='.' + name, dir=directory)
+		try:
+			os.write(fd, self.toString())
+		finally:
+			os.close(fd)
+		_replaceFile(tmp, path)
+		self.changed = False
+		
+	@classmethod
+	def fromString(cls, string):
+		m = cls()
+		for line in string.splitlines():
+			if line.startswith(cls.LINK):
+				name, value = line[len(cls.LINK):].split()
+				for suffix in ('_total', '_bytes_per_minute'):
+					if name.endswith(suffix): name = name[:-len(suffix)]
+				if hasattr(m.link, name): setattr(m.link, name, int(value))
+				continue
+			match = cls._LINE.match(line)
+			if match == None: continue
+			name, labels, value = match.groups()
+			labels = dict([(k, _unescapeLabel(v)) for k, v in cls._LABEL.findall(labels)])
+			if name == cls.COMMANDS:
+				m.commands[(labels['module'], labels['result'])] = int(value)
+				continue
+			for metric, keys, buckets in ((cls.PHASES, ('module', 'phase'), METRICS_TIME_BUCKETS),
+										  (cls.OUTPUT, ('module',), METRICS_SIZE_BUCKETS)):
+				if not name.startswith(metric + '_'): continue
+				h = m._histogram(metric, tuple([labels[k] for k in keys]), buckets)
+				field = name[len(metric) + 1:]
+				if field == 'bucket':
+					if labels['le'] == '+Inf':
+						i = len(h.buckets)
+					else:
+						i = list(h.buckets).index(_number(labels['le']))
+					# cumulative counts are turned back into per bucket ones once the whole file is read
+					h.counts[i] = int(value)
+				elif field == 'sum':
+					h.sum = float(value)
+				elif field == 'count':
+					h.count = int(value)
+				elif field == 'max':
+					h.max = float(value)
+		for h in m.histograms.values():
+			for i in range(len(h.counts) - 1, 0, -1):
+				h.counts[i] -= h.counts[i - 1]
+		return m
+		
+	@classmethod
+	def load(cls, path):
+		"""
+		Read the metrics saved by the service, empty ones if there is no file
+		"""
+		try:
+			return cls.fromString(open(path).read())
+		except IOError:
+			return cls()
+			
+def _labels(names, values):
+	return ','.join(['%s="%s"' % (n, _escapeLabel(v)) for n, v in zip(names, values)])
+	
+def _escapeLabel(value):
+	"""
+	Escape backslash, double quote and line feed as the Prometheus text format requires
+	"""
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+	
+def _unescapeLabel(value):
+	return re.sub(r'\\(.)', lambda m: {'n': '\n'}.get(m.group(1), m.group(1)), value)
+	
+def _number(s):
+	try:
+		return int(s)
+	except ValueError:
+		return float(s)
 
 def getRoot():
 	"""
@@ -196,13 +639,84 @@ def getCustomDirectory():
 	"""
 	return os.path.join(getRoot(), "usermodules")
 
+def getArtifactCacheDirectory():
+	"""
+	Return the path to the directory where downloaded installers and modules are cached
+	"""
+	return os.path.join(getRoot(), _ARTIFACT_CACHE_DIR)
+
+def getAttachmentsDirectory():
+	"""
+	Return the path to the directory where the binary data received in DATA packets is stored, 
+	created readable by the agent user only
+	"""
+	path = os.path.join(getRoot(), _ATTACHMENTS_DIR)
+	if not os.path.isdir(path):
+		os.makedirs(path, 0700)
+	return path
+
+class _ModuleTypes(dict):
+	"""
+	Dictionary filled on first use: the installation dirs come from the INI file, that --exec 
+	children not dealing with modules never need to read
+	"""
+	
+	_loaded = False
+	
+	def _load(self):
+		if self._loaded: return
+		self._loaded = True
+		for k, v in {
+			# Name, Upgradable, (Paths..)
+			MODULE_INTERNALS: (MODULE_INTERNALS, False, (getRoot()+"/internals",)),
+			MODULE_PLUGINS: (MODULE_PLUGINS, True, (getRoot()+"/plugins",)), 
+			MODULE_CUSTOMS: (MODULE_CUSTOMS, True, (getCustomDirectory(),)),
+		}.items():
+			dict.setdefault(self, k, v)
+		
+	def __getitem__(self, key):
+		self._load()
+		return dict.__getitem__(self, key)
+		
+	def __contains__(self, key):
+		self._load()
+		return dict.__contains__(self, key)
+		
+	def __iter__(self):
+		self._load()
+		return dict.__iter__(self)
+		
+	def __len__(self):
+		self._load()
+		return dict.__len__(self)
+		
+	def get(self, key, default=None):
+		self._load()
+		return dict.get(self, key, default)
+		
+	def keys(self):
+		self._load()
+		return dict.keys(self)
+		
+	def values(self):
+		self._load()
+		return dict.values(self)
+		
+	def items(self):
+		self._load()
+		return dict.items(self)
+		
 # There are 3 types of modules, each one with its properties and installation dirs
-MODULE_TYPES = {
-	# Name, Upgradable, (Paths..)
-	MODULE_INTERNALS: (MODULE_INTERNALS, False, (getRoot()+"/internals",)),
-	MODULE_PLUGINS: (MODULE_PLUGINS, True, (getRoot()+"/plugins",)), 
-	MODULE_CUSTOMS: (MODULE_CUSTOMS, True, (getCustomDirectory(),)),
-}
+MODULE_TYPES = _ModuleTypes()
+
+def migrateModuleManifests():
+	"""
+	Migrate the legacy metadata files of every module directory, see `ModuleManifest.migrate`
+	"""
+	for type, upgradable, dirs in MODULE_TYPES.values():
+		for d in dirs:
+			if os.path.isdir(d):
+				ModuleManifest.migrate(d)
 
 def getServiceVersion():
 	"""
@@ -231,6 +745,9 @@ class Module(object):
 	ALIAS_NAME = {
 		# Service management
 		'restart.py': 'restart',
+		'wiretrace.py': 'wiretrace',
+		'linkstats.py': 'linkstats',
+		'stats.py': 'stats',
 		# Module management
 		'modulemng.py': 'modulemng',
 		'updateModule.py': 'updateModule',
@@ -245,13 +762,15 @@ class Module(object):
 		'systemstatus.py': 'systemstatus',
 	}
 	
-	def __init__(self, type, full_path, version, upgradable, blocking, alias=None):
+	def __init__(self, type, full_path, version, upgradable, blocking, alias=None, timeout=None, sha256=None):
 		self._type = type
 		self._full_path = full_path
 		self._name_and_extension = os.path.basename(self._full_path)
 		self._version = version
 		self._upgradable = upgradable
 		self._blocking = blocking
+		self._timeout = timeout
+		self._sha256 = sha256
 		if alias == None:
 			self._alias = Module.ALIAS_NAME.get(self._name_and_extension, self._name_and_extension)
 		else:
@@ -304,6 +823,18 @@ class Module(object):
 		"""
 		return self._blocking
 		
+	def timeout(self):
+		"""
+		Returns the execution timeout in seconds declared for the module or None
+		"""
+		return self._timeout
+		
+	def checksum(self):
+		"""
+		Returns the SHA-256 hex digest of the module recorded at installation or None
+		"""
+		return self._sha256
+		
 	def toElementTree(self, details):
 		"""
 		Return an Element node with the XML rappresentation of this module
@@ -338,6 +869,205 @@ class Module(object):
 		return self._name_and_extension.endswith(".py")
 		
 
+class ModuleManifest(object):
+	"""
+	Metadata of the modules stored in a directory: version, blocking flag, timeout, alias and checksum.
+	
+	The metadata are stored in a single ini file per directory with a section for each module file name.
+	Manifests are cached and read again only when the directory or the manifest file change.
+	Legacy .version and .blocking files found in the directory are merged into the manifest as it is 
+	read; `migrate` stores them in the manifest file and removes them. Reading never writes.
+	"""
+	
+	DEFAULTS = {
+		'version': 0,
+		'blocking': False,
+		'timeout': None,
+		'alias': None,
+		'sha256': None,
+	}
+	
+	# directory -> (stamp, manifest)
+	_cache = {}
+	
+	def __init__(self, directory):
+		self._directory = directory
+		self._entries = {}
+		
+	@staticmethod
+	def load(directory):
+		"""
+		Return the manifest of the directory
+		"""
+		stamp = ModuleManifest._stamp(directory)
+		cached = ModuleManifest._cache.get(directory)
+		if cached != None and stamp != None and cached[0] == stamp:
+			return cached[1]
+		m = ModuleManifest(directory)
+		m._read()
+		m._mergeLegacy()
+		ModuleManifest._cache[directory] = (ModuleManifest._stamp(directory), m)
+		return m
+		
+	@staticmethod
+	def migrate(directory):
+		"""
+		Store the legacy .version and .blocking files of the directory in its manifest, with the 
+		checksums of the modules, and remove them. Done when the service starts and before a module 
+		is installed, never by a lookup. Returns True if there were legacy files.
+		"""
+		m = ModuleManifest(directory)
+		m._read()
+		legacy = m._mergeLegacy()
+		if not legacy: return False
+		for name, e in m._entries.items():
+			p = os.path.join(directory, name)
+			if e['sha256'] == None and os.path.isfile(p):
+				try:
+					e['sha256'] = fileSHA256(p)
+				except IOError:
+					pass
+		try:
+			beforeFileUpdate()
+			try:
+				m.save()
+				for f in legacy:
+					os.remove(f)
+			finally:
+				afterFileUpdate()
+		except (IOError, OSError, subprocess.CalledProcessError):
+			# read only installation: the lookups keep merging the legacy files
+			pass
+		return True
+		
+	@staticmethod
+	def _stamp(directory):
+		"""
+		Return a value that changes when files are added to or removed from the directory or the manifest is written
+		"""
+		try:
+			d = os.stat(directory).st_mtime
+		except OSError:
+			return None
+		try:
+			st = os.stat(os.path.join(directory, MANIFEST_FILE))
+			return (d, st.st_mtime, st.st_size)
+		except OSError:
+			return (d, None, None)
+		
+	def path(self):
+		return os.path.join(self._directory, MANIFEST_FILE)
+		
+	def get(self, name):
+		"""
+		Return a dictionary with the metadata of the module file name (defaults if not listed)
+		"""
+		e = dict(ModuleManifest.DEFAULTS)
+		e.update(self._entries.get(name, {}))
+		return e
+		
+	def names(self):
+		return self._entries.keys()
+		
+	def nameForAlias(self, alias):
+		"""
+		Return the file name of the module with alias or None
+		"""
+		for name, e in self._entries.items():
+			if e['alias'] == alias: return name
+		return None
+		
+	def update(self, name, **values):
+		"""
+		Set metadata of the module file name, call `save` to store them
+		"""
+		for k in values.keys():
+			assert k in ModuleManifest.DEFAULTS, "Unknown module property: %r" % k
+		self._entries.setdefault(name, dict(ModuleManifest.DEFAULTS)).update(values)
+		
+	def remove(self, name):
+		"""
+		Remove the module file name from the manifest, call `save` to store it. Returns False if not listed.
+		"""
+		if name not in self._entries: return False
+		del self._entries[name]
+		return True
+		
+	def _read(self):
+		ini = RawConfigParser()
+		try:
+			ini.read([self.path()])
+		except ParsingError:
+			# keep going with the defaults rather than hiding every module
+			pass
+		for name in ini.sections():
+			e = dict(ModuleManifest.DEFAULTS)
+			for k, v in ini.items(name):
+				if k == 'version':
+					try:
+						e[k] = float(v)
+					except ValueError:
+						pass
+				elif k == 'blocking':
+					e[k] = v.strip().lower() in ('1', 'yes', 'true', 'on')
+				elif k == 'timeout':
+					try:
+						e[k] = int(v)
+					except ValueError:
+						pass
+				elif k in ('alias', 'sha256') and v:
+					e[k] = v
+			self._entries[name] = e
+			
+	def _mergeLegacy(self):
+		"""
+		Merge the legacy .version and .blocking files into the manifest in memory, return their paths
+		"""
+		legacy = glob.glob(os.path.join(self._directory, "*" + EXTENSION_VERSION)) + \
+			glob.glob(os.path.join(self._directory, "*" + EXTENSION_BLOCKING))
+		for f in legacy:
+			name, ext = os.path.splitext(os.path.basename(f))
+			if ext == EXTENSION_VERSION:
+				try:
+					self.update(name, version=float(open(f).readline().split("\n")[0]))
+				except (IOError, ValueError):
+					self.update(name)
+			else:
+				self.update(name, blocking=True)
+		return legacy
+		
+	def toString(self):
+		lines = []
+		for name in sorted(self._entries.keys()):
+			e = self._entries[name]
+			lines.append("[%s]" % name)
+			if e['version']:
+				lines.append("version = %r" % e['version'])
+			lines.append("blocking = %s" % repr(e['blocking']).lower())
+			for k in ('timeout', 'alias', 'sha256'):
+				if e[k] != None:
+					lines.append("%s = %s" % (k, e[k]))
+			lines.append("")
+		return "\n".join(lines)
+		
+	def save(self):
+		"""
+		Write the manifest replacing the old one in a single step
+		"""
+		fd, tmp = tempfile.mkstemp(prefix='.modules-', suffix='.tmp', dir=self._directory)
+		try:
+			try:
+				os.write(fd, self.toString())
+				os.fsync(fd)
+			finally:
+				os.close(fd)
+			_replaceFile(tmp, self.path())
+		except:
+			if os.path.exists(tmp): os.remove(tmp)
+			ModuleManifest._cache.pop(self._directory, None)
+			raise
+		ModuleManifest._cache[self._directory] = (ModuleManifest._stamp(self._directory), self)
+	
 def moduleFromPathAndType(path, type):
 	"""
 	Return a Module from the path and type requested.
@@ -351,12 +1081,9 @@ def moduleFromPathAndType(path, type):
 	if os.path.isfile(path) and ext in MODULE_VALID_EXTENSIONS:
 		full_path = path
 		_, upgradable, _ = MODULE_TYPES[type]
-		blocking = os.path.exists(path+EXTENSION_BLOCKING)
-		try:
-			version = float(open(path+EXTENSION_VERSION).readline().split("\n")[0])
-		except (IOError, ValueError):
-			version = 0
-		m = Module(type, full_path, version, upgradable, blocking)
+		directory, name = os.path.split(path)
+		e = ModuleManifest.load(directory).get(name)
+		m = Module(type, full_path, e['version'], upgradable, e['blocking'], alias=e['alias'], timeout=e['timeout'], sha256=e['sha256'])
 	return m
 	
 def moduleFromNameAndType(name, type):
@@ -369,9 +1096,8 @@ def moduleFromNameAndType(name, type):
 	# inverse alias
 	ia = {}
 	for k, v in Module.ALIAS_NAME.items(): ia[v] = k
-	name = ia.get(name, name)
 	for dir in dirs:
-		file = os.path.join(dir, name)
+		file = os.path.join(dir, ModuleManifest.load(dir).nameForAlias(name) or ia.get(name, name))
 		found = moduleFromPathAndType(file, type)
 		if found:
 			# the first module found hides any other module (internal then plugins then customs)
@@ -390,12 +1116,15 @@ def browseModules(types=[MODULE_INTERNALS, MODULE_PLUGINS, MODULE_CUSTOMS]):
 	# add restart
 	for type, upgradable, dirs in type_groups:
 		for dir in dirs:
-			for ext in MODULE_VALID_EXTENSIONS:
-				s = "%s/*%s" % (dir, ext)
-				for file in glob.glob(s):
-					found = moduleFromPathAndType(file, type)
-					if found:
-						modules[type][found.aliasName()] = found
+			try:
+				names = sorted(os.listdir(dir))
+			except OSError:
+				continue
+			for name in names:
+				if name.startswith('.'): continue
+				found = moduleFromPathAndType(os.path.join(dir, name), type)
+				if found:
+					modules[type][found.aliasName()] = found
 	return modules
 
 def searchModule(name):
@@ -431,9 +1160,76 @@ def runExternal(cmd_line, shell=False, close_handles=False):
 			env=e)
 	return process
 
-def copyModule(source, target):
-	shutil.copy(source, target)
-	os.chmod(target, 0755)
+def _stageFile(staging, name, source):
+	"""
+	Copy source in the staging directory and fsync it
+	"""
+	path = os.path.join(staging, name)
+	dst = open(path, 'wb')
+	try:
+		src = open(source, 'rb')
+		try:
+			shutil.copyfileobj(src, dst)
+		finally:
+			src.close()
+		dst.flush()
+		os.fsync(dst.fileno())
+	finally:
+		dst.close()
+	return path
+
+def _replaceFile(source, target):
+	if IS_WINDOWS and os.path.exists(target):
+		# rename does not overwrite on windows
+		os.remove(target)
+	os.rename(source, target)
+
+def _fsyncDirectory(path):
+	if IS_WINDOWS: return
+	fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+def copyModule(source, target, version=None, blocking=None):
+	"""
+	Install source as the module target and record it in the directory manifest.
+	
+	The module is written and fsync-ed in a staging directory next to target, then the manifest 
+	and the module are renamed over the old ones, so a concurrent lookup never finds a missing or 
+	half written module.
+	
+	@param version: module version or None to leave it untouched
+	@param blocking: module blocking flag or None to leave it untouched
+	"""
+	directory, name = os.path.split(target)
+	# the legacy files would otherwise still override the metadata stored now
+	ModuleManifest.migrate(directory)
+	staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+	try:
+		module = _stageFile(staging, name, source)
+		os.chmod(module, 0755)
+		values = {'sha256': fileSHA256(module)}
+		if version != None: values['version'] = version
+		if blocking != None: values['blocking'] = blocking
+		manifest = ModuleManifest.load(directory)
+		manifest.update(name, **values)
+		manifest.save()
+		_replaceFile(module, target)
+		_fsyncDirectory(directory)
+	finally:
+		shutil.rmtree(staging, ignore_errors=True)
+
+def removeModule(path):
+	"""
+	Remove the module file and its entry from the directory manifest
+	"""
+	directory, name = os.path.split(path)
+	manifest = ModuleManifest.load(directory)
+	os.remove(path)
+	if manifest.remove(name):
+		manifest.save()
 
 # copied from Python 2.7 subprocess.py
 def subprocessCheckOutput(*popenargs, **kwargs):
@@ -464,11 +1260,436 @@ def subprocessCheckCall(*popenargs, **kwargs):
 		raise subprocess.CalledProcessError(retcode, cmd)
 	return 0
 
+class DownloadError(IOError):
+	"""
+	Raised when a file can not be downloaded or its checksum does not match
+	"""
+	pass
+
+def downloadPath(url):
+	"""
+	Return the path used to download url when no target is specified.
+	
+	The path does not change between calls so an interrupted download is resumed by the next attempt.
+	It is in the artifact cache directory, that only the agent user can write: a predictable name in 
+	the temporary directory could be planted by any local user.
+	"""
+	return os.path.join(getArtifactCacheDirectory(), ArtifactCache.DOWNLOAD_PREFIX + hashlib.sha1(url).hexdigest())
+
+def fileSHA256(path):
+	"""
+	Return the hex SHA-256 digest of the file content
+	"""
+	h = hashlib.sha256()
+	f = open(path, 'rb')
+	try:
+		while 1:
+			data = f.read(DOWNLOAD_CHUNK_SIZE)
+			if not data: break
+			h.update(data)
+	finally:
+		f.close()
+	return h.hexdigest()
+	
+def checkSHA256(path, sha256):
+	"""
+	Raise DownloadError if sha256 is not None and does not match the file content
+	"""
+	if sha256 == None: return
+	digest = fileSHA256(path)
+	if digest != sha256.lower():
+		raise DownloadError("SHA-256 mismatch for %s: expected %s, got %s" % (path, sha256.lower(), digest))
+
+def _isOwnPartial(st):
+	"""
+	Return True if the os.stat result is the one of a partial download that can be resumed: a regular
+	file owned by the current user with mode 0600
+	"""
+	import stat
+	if not stat.S_ISREG(st.st_mode):
+		return False
+	if not hasattr(os, 'getuid'):
+		# windows: no owner nor unix mode, the directory is not shared
+		return True
+	return st.st_uid == os.getuid() and stat.S_IMODE(st.st_mode) == 0600
+	
+def _partialOffset(partial, logger):
+	"""
+	Return the size of the partial download to resume, 0 when there is none. A partial file that
+	can not be resumed (see `_isOwnPartial`, ie a symbolic link) is removed: the download starts over.
+	"""
+	try:
+		st = os.lstat(partial)
+	except OSError:
+		return 0
+	if _isOwnPartial(st):
+		return st.st_size
+	if logger: logger.warning("Removing %s, not a private regular file" % partial)
+	os.remove(partial)
+	return 0
+	
+def _openPartial(partial, offset):
+	"""
+	Open the partial download for writing: in append mode when offset is not 0, otherwise a new 
+	file created with O_EXCL and mode 0600. Symbolic links are never followed.
+	"""
+	flags = os.O_WRONLY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+	if offset:
+		fd = os.open(partial, flags | os.O_APPEND)
+		if not _isOwnPartial(os.fstat(fd)) or os.fstat(fd).st_size != offset:
+			os.close(fd)
+			raise DownloadError("%s changed while resuming the download" % partial)
+		return os.fdopen(fd, 'ab')
+	return createPrivateFile(partial)
+	
+def createPrivateFile(path):
+	"""
+	Return a new file, opened for writing, created with O_EXCL and mode 0600 after removing path.
+	Symbolic links are never followed.
+	"""
+	flags = os.O_WRONLY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+	if os.path.lexists(path):
+		os.remove(path)
+	return os.fdopen(os.open(path, flags | os.O_CREAT | os.O_EXCL, 0600), 'wb')
+	
+def _lockFile(path):
+	"""
+	Open path, creating it with mode 0600, and take an exclusive lock on it, waiting while another 
+	process holds it. Closing the returned file releases the lock.
+	"""
+	flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+	f = os.fdopen(os.open(path, flags, 0600), 'r+b')
+	try:
+		if IS_WINDOWS:
+			import msvcrt
+			while 1:
+				try:
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except IOError:
+					pass	# LK_LOCK gives up after 10 seconds, keep waiting
+		else:
+			import fcntl
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+	except:
+		f.close()
+		raise
+	return f
+	
+def _downloadChunks(url, partial, timeout, logger):
+	"""
+	Append to the partial file the bytes of url still missing and return the response headers
+	"""
+	import urllib2
+	offset = _partialOffset(partial, logger)
+	request = urllib2.Request(url)
+	if offset:
+		request.add_header('Range', 'bytes=%d-' % offset)
+	try:
+		response = urllib2.urlopen(request, timeout=timeout)
+	except urllib2.HTTPError, he:
+		if he.code == 416:
+			# the partial file does not match the remote one anymore
+			os.remove(partial)
+		raise
+	try:
+		if offset and response.getcode() != 206:
+			if logger: logger.info("Server does not support resume, restarting download")
+			offset = 0
+		headers = response.info()
+		total = headers.get('Content-Length')
+		if total != None:
+			total = offset + int(total)
+		if logger and offset: logger.info("Resuming download at byte %d" % offset)
+		
+		done = offset
+		last_log = time.time()
+		out = _openPartial(partial, offset)
+		try:
+			while 1:
+				data = response.read(DOWNLOAD_CHUNK_SIZE)
+				if not data: break
+				out.write(data)
+				done += len(data)
+				if logger and time.time() - last_log >= DOWNLOAD_PROGRESS_INTERVAL:
+					last_log = time.time()
+					logger.info("Downloaded %d/%s bytes" % (done, total or "?"))
+		finally:
+			out.close()
+	finally:
+		response.close()
+	if total != None and done < total:
+		raise DownloadError("Connection closed after %d of %d bytes" % (done, total))
+	if logger: logger.info("Downloaded %d bytes" % done)
+	return headers
+
+def downloadFile(url, target=None, sha256=None, timeout=DOWNLOAD_TIMEOUT, retries=DOWNLOAD_RETRIES, logger=None):
+	"""
+	Download url and return a tuple (path, headers).
+	
+	Data is streamed into a partial file that is resumed with an HTTP Range request when the 
+	transfer is interrupted, both by the retries of this call and by a later call with the same target.
+	Concurrent calls with the same target are serialized by a lock file next to it.
+	Raises DownloadError if the download fails or the file does not match the SHA-256 hex digest.
+	
+	@param target: destination path, default to `downloadPath`
+	@param sha256: expected SHA-256 hex digest or None to skip the verification
+	@param timeout: socket timeout in seconds
+	@param retries: number of times an interrupted download is resumed
+	@param logger: logging.Logger used to report the progress or None
+	"""
+	# imported here, most modules never download
+	import urllib2, httplib, socket
+	if target == None:
+		target = downloadPath(url)
+		if not os.path.isdir(os.path.dirname(target)):
+			os.makedirs(os.path.dirname(target), 0700)
+	lock = _lockFile(target + EXTENSION_LOCK)
+	try:
+		partial = target + EXTENSION_PARTIAL
+		attempt = 0
+		while 1:
+			try:
+				headers = _downloadChunks(url, partial, timeout, logger)
+				break
+			except (IOError, socket.error, httplib.HTTPException), e:
+				# client errors (ie 404) will not be fixed by trying again
+				if isinstance(e, urllib2.HTTPError) and e.code < 500 and e.code != 416:
+					raise DownloadError("%s" % e)
+				attempt += 1
+				if attempt > retries:
+					raise DownloadError("Download failed after %d attempts: %s" % (attempt, e))
+				if logger: logger.warning("Download interrupted (%s), retrying" % e)
+				time.sleep(DOWNLOAD_RETRY_DELAY)
+		try:
+			checkSHA256(partial, sha256)
+		except DownloadError:
+			os.remove(partial)
+			raise
+		if os.path.exists(target):
+			os.remove(target)
+		os.rename(partial, target)
+		return target, headers
+	finally:
+		lock.close()
+
+class ArtifactCache(object):
+	"""
+	Content addressed cache of downloaded files.
+	
+	Every artifact is stored under its SHA-256 hex digest; for each URL the cache remembers the digest 
+	and ETag of its last download so it can be revalidated with a conditional request. 
+	When the cache exceeds its size the least recently used artifacts are evicted.
+	"""
+	
+	URL_PREFIX = "url-"
+	DOWNLOAD_PREFIX = "download-"
+	
+	def __init__(self, path=None, max_size=None):
+		if path == None:
+			path = getArtifactCacheDirectory()
+		if max_size == None:
+			max_size = int(getConfigurationFromINI()['PLUGINS']['cache_size'])
+		self._path = path
+		self._max_size = max_size
+		
+	def path(self, sha256):
+		"""
+		Return the path of the artifact with the requested digest (it may not exist).
+		Raises ValueError if sha256 is not a SHA-256 hex digest, so that it can not name a file outside the cache.
+		"""
+		if not self._isArtifact(sha256):
+			raise ValueError("invalid SHA-256 digest: %r" % sha256)
+		return os.path.join(self._path, sha256.lower())
+		
+	def get(self, sha256):
+		"""
+		Return the path of the artifact or None if it is not cached, marking it as recently used
+		"""
+		if not self._isArtifact(sha256): return None
+		p = self.path(sha256)
+		if not os.path.isfile(p): return None
+		os.utime(p, None)
+		return p
+		
+	def _urlFile(self, url):
+		return os.path.join(self._path, ArtifactCache.URL_PREFIX + hashlib.sha1(url).hexdigest())
+		
+	def _urlEntry(self, url):
+		"""
+		Return a tuple (etag, sha256) for the last download of url or (None, None)
+		"""
+		try:
+			lines = open(self._urlFile(url)).read().split("\n")
+		except IOError:
+			return None, None
+		if len(lines) < 3 or lines[0] != url:
+			return None, None
+		return lines[1], lines[2]
+		
+	def _urlEntries(self):
+		"""
+		Return a list of tuples (url file, url, sha256)
+		"""
+		entries = []
+		for f in glob.glob(os.path.join(self._path, ArtifactCache.URL_PREFIX + "*")):
+			try:
+				lines = open(f).read().split("\n")
+			except IOError:
+				continue
+			if len(lines) >= 3:
+				entries.append((f, lines[0], lines[2]))
+		return entries
+		
+	def _isArtifact(self, name):
+		return isinstance(name, basestring) and len(name) == 64 and not False in [k in string.hexdigits for k in name]
+		
+	def add(self, path, url=None, etag=None):
+		"""
+		Move the file into the cache and return its SHA-256 hex digest.
+		
+		@param url: URL the file was downloaded from
+		@param etag: ETag returned by the server for url
+		"""
+		if not os.path.isdir(self._path):
+			os.makedirs(self._path, 0700)
+		sha256 = fileSHA256(path)
+		target = self.path(sha256)
+		if os.path.exists(target):
+			os.remove(path)
+		else:
+			shutil.move(path, target)
+		os.utime(target, None)
+		if url != None:
+			open(self._urlFile(url), "w").write("%s\n%s\n%s\n" % (url, etag or "", sha256))
+		self.evict(keep=sha256)
+		return sha256
+		
+	def entries(self):
+		"""
+		Return a list of dictionaries describing the cached artifacts, most recently used first
+		"""
+		if not os.path.isdir(self._path): return []
+		urls = {}
+		for _, url, sha256 in self._urlEntries():
+			urls.setdefault(sha256, []).append(url)
+		entries = []
+		for name in os.listdir(self._path):
+			if not self._isArtifact(name): continue
+			st = os.stat(os.path.join(self._path, name))
+			entries.append({
+				'sha256': name,
+				'size': st.st_size,
+				'last_used': st.st_mtime,
+				'urls': urls.get(name, []),
+			})
+		entries.sort(key=lambda e: e['last_used'], reverse=True)
+		return entries
+		
+	def size(self):
+		"""
+		Return the size in bytes of all the cached artifacts
+		"""
+		return sum([e['size'] for e in self.entries()])
+		
+	def remove(self, sha256):
+		"""
+		Remove an artifact and the URLs referring to it. Returns False if it was not cached, raises
+		ValueError if sha256 is not a SHA-256 hex digest.
+		"""
+		p = self.path(sha256)
+		sha256 = sha256.lower()
+		for f, _, s in self._urlEntries():
+			if s == sha256: os.remove(f)
+		try:
+			os.remove(p)
+		except OSError:
+			return False
+		return True
+		
+	def evict(self, keep=None):
+		"""
+		Remove the least recently used artifacts until the cache fits its size
+		
+		@param keep: digest of an artifact that must not be removed
+		"""
+		entries = self.entries()
+		total = sum([e['size'] for e in entries])
+		while entries and total > self._max_size:
+			e = entries.pop()
+			if e['sha256'] == keep: continue
+			self.remove(e['sha256'])
+			total -= e['size']
+			
+	def purge(self):
+		"""
+		Remove all the artifacts and any interrupted download
+		"""
+		for e in self.entries():
+			self.remove(e['sha256'])
+		for f in glob.glob(os.path.join(self._path, ArtifactCache.DOWNLOAD_PREFIX + "*")):
+			os.remove(f)
+			
+	def _isNotModified(self, url, etag, timeout):
+		"""
+		Return True if the server still has the ETag etag for url. The conditional request is a HEAD, 
+		the body is only transferred by the download that follows when it changed.
+		"""
+		import urllib2, httplib, socket
+		request = urllib2.Request(url)
+		request.get_method = lambda: 'HEAD'
+		request.add_header('If-None-Match', etag)
+		try:
+			response = urllib2.urlopen(request, timeout=timeout)
+		except urllib2.HTTPError, he:
+			return he.code == 304
+		except (IOError, socket.error, httplib.HTTPException):
+			return False
+		try:
+			# a server ignoring If-None-Match still tells the current ETag
+			return response.info().get('ETag') == etag
+		finally:
+			response.close()
+		
+	def download(self, url, sha256=None, timeout=DOWNLOAD_TIMEOUT, logger=None):
+		"""
+		Return a tuple (path, headers) with the cached copy of url, downloading it with 
+		`downloadFile` if it is not cached or it changed on the server. 
+		Headers are None when the artifact is found by its digest without contacting the server.
+		
+		@param sha256: expected SHA-256 hex digest or None
+		"""
+		if sha256 != None:
+			p = self.get(sha256)
+			if p:
+				if logger: logger.info("Found %s in cache" % sha256)
+				return p, None
+		etag, cached = self._urlEntry(url)
+		if etag and self.get(cached) and (sha256 == None or cached == sha256.lower()):
+			if self._isNotModified(url, etag, timeout):
+				if logger: logger.info("Using cached copy of %s" % url)
+				return self.path(cached), None
+		if not os.path.isdir(self._path):
+			os.makedirs(self._path, 0700)
+		target = os.path.join(self._path, ArtifactCache.DOWNLOAD_PREFIX + hashlib.sha1(url).hexdigest())
+		path, headers = downloadFile(url, target, sha256, timeout, logger=logger)
+		return self.path(self.add(path, url, headers.get('ETag'))), headers
+
+# Nesting level of beforeFileUpdate calls: only the outermost pair remounts the file system
+_file_update_level = 0
+
 def beforeFileUpdate():
+	global _file_update_level
+	_file_update_level += 1
+	if _file_update_level > 1: return
 	if sys.platform.startswith('freebsd') and os.path.exists('/etc/version.freenas'):
 		subprocessCheckCall(['mount', '-uw', '/'])
 
 def afterFileUpdate():
+	global _file_update_level
+	_file_update_level -= 1
+	if _file_update_level > 0: return
+	_file_update_level = 0
 	if sys.platform.startswith('freebsd') and os.path.exists('/etc/version.freenas'):
 		subprocessCheckCall(['mount', '-ur', '/'])
 
@@ -513,6 +1734,7 @@ CENTOS_NETWORK_SCRIPTS = '/etc/sysconfig/network-scripts'
 ENDIAN_BRIDGE_CONFIG = '/var/efw/ethernet'
 ENDIAN_UPLINK_CONFIG = '/var/efw/uplinks/main'
 FREENAS_DB = '/data/freenas-v1.db'
+PFSENSE_CONFIG = '/conf/config.xml'
 
 def isWindows(): return sys.platform == 'win32'
 def isLinux(): return sys.platform == 'linux2'
@@ -522,7 +1744,7 @@ def isOpenFiler(): return isLinux() and os.path.isdir('/etc/conary')
 def isDebian(): return isLinux() and os.path.isfile(DEBIAN_INTERFACES_FILE)
 def isUbuntu(): return isLinux() and os.path.isdir('/etc/init')
 def isEndian(): return isLinux() and os.path.isdir('/etc/endian')
-def isPfSense(): return isBsd() and os.path.isfile('/conf/config.xml')
+def isPfSense(): return isBsd() and os.path.isfile(PFSENSE_CONFIG)
 def isFreeNAS(): return isBsd() and os.path.isfile(FREENAS_DB)
 
 def getRestartGUID(remove=False):
@@ -545,6 +1767,16 @@ def getUpdateSoftwareLOGFileName():
 	f = os.path.join(getRoot(), _UPDATESOFTWARE_LOG_FILE)
 	return f
 	
+def getWireTraceFileName():
+	return os.path.join(getRoot(), _WIRETRACE_FILE)
+	
+def getMetricsFileName():
+	"""
+	Return the path of the metrics file, in the plugins root as a fixed name in the temporary 
+	directory could be planted or replaced by any local user
+	"""
+	return os.path.join(getRoot(), _METRICS_FILE)
+	
 def getUpdateSoftwareLOG(remove=False):
 	"""
 	Return the LOG of latest updateSoftware command (if present)